@@ -0,0 +1,360 @@
+import asyncio
+import json
+import random
+import signal
+import threading
+import time
+from functools import partial
+
+import aiohttp
+import redis
+import redis.asyncio as aioredis
+
+import endpoint_health
+import idempotency
+import job_codec
+import profile_store
+import metrics
+import response_cache
+
+from prompt import (prompt_for_job, build_chat_payload, extract_reply, clean_model_name_for, conversation_for,
+                    save_conversation, subprompts, compaction_from_args)
+
+# Asyncio worker engine: instead of one blocking request per thread, each port gets a small
+# prefetch buffer fed from its Redis queue and `concurrency` tasks that keep that many requests
+# in flight, so a vLLM server can batch them continuously.
+#
+# On Ctrl+C or SIGTERM the fetchers stop taking jobs from Redis, the jobs still in the prefetch
+# buffer go back to the head of their queues unstarted, and the requests in flight get up to
+# --drain-timeout seconds to finish (a second Ctrl+C stops waiting); the ones that don't are
+# cancelled and their jobs returned to the head of their queues as well.
+
+
+async def call_model_api_async(session, prompt, port, model_name):
+    """
+    Async counterpart of prompt.request_completion sharing the same payload, reply handling and
+    endpoint health; returns (reply or None, clean model name, endpoint_failed)
+    """
+    base_url = f"http://localhost:{port}"
+    url = f"{base_url}/v1/chat/completions"
+    clean_model_name = clean_model_name_for(model_name)
+    health = endpoint_health.get_health(base_url)
+    payload = build_chat_payload(prompt, model_name)
+    endpoint = f"localhost:{port}"
+
+    permit = health.allow_request()
+    while not permit and health.probe_pending():
+        # Another request is probing the endpoint: follow its outcome
+        await asyncio.sleep(0.05)
+        permit = health.allow_request()
+    if not permit:
+        # The breaker just opened (or the probe failed)
+        print(f"Endpoint {base_url} is paused by its circuit breaker")
+        return None, clean_model_name, True
+
+    metrics.IN_FLIGHT.inc(endpoint=endpoint)
+    started = time.monotonic()
+    try:
+        async with session.post(url, json=payload) as response:
+            response.raise_for_status()
+            result = await response.json()
+        health.record_success()
+        metrics.record_request(endpoint, model_name, time.monotonic() - started, "ok", result)
+        return extract_reply(result), clean_model_name, False
+    except (aiohttp.ContentTypeError, ValueError) as e:
+        # A 200 whose body isn't JSON (a proxy error page, a truncated reply) is the endpoint's
+        # fault, not the job's: count it against the endpoint so the job is requeued
+        print(f"Invalid response from model API on port {port}: {e}")
+        metrics.record_request(endpoint, model_name, time.monotonic() - started, "invalid")
+        health.record_failure()
+        return None, clean_model_name, True
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error calling model API on port {port}: {e}")
+        status_code = e.status if isinstance(e, aiohttp.ClientResponseError) else None
+        metrics.record_request(endpoint, model_name, time.monotonic() - started,
+                               "error" if status_code is None else str(status_code))
+        if endpoint_health.is_endpoint_failure(status_code):
+            health.record_failure()
+            return None, clean_model_name, True
+        health.record_success()
+        return None, clean_model_name, False
+    except BaseException:
+        # Includes cancellation: a probe that never got an answer must not hold the slot
+        if permit == endpoint_health.PROBE:
+            health.cancel_probe()
+        raise
+    finally:
+        metrics.IN_FLIGHT.dec(endpoint=endpoint)
+
+
+async def generate_reply_async(session, prompt, port, model_name, cache=None, validator=None):
+    """
+    Async counterpart of prompt.generate_reply; returns (reply or None, clean model name, endpoint_failed)
+    """
+    clean_model_name = clean_model_name_for(model_name)
+
+    if cache is not None:
+        request_key = response_cache.cache_key(build_chat_payload(prompt, model_name))
+        reply = await asyncio.to_thread(cache.get, request_key)
+        if reply is not None and validator is not None:
+            reply = validator.check(clean_model_name, reply)
+        if reply is not None:
+            print(f"Using cached reply from {model_name}")
+            return reply, clean_model_name, False
+
+    attempts = 1 + (validator.retries if validator is not None else 0)
+    for attempt in range(1, attempts + 1):
+        reply, clean_model_name, endpoint_failed = await call_model_api_async(session, prompt, port, model_name)
+        if not reply:
+            return None, clean_model_name, endpoint_failed
+        if validator is not None:
+            reply = validator.check(clean_model_name, reply)
+            if reply is None:
+                if attempt < attempts:
+                    print(f"Asking {model_name} again ({attempt}/{attempts - 1} retries)")
+                continue
+        if cache is not None:
+            await asyncio.to_thread(cache.put, request_key, model_name, reply)
+        return reply, clean_model_name, False
+    return None, clean_model_name, False
+
+
+async def fetch_jobs(redis_client, queue_name, jobs):
+    """
+    Keep the bounded prefetch buffer topped up from the Redis queue
+    """
+    while True:
+        try:
+            job_data = await redis_client.brpop(queue_name, timeout=1)
+            if job_data is None:
+                continue
+            _, message = job_data
+            metrics.JOBS_DEQUEUED.inc(queue=queue_name)
+            try:
+                # Blocks while the buffer is full, so at most `prefetch` jobs sit outside Redis
+                await jobs.put(message)
+            except asyncio.CancelledError:
+                # Stopped while holding a job that didn't fit in the buffer: it goes back first in line
+                await redis_client.rpush(queue_name, message)
+                raise
+        except redis.exceptions.RedisError as e:
+            print(f"Redis error fetching from {queue_name}: {e}")
+            await asyncio.sleep(5)
+
+
+async def run_jobs(jobs, session, redis_client, queue_name, port, model_name, output_dir, counter,
+                   compaction=None, layout="persona_first", sink=None, completed=None, cache=None,
+                   validator=None, persona_seed=0, decoder=None):
+    """
+    Process jobs from the prefetch buffer one at a time; several of these run per port
+    """
+    health = endpoint_health.get_health(f"http://localhost:{port}")
+    decoder = decoder or job_codec.JobDecoder()
+
+    while True:
+        # Stop pulling from the buffer while the endpoint's circuit breaker is open
+        while not health.is_available():
+            await asyncio.sleep(min(max(health.wait_time(), 0.1), 1))
+
+        message = await jobs.get()
+        try:
+            job_payload = decoder.decode(message, queue_name.rsplit(":queue:", 1)[0])
+            job_id = job_payload.get('job_id')
+
+            print(f"Processing job {job_id} from {queue_name} on port {port}")
+
+            # Same variant selection and output keys as the threads engine
+            if job_id is not None:
+                variant = idempotency.variant_for_job(job_id, len(subprompts), persona_seed)
+                key = idempotency.output_key(job_id, clean_model_name_for(model_name), variant)
+            else:
+                variant = random.randrange(len(subprompts))
+                key = None
+            selected_subprompt = subprompts[variant]
+
+            if completed is not None and key is not None and await asyncio.to_thread(completed.contains, key):
+                print(f"Skipping job {job_id}: {key} already completed")
+                continue
+
+            prompt = prompt_for_job(selected_subprompt, job_payload, compaction, layout)
+
+            response, model_name_clean, endpoint_failed = await generate_reply_async(session, prompt, port,
+                                                                                      model_name, cache, validator)
+            job_labels = dict(queue=queue_name, endpoint=f"localhost:{port}", model=model_name)
+
+            if endpoint_failed:
+                # Not the job's fault: return it to the head of the queue
+                await redis_client.rpush(queue_name, message)
+                message = None
+                print(f"Requeued job {job_id} after endpoint failure on port {port}")
+                metrics.JOBS_FAILED.inc(reason="endpoint", **job_labels)
+                await asyncio.sleep(health.backoff_delay())
+            elif response:
+                conversation_data = conversation_for(prompt, response)
+                mark_completed = None
+                if completed is not None and key is not None:
+                    mark_completed = partial(completed.add, key)
+                if sink is not None:
+                    record = dict(id=key, **conversation_data) if key is not None else conversation_data
+                    saved = await asyncio.to_thread(sink.write, record, mark_completed)
+                else:
+                    counter[0] += 1
+                    saved = await asyncio.to_thread(save_conversation, model_name_clean, counter[0],
+                                                    conversation_data, output_dir, key)
+                    if saved and mark_completed is not None:
+                        await asyncio.to_thread(mark_completed)
+                if saved:
+                    print(f"Successfully processed job {job_id}")
+                    metrics.JOBS_COMPLETED.inc(**job_labels)
+                else:
+                    metrics.JOBS_FAILED.inc(reason="no_output", **job_labels)
+            else:
+                print(f"Failed to get response for job {job_id}")
+                metrics.JOBS_FAILED.inc(reason="no_output", **job_labels)
+        except (json.JSONDecodeError, job_codec.JobDecodeError) as e:
+            print(f"Job decode error in queue processor for port {port}: {e}")
+        except asyncio.CancelledError:
+            # The shutdown's drain timeout ran out: hand the unfinished job back
+            if message is not None:
+                await redis_client.rpush(queue_name, message)
+                print(f"Returned an unfinished job to the head of {queue_name}")
+            raise
+        except Exception as e:
+            print(f"Unexpected error in queue processor for port {port}: {e}")
+        finally:
+            jobs.task_done()
+
+
+async def return_buffered(redis_client, queue_name, jobs):
+    """
+    Put the jobs waiting in a prefetch buffer back at the head of their queue, oldest first in line
+    """
+    buffered = []
+    while not jobs.empty():
+        buffered.append(jobs.get_nowait())
+        jobs.task_done()
+    if buffered:
+        # BRPOP takes from the right: the last one pushed is the next one taken
+        await redis_client.rpush(queue_name, *reversed(buffered))
+        print(f"Returned {len(buffered)} prefetched jobs to {queue_name}")
+    return len(buffered)
+
+
+async def process_queue_async(queue_id, redis_client, session, port, model_name, output_dir="../output",
+                              queue_prefix="profiles", concurrency=8, prefetch=None, compaction=None,
+                              layout="persona_first", ready_timeout=0, sink=None, completed=None,
+                              cache=None, validator=None, persona_seed=0, decoder=None, stop=None,
+                              abort=None, drain_timeout=45.0):
+    """
+    Process jobs from a specific Redis queue for a specific model port with
+    `concurrency` requests in flight and at most `prefetch` jobs buffered locally.
+
+    Runs until stop (an asyncio.Event) is set, then drains: no new jobs, buffered jobs back to
+    the queue, and up to drain_timeout seconds (or until abort is set) for the jobs in flight.
+    """
+    if ready_timeout > 0:
+        await asyncio.to_thread(endpoint_health.wait_until_ready, f"http://localhost:{port}", model_name,
+                                ready_timeout)
+
+    queue_name = f"{queue_prefix}:queue:{queue_id}"
+    jobs = asyncio.Queue(maxsize=prefetch or concurrency)
+    counter = [0]
+
+    print(f"Starting async queue processor for {queue_name} -> localhost:{port} (concurrency: {concurrency})")
+
+    fetcher = asyncio.create_task(fetch_jobs(redis_client, queue_name, jobs))
+    runners = [asyncio.create_task(run_jobs(jobs, session, redis_client, queue_name, port, model_name,
+                                            output_dir, counter, compaction, layout, sink,
+                                            completed, cache, validator, persona_seed, decoder))
+               for _ in range(concurrency)]
+    waiters = [asyncio.create_task((stop or asyncio.Event()).wait())]
+    try:
+        # The fetcher and runners only end by failing
+        done, _ = await asyncio.wait([fetcher, *runners, *waiters], return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+
+        fetcher.cancel()
+        await asyncio.gather(fetcher, return_exceptions=True)
+        await return_buffered(redis_client, queue_name, jobs)
+        waiters.append(asyncio.create_task(jobs.join()))
+        if abort is not None:
+            waiters.append(asyncio.create_task(abort.wait()))
+        await asyncio.wait(waiters[1:], timeout=drain_timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in [fetcher, *runners, *waiters]:
+            task.cancel()
+        # Cancelled runners hand their unfinished jobs back before they end
+        await asyncio.gather(*runners, return_exceptions=True)
+        # Jobs still waiting in the prefetch buffer were never started: hand them back
+        await return_buffered(redis_client, queue_name, jobs)
+
+
+async def run_workers(args, sink=None, completed=None, cache=None, validator=None):
+    """
+    Start one async queue processor per queue/port combination
+    """
+    redis_client = aioredis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db)
+    # One connection pool shared by every task; limit_per_host bounds in-flight requests per port
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=args.concurrency,
+                                     force_close=args.no_keep_alive)
+    timeout = aiohttp.ClientTimeout(sock_connect=args.connect_timeout, sock_read=args.read_timeout)
+    # Dictionary lookups are rare (once per dictionary), so they use a plain blocking client
+    decoder = job_codec.JobDecoder(redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db),
+                                   args.queue_prefix, profile_store.ProfileStores(args.profile_store_dir))
+
+    stop = asyncio.Event()
+    abort = asyncio.Event()
+
+    def request_stop():
+        if stop.is_set():
+            print("Not waiting any longer.")
+            abort.set()
+            return
+        print(f"\nShutting down queue processors: no new jobs, waiting up to {args.drain_timeout:g}s "
+              f"for the jobs in flight...")
+        stop.set()
+
+    if threading.current_thread() is threading.main_thread():
+        # supervisor.py (and the batch system) stop workers with SIGTERM: shut down as on Ctrl+C
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, request_stop)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        processors = []
+        for i in range(args.num_queues):
+            queue_id = i + args.queue_offset
+            port = args.start_port + i
+            processors.append(process_queue_async(queue_id, redis_client, session, port, args.model,
+                                                  args.output_dir, args.queue_prefix, args.concurrency,
+                                                  args.prefetch, compaction_from_args(args),
+                                                  args.prompt_layout, args.ready_timeout, sink,
+                                                  completed, cache, validator, args.persona_seed,
+                                                  decoder, stop, abort, args.drain_timeout))
+            print(f"Started processor for {args.queue_prefix}:queue:{queue_id} -> port:{port} -> {args.output_dir}")
+
+        print(f"Started {len(processors)} async queue processors. Press Ctrl+C to stop.")
+        try:
+            await asyncio.gather(*processors)
+            print("Queue processors drained.")
+        finally:
+            await redis_client.connection_pool.disconnect()
+
+
+def main(args, sink=None, completed=None, cache=None, validator=None):
+    """
+    Entry point used by prompt.main for --engine async
+    """
+    try:
+        asyncio.run(run_workers(args, sink, completed, cache, validator))
+    except KeyboardInterrupt:
+        print("\nShutting down queue processors...")
+    finally:
+        if cache is not None:
+            print(f"Response cache: {cache.stats.format()}")
+        if validator is not None:
+            print("Reply validity:")
+            validator.stats.print_stats()
+        if sink is not None:
+            sink.close()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import json
+import sys
+import timeit
+
+from dispatcher import build_job_payload
+from prompt import buildprompt, prompt_for_job, subprompts
+
+# Micro-benchmark of per-job prompt construction in the worker, from the raw Redis message to the
+# finished prompt string. Usage: python bench_prompt.py [iterations]
+
+
+def load_message(compaction=None):
+    with open("profile_example.json", "r", encoding="utf-8") as f:
+        profile = json.load(f)
+    return json.dumps(build_job_payload(profile, compaction)).encode('utf-8')
+
+
+def legacy_path(message):
+    """
+    What process_queue used to do: decode, re-encode with indent=2, decode and encode again
+    """
+    job_payload = json.loads(message.decode('utf-8'))
+    profile_data = job_payload.get('profile_data')
+    return buildprompt(subprompts[0], json.dumps(profile_data, indent=2))
+
+
+def worker_path(message):
+    """
+    Current process_queue: profile_data is serialized once, profile_text is spliced in as-is
+    """
+    return prompt_for_job(subprompts[0], json.loads(message))
+
+
+def bench(name, func, message, iterations):
+    seconds = timeit.timeit(lambda: func(message), number=iterations)
+    per_job = seconds / iterations * 1e6
+    print(f"  {name:<36} {per_job:8.1f} us/job  ({len(func(message))} prompt chars)")
+    return per_job
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    full_message = load_message()
+    compact_message = load_message(compaction={})
+
+    print(f"Prompt construction, {iterations} iterations:")
+    before = bench("before (decode/encode x3)", legacy_path, full_message, iterations)
+    direct = bench("after, profile_data (encode once)", worker_path, full_message, iterations)
+    spliced = bench("after, profile_text (spliced)", worker_path, compact_message, iterations)
+    print(f"Speedup: {before / direct:.1f}x with profile_data, {before / spliced:.1f}x with profile_text")
@@ -1,10 +1,192 @@
+import argparse
+import re
+import time
+from datetime import datetime
+
 import redis
 
-# Connect to Redis
-r = redis.Redis(host='localhost', port=6379, db=0)
+import reliable_queue
+
+# Queue inspector.
+#
+# Finds every queue under the given prefixes with SCAN and counts its pending, claimed (in-flight
+# in workers' processing lists), dead-lettered and uncached jobs with one pipelined LLEN per list
+# (reliable_queue.queue_depths), so it stays cheap against a busy Redis. With --watch the counts
+# are refreshed every --interval seconds; the drop in outstanding (pending + claimed) jobs between
+# samples gives a smoothed drain rate per queue and an estimated time to empty it. With --deadline
+# (e.g. the job's h_rt) queues that won't drain in time are flagged, which is the cue to add workers.
+
+# Weight of the newest sample in the smoothed drain rate
+RATE_SMOOTHING = 0.3
+
+
+def parse_duration(text):
+    """
+    Seconds in "HH:MM:SS", "MM:SS" or plain seconds (the formats of h_rt)
+    """
+    if not re.fullmatch(r"\d+(:\d+){0,2}", text):
+        raise argparse.ArgumentTypeError(f"invalid duration {text!r}, expected HH:MM:SS or seconds")
+    seconds = 0
+    for part in text.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def format_duration(seconds):
+    """
+    Compact human-readable duration, e.g. 2h05m or 45s
+    """
+    seconds = int(seconds)
+    if seconds >= 86400:
+        return f"{seconds // 86400}d{seconds % 86400 // 3600:02d}h"
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def natural_key(queue_name):
+    """
+    Sort profiles:queue:2 before profiles:queue:10
+    """
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", queue_name)]
+
+
+def snapshot(redis_client, queue_prefixes):
+    """
+    Job counts of every queue under the prefixes, in natural order
+    """
+    depths = {}
+    for prefix in queue_prefixes:
+        depths.update(reliable_queue.queue_depths(redis_client, prefix))
+    return dict(sorted(depths.items(), key=lambda item: natural_key(item[0])))
+
+
+class DrainRates:
+    """
+    Smoothed rate at which each queue's outstanding (pending + claimed) jobs go down
+    """
+
+    def __init__(self):
+        self.rates = {}
+        self._previous = None
+
+    def update(self, depths, now):
+        if self._previous is not None:
+            previous_time, previous = self._previous
+            elapsed = now - previous_time
+            for queue_name, counts in depths.items():
+                before = previous.get(queue_name)
+                if before is None or elapsed <= 0:
+                    continue
+                outstanding = counts["pending"] + counts["claimed"]
+                rate = (before["pending"] + before["claimed"] - outstanding) / elapsed
+                old = self.rates.get(queue_name)
+                self.rates[queue_name] = rate if old is None else RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * old
+        self._previous = (now, depths)
+
+    def eta(self, queue_name, outstanding):
+        """
+        Seconds until the queue is empty at its current rate, or None if it isn't draining
+        """
+        rate = self.rates.get(queue_name)
+        if outstanding == 0:
+            return 0
+        if rate is None or rate <= 0:
+            return None
+        return outstanding / rate
+
+
+def print_report(depths, rates=None, deadline=None):
+    """
+    One line per queue and a total, with drain rates and ETAs when rates are known
+    """
+    width = max([len(queue_name) for queue_name in depths] + [len("Total")])
+    header = f"{'Queue':<{width}} {'pending':>9} {'claimed':>8} {'dead':>7} {'uncached':>8}"
+    if rates is not None:
+        header += f" {'jobs/min':>9} {'ETA':>8}"
+    print(header)
+
+    totals = {"pending": 0, "claimed": 0, "dead": 0, "uncached": 0}
+    total_rate = 0.0
+    late = []
+    for queue_name, counts in list(depths.items()) + [("Total", totals)]:
+        is_total = queue_name == "Total"
+        if not is_total:
+            for state in totals:
+                totals[state] += counts[state]
+        line = (f"{queue_name:<{width}} {counts['pending']:>9} {counts['claimed']:>8} "
+                f"{counts['dead']:>7} {counts['uncached']:>8}")
+        if rates is not None:
+            outstanding = counts["pending"] + counts["claimed"]
+            if is_total:
+                rate = total_rate
+                eta = 0 if outstanding == 0 else outstanding / rate if rate > 0 else None
+            else:
+                rate = rates.rates.get(queue_name)
+                eta = rates.eta(queue_name, outstanding)
+                total_rate += rate or 0.0
+            line += f" {'-' if rate is None else f'{rate * 60:.1f}':>9} {'-' if eta is None else format_duration(eta):>8}"
+            if deadline is not None and rate is not None and not is_total and outstanding and (eta is None or eta > deadline):
+                late.append(queue_name)
+        print(line)
+
+    if late:
+        print(f"Will not drain within {format_duration(deadline)}: {', '.join(late)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect Redis job queues: depths, in-flight and dead jobs, drain rates")
+    parser.add_argument("--redis-host", default="localhost", help="Redis host")
+    parser.add_argument("--redis-port", default=6379, type=int, help="Redis port")
+    parser.add_argument("--redis-db", default=0, type=int, help="Redis database number")
+    parser.add_argument("--queue-prefix", default="profiles", help="Comma-separated prefixes of the queues to inspect")
+    parser.add_argument("--watch", action="store_true", help="Refresh every --interval seconds and show drain rates and ETAs")
+    parser.add_argument("--interval", default=10.0, type=float, help="Seconds between samples in watch mode")
+    parser.add_argument("--deadline", default=None, type=parse_duration, help="Remaining run time (HH:MM:SS or seconds, e.g. the job's h_rt); flag queues that won't drain in time")
+    args = parser.parse_args()
+
+    prefixes = [prefix for prefix in args.queue_prefix.split(",") if prefix]
+    r = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db)
+    try:
+        r.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"Could not connect to Redis: {e}")
+        return
+
+    if not args.watch:
+        depths = snapshot(r, prefixes)
+        if not depths:
+            print(f"No queues under {', '.join(prefixes)}")
+            return
+        print_report(depths)
+        return
+
+    rates = DrainRates()
+    # Redis deletes a list once it is empty; keep showing drained queues as zeros
+    known = {}
+    started = time.monotonic()
+    try:
+        while True:
+            now = time.monotonic()
+            try:
+                depths = snapshot(r, prefixes)
+            except redis.exceptions.RedisError as e:
+                print(f"Redis error: {e}")
+                time.sleep(args.interval)
+                continue
+            known.update(depths)
+            depths = {queue_name: depths.get(queue_name, dict.fromkeys(counts, 0))
+                      for queue_name, counts in sorted(known.items(), key=lambda item: natural_key(item[0]))}
+            rates.update(depths, now)
+            deadline = args.deadline - (now - started) if args.deadline is not None else None
+            print(f"\n{datetime.now():%Y-%m-%d %H:%M:%S}")
+            print_report(depths, rates, deadline)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
 
-# Check all queues
-for i in range(4):
-    queue_name = f"profiles:queue:{i}"
-    length = r.llen(queue_name)
-    print(f"Queue {queue_name}: {length} items") 
\ No newline at end of file
+if __name__ == '__main__':
+    main()
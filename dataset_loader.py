@@ -0,0 +1,123 @@
+import gzip
+import json
+import sys
+
+# Streaming dataset ingestion.
+#
+# pd.read_pickle materializes the whole LinkedIn dataset before the first job is dispatched. The
+# readers here yield profiles in chunks of plain dicts from formats that can be read incrementally
+# - JSON Lines (optionally gzipped) and Parquet row groups - so dispatch starts immediately and
+# memory stays bounded by the chunk size. A pickle can't be streamed; convert it once with
+#   python dataset_loader.py convert LinkedIn_Dataset.pcl LinkedIn_Dataset.jsonl
+
+STREAMABLE_SUFFIXES = (".jsonl", ".jsonl.gz", ".ndjson", ".parquet")
+
+
+def is_streamable(path):
+    """
+    Whether a dataset can be read chunk by chunk
+    """
+    return path.endswith(STREAMABLE_SUFFIXES)
+
+
+def iter_jsonl_chunks(path, chunk_size=1000, skip=0):
+    """
+    Yield lists of up to chunk_size profiles from a JSON Lines file (gzipped if it ends in .gz),
+    starting after the first `skip` profiles
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    chunk = []
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if skip > 0:
+                # Skipped profiles are never parsed
+                skip -= 1
+                continue
+            chunk.append(json.loads(line))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_parquet_chunks(path, chunk_size=1000, skip=0):
+    """
+    Yield lists of up to chunk_size profiles from a Parquet file, one record batch at a time,
+    starting after the first `skip` profiles
+    """
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading Parquet datasets requires pyarrow (pip install pyarrow)")
+
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=chunk_size):
+        if skip >= batch.num_rows:
+            skip -= batch.num_rows
+            continue
+        yield batch.slice(skip).to_pylist()
+        skip = 0
+
+
+def iter_dataframe_chunks(dataframe, chunk_size=1000, skip=0):
+    """
+    Yield lists of profiles from an in-memory DataFrame, serializing one chunk at a time,
+    starting after the first `skip` profiles
+    """
+    for start in range(skip, len(dataframe), chunk_size):
+        yield dataframe.iloc[start:start + chunk_size].to_dict(orient="records")
+
+
+def iter_profile_chunks(path, chunk_size=1000, skip=0):
+    """
+    Yield lists of profile dicts from a dataset file, starting after the first `skip` profiles.
+
+    JSONL and Parquet are streamed; anything else is loaded with pd.read_pickle first, which is
+    not memory-bounded and prints a hint to convert the file.
+    """
+    if path.endswith((".jsonl", ".jsonl.gz", ".ndjson")):
+        yield from iter_jsonl_chunks(path, chunk_size, skip)
+    elif path.endswith(".parquet"):
+        yield from iter_parquet_chunks(path, chunk_size, skip)
+    else:
+        import pandas as pd
+
+        print(f"Warning: {path} can't be streamed and will be loaded into memory; convert it once with "
+              f"'python dataset_loader.py convert {path} <dataset>.jsonl'")
+        yield from iter_dataframe_chunks(pd.read_pickle(path), chunk_size, skip)
+
+
+def convert_pickle(source_path, target_path, chunk_size=10000):
+    """
+    One-time conversion of a pickled DataFrame to JSON Lines or Parquet.
+
+    Returns the number of profiles written.
+    """
+    import pandas as pd
+
+    dataset = pd.read_pickle(source_path)
+    total = len(dataset)
+
+    if target_path.endswith(".parquet"):
+        dataset.to_parquet(target_path, row_group_size=chunk_size)
+    else:
+        opener = gzip.open if target_path.endswith(".gz") else open
+        with opener(target_path, 'wt', encoding='utf-8') as f:
+            for chunk in iter_dataframe_chunks(dataset, chunk_size):
+                for profile in chunk:
+                    f.write(json.dumps(profile, default=str, ensure_ascii=False))
+                    f.write("\n")
+
+    print(f"Converted {total} profiles from {source_path} to {target_path}")
+    return total
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != "convert":
+        print("Usage: python dataset_loader.py convert <dataset.pcl> <dataset.jsonl|dataset.jsonl.gz|dataset.parquet>")
+        sys.exit(1)
+    convert_pickle(sys.argv[2], sys.argv[3])
@@ -1,9 +1,137 @@
 import redis
 import json
+import hashlib
+import secrets
 import uuid
+import time
+import argparse
+import os
+from itertools import islice
 import pandas as pd
 
-def dispatch_to_redis_queues(redis_client, profiles, num_queues):
+from profile_compaction import serialize_profile, DEFAULT_DENYLIST, DEFAULT_MAX_LIST_ITEMS
+from dataset_loader import is_streamable, iter_profile_chunks, iter_dataframe_chunks
+from dispatch_dedup import RedisSetDedup, RedisBloomDedup
+import metrics
+from job_codec import JobEncoder, CODECS, load_dictionary, publish_dictionary
+from profile_store import ProfileStoreWriter
+
+# uuid5 namespace for job ids derived from profile identities
+JOB_ID_NAMESPACE = uuid.UUID("5b0f6f0e-3c1e-4d57-9a43-6f1d1c2b7e90")
+
+
+def profile_identity(profile_dict):
+    """
+    The profile's urn or username, or a hash of its content if it has neither
+    """
+    identity = profile_dict.get("urn") or profile_dict.get("username")
+    if not identity or not isinstance(identity, str):
+        identity = hashlib.sha1(json.dumps(profile_dict, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return identity
+
+
+def profile_job_id(profile_dict):
+    """
+    Stable job id for a profile, so re-dispatching the dataset yields the same ids and workers can
+    recognize jobs they have already completed.
+    """
+    return str(uuid.uuid5(JOB_ID_NAMESPACE, profile_identity(profile_dict)))
+
+
+def build_job_payload(profile_dict, compaction=None, store=None):
+    """
+    Build the job payload for a profile.
+
+    With compaction (a dict of profile_compaction.compact_profile options) the profile is stored
+    as canonical, already-compacted text under "profile_text", which workers splice straight into
+    the prompt without decoding or re-encoding it.
+
+    With store (a profile_store.ProfileStoreWriter) the profile is appended to the store instead
+    and the job only carries a "profile_ref" to its row; the store must be flushed before the job
+    is pushed.
+
+    The job_id is the same for every dispatch of a profile, but each payload gets a random
+    "dispatch_id", so two dispatches never produce identical messages (reliable_queue tracks the
+    attempts of a message by its digest).
+    """
+    job_payload = {"job_id": profile_job_id(profile_dict), "dispatch_id": secrets.token_hex(8)}
+    if store is not None:
+        record = (serialize_profile(profile_dict, **compaction) if compaction is not None
+                  else json.dumps(profile_dict, default=str))
+        job_payload["profile_ref"] = store.reference(store.append(record))
+    elif compaction is not None:
+        job_payload["profile_text"] = serialize_profile(profile_dict, **compaction)
+    else:
+        job_payload["profile_data"] = profile_dict
+    return job_payload
+
+
+def push_profiles(redis_client, records, route, dedup=None, compaction=None, encoder=None, store=None,
+                  finish=None):
+    """
+    LPUSH the jobs of a list of profiles in one MULTI/EXEC that also claims them in the dedup index,
+    so a failed or interrupted push leaves no claims behind and the profiles are sent again later.
+
+    Profiles the index has seen (or that repeat within records) are skipped. route(index, position)
+    names the queue of records[index], position counting the profiles pushed before it; finish(pipe)
+    adds more commands to the transaction. With a dedup index the transaction WATCHes it and is
+    retried if another dispatcher claims profiles while it is being prepared. Profile store rows
+    are marked published only once the transaction has committed.
+
+    Returns:
+        dict: The messages pushed per queue.
+    """
+    encoder = encoder or JobEncoder()
+    identities = [profile_identity(profile_dict) for profile_dict in records] if dedup is not None else None
+    # Messages survive retries, so a profile is appended to the store only once
+    messages = {}
+    rows = {}
+    batches = {}
+    pushed = []
+
+    def push(pipe):
+        fresh = range(len(records))
+        if dedup is not None:
+            seen = dedup.seen(identities)
+            unique = set()
+            fresh = []
+            for index, identity in enumerate(identities):
+                if not seen[index] and identity not in unique:
+                    unique.add(identity)
+                    fresh.append(index)
+
+        batches.clear()
+        pushed[:] = fresh
+        for position, index in enumerate(fresh):
+            if index not in messages:
+                job_payload = build_job_payload(records[index], compaction, store)
+                if store is not None:
+                    rows[index] = job_payload["profile_ref"]["row"]
+                messages[index] = encoder.encode(job_payload)
+            batches.setdefault(route(index, position), []).append(messages[index])
+        if store is not None:
+            # Workers may pick a job up as soon as it is pushed
+            store.flush()
+
+        pipe.multi()
+        for target_queue, queue_messages in batches.items():
+            # A single multi-value LPUSH keeps FIFO order for consumers using BRPOP
+            pipe.lpush(target_queue, *queue_messages)
+        if dedup is not None:
+            dedup.add(pipe, [identities[index] for index in fresh])
+        if finish is not None:
+            finish(pipe)
+
+    redis_client.transaction(push, *([dedup.key] if dedup is not None else []))
+    if store is not None:
+        # Rows of profiles dropped on a retry (claimed meanwhile) or of a failed push stay
+        # unpublished: reused if the profile is sent again, otherwise listed as orphans
+        store.published([rows[index] for index in pushed])
+    return batches
+
+
+def dispatch_to_redis_queues(redis_client, profiles, num_queues, queue_offset=0, queue_prefix="profiles",
+                             compaction=None, dedup=None, encoder=None, store=None):
     """
     Dispatches a list of profiles to a specified number of Redis queues.
 
@@ -11,14 +139,23 @@ def dispatch_to_redis_queues(redis_client, profiles, num_queues):
         redis_client (redis.Redis): An active Redis client connection.
         profiles (pd.DataFrame): A DataFrame containing LinkedIn profiles.
         num_queues (int): The number of parallel queues to distribute profiles among.
+        queue_offset (int): Index of the first target queue (allows multiple dispatchers).
+        queue_prefix (str): Prefix for queue names, matching prompt.py's --queue-prefix.
+        compaction (dict): compact_profile options to store profiles as compacted text, or None.
+        dedup: dispatch_dedup index; profiles it has already seen are skipped.
+        encoder (job_codec.JobEncoder): Codec for the job messages (default: JSON).
+        store (profile_store.ProfileStoreWriter): Claim-check store for the profiles, or None to
+            put them in the job messages.
     """
     if num_queues <= 0:
         print("Error: Number of queues must be a positive integer.")
         return
 
     # A base name for our queues for better organization in Redis
-    queue_base_name = "profiles:queue"
+    queue_base_name = f"{queue_prefix}:queue"
+    encoder = encoder or JobEncoder()
     total_dispatched = 0
+    skipped = 0
 
     print(f"Starting dispatch of {len(profiles)} profiles to {num_queues} queues...\n")
 
@@ -26,58 +163,391 @@ def dispatch_to_redis_queues(redis_client, profiles, num_queues):
     for i, (index, profile) in enumerate(profiles.iterrows()):
         # Convert the profile Series to a dictionary
         profile_dict = profile.to_dict()
-        
+
         # Determine which queue to send the profile to using round-robin
-        queue_index = i % num_queues
+        queue_index = queue_offset + i % num_queues
         target_queue = f"{queue_base_name}:{queue_index}"
 
-        # --- Prepare the data payload ---
-        job_payload = {
-            "job_id": str(uuid.uuid4()),
-            "profile_data": profile_dict
-        }
-
-        # Convert the Python dictionary to a JSON string for storage in Redis
-        message = json.dumps(job_payload)
-
         try:
-            # LPUSH adds the new message to the left (head) of the list (queue)
-            redis_client.lpush(target_queue, message)
-            print(f"  Dispatched profile {i+1} (Job ID: {job_payload['job_id']}) to queue '{target_queue}'")
+            # LPUSH adds the new message to the left (head) of the list (queue); the profile is
+            # claimed in the dedup index only if the push goes through
+            if not push_profiles(redis_client, [profile_dict], lambda index, position: target_queue,
+                                 dedup, compaction, encoder, store):
+                print(f"  Skipped profile {i+1}: already dispatched")
+                skipped += 1
+                metrics.PROFILES_SKIPPED.inc()
+                continue
+            print(f"  Dispatched profile {i+1} (Job ID: {profile_job_id(profile_dict)}) to queue '{target_queue}'")
             total_dispatched += 1
+            metrics.JOBS_DISPATCHED.inc(queue=target_queue)
         except redis.exceptions.RedisError as e:
             print(f"Error dispatching profile {i+1} to Redis: {e}")
 
     print(f"\nDispatch complete. Total profiles sent: {total_dispatched}/{len(profiles)}.")
+    if dedup is not None:
+        print(f"Skipped {skipped} duplicate profiles.")
+
+
+def dispatch_batched(redis_client, profiles, num_queues, chunk_size=1000, queue_offset=0,
+                     queue_prefix="profiles", progress_interval=5.0, compaction=None, dedup=None,
+                     encoder=None, store=None):
+    """
+    Dispatches profiles in bulk, grouping messages per queue and flushing them through Redis pipelines.
+
+    Rows are serialized a chunk at a time with to_dict(orient="records") instead of boxing each
+    row into a Series, and every chunk costs a single pipeline round trip regardless of its size.
+
+    Args:
+        redis_client (redis.Redis): An active Redis client connection.
+        profiles (pd.DataFrame): A DataFrame containing LinkedIn profiles.
+        num_queues (int): The number of parallel queues to distribute profiles among.
+        chunk_size (int): Number of profiles serialized and flushed per pipeline.
+        queue_offset (int): Index of the first target queue (allows multiple dispatchers).
+        queue_prefix (str): Prefix for queue names, matching prompt.py's --queue-prefix.
+        progress_interval (float): Minimum number of seconds between progress lines.
+        compaction (dict): compact_profile options to store profiles as compacted text, or None.
+        dedup: dispatch_dedup index; profiles it has already seen are skipped.
+        encoder (job_codec.JobEncoder): Codec for the job messages (default: JSON).
+        store (profile_store.ProfileStoreWriter): Claim-check store for the profiles, or None to
+            put them in the job messages.
+
+    Returns:
+        int: The number of profiles successfully pushed to Redis.
+    """
+    if chunk_size <= 0:
+        print("Error: Chunk size must be a positive integer.")
+        return 0
+
+    return dispatch_chunks(redis_client, iter_dataframe_chunks(profiles, chunk_size), num_queues,
+                           queue_offset=queue_offset, queue_prefix=queue_prefix,
+                           progress_interval=progress_interval, compaction=compaction,
+                           total_profiles=len(profiles), dedup=dedup, encoder=encoder,
+                           store=store)
+
+
+def dispatch_chunks(redis_client, chunks, num_queues, queue_offset=0, queue_prefix="profiles",
+                    progress_interval=5.0, compaction=None, total_profiles=None, dedup=None, encoder=None,
+                    store=None):
+    """
+    Dispatches an iterable of profile chunks, one Redis pipeline per chunk.
+
+    Only one chunk is held in memory at a time, so this works with the streaming readers in
+    dataset_loader as well as with in-memory DataFrames.
+
+    Args:
+        redis_client (redis.Redis): An active Redis client connection.
+        chunks (iterable): Lists of profile dictionaries.
+        num_queues (int): The number of parallel queues to distribute profiles among.
+        queue_offset (int): Index of the first target queue (allows multiple dispatchers).
+        queue_prefix (str): Prefix for queue names, matching prompt.py's --queue-prefix.
+        progress_interval (float): Minimum number of seconds between progress lines.
+        compaction (dict): compact_profile options to store profiles as compacted text, or None.
+        total_profiles (int): Total number of profiles for progress lines, if known.
+        dedup: dispatch_dedup index; profiles it has already seen are skipped.
+        encoder (job_codec.JobEncoder): Codec for the job messages (default: JSON).
+        store (profile_store.ProfileStoreWriter): Claim-check store for the profiles, or None to
+            put them in the job messages.
+
+    Returns:
+        int: The number of profiles successfully pushed to Redis.
+    """
+    if num_queues <= 0:
+        print("Error: Number of queues must be a positive integer.")
+        return 0
+
+    queue_base_name = f"{queue_prefix}:queue"
+    encoder = encoder or JobEncoder()
+    of_total = f"/{total_profiles}" if total_profiles is not None else ""
+    total_seen = 0
+    total_dispatched = 0
+    skipped = 0
+    # Round-robin position of the next profile sent
+    position = 0
+
+    print(f"Starting batched dispatch of {total_profiles if total_profiles is not None else 'streamed'} "
+          f"profiles to {num_queues} queues...\n")
+
+    start_time = time.monotonic()
+    last_report = start_time
+
+    for records in chunks:
+        total_seen += len(records)
+
+        # Group messages per target queue, keeping the same round-robin assignment (over the
+        # profiles actually sent) as the row-by-row dispatcher so both modes fill the queues
+        # identically; the chunk's new profiles are claimed with its pushes in one round trip
+        chunk_start = position
+        try:
+            batches = push_profiles(
+                redis_client, records,
+                lambda index, sent: f"{queue_base_name}:{queue_offset + (chunk_start + sent) % num_queues}",
+                dedup, compaction, encoder, store)
+        except redis.exceptions.RedisError as e:
+            print(f"Error dispatching {len(records)} profiles up to profile {total_seen} to Redis: {e}")
+            continue
+        pushed = sum(len(messages) for messages in batches.values())
+        position += pushed
+        total_dispatched += pushed
+        skipped += len(records) - pushed
+        if dedup is not None:
+            metrics.PROFILES_SKIPPED.inc(len(records) - pushed)
+        for target_queue, messages in batches.items():
+            metrics.JOBS_DISPATCHED.inc(len(messages), queue=target_queue)
+
+        now = time.monotonic()
+        if now - last_report >= progress_interval:
+            rate = total_dispatched / (now - start_time)
+            print(f"  Dispatched {total_dispatched}{of_total} profiles ({rate:.0f} profiles/sec)")
+            last_report = now
+
+    elapsed = time.monotonic() - start_time
+    rate = total_dispatched / elapsed if elapsed > 0 else float(total_dispatched)
+    print(f"\nDispatch complete. Total profiles sent: {total_dispatched}/{total_seen} "
+          f"in {elapsed:.1f}s ({rate:.0f} profiles/sec).")
+    if dedup is not None:
+        print(f"Skipped {skipped} duplicate profiles.")
+    return total_dispatched
+
+
+def feeder_checkpoint_key(queue_prefix="profiles"):
+    """
+    Name of the Redis hash holding each fed dataset's offset
+    """
+    return f"{queue_prefix}:feeder:offsets"
+
+
+def feed_queues(redis_client, dataset_path, num_queues, low_watermark=1000, high_watermark=5000,
+                queue_offset=0, queue_prefix="profiles", chunk_size=1000, poll_interval=2.0,
+                progress_interval=30.0, compaction=None, dedup=None, checkpoint_name=None, restart=False,
+                encoder=None, store=None):
+    """
+    Continuously keeps the queues topped up from a dataset instead of pushing all of it at once.
+
+    Whenever a queue falls below low_watermark it is refilled up to high_watermark, reading only
+    that many profiles ahead from the dataset, so Redis holds at most about num_queues *
+    high_watermark jobs however large the dataset is. The dataset offset is checkpointed in the
+    same MULTI/EXEC as the pushes, so a restarted feeder resumes right after the last profile it
+    sent; restart=True starts over from the beginning.
+
+    Args:
+        redis_client (redis.Redis): An active Redis client connection.
+        dataset_path (str): Dataset file, read with dataset_loader.iter_profile_chunks.
+        num_queues (int): The number of parallel queues to keep filled.
+        low_watermark (int): Queue depth below which a queue is refilled.
+        high_watermark (int): Queue depth a refill brings a queue back up to.
+        queue_offset (int): Index of the first target queue (allows multiple dispatchers).
+        queue_prefix (str): Prefix for queue names, matching prompt.py's --queue-prefix.
+        chunk_size (int): Most profiles pushed to one queue per round trip.
+        poll_interval (float): Seconds between depth checks while every queue is above low_watermark.
+        progress_interval (float): Minimum number of seconds between progress lines.
+        compaction (dict): compact_profile options to store profiles as compacted text, or None.
+        dedup: dispatch_dedup index; profiles it has already seen are skipped.
+        encoder (job_codec.JobEncoder): Codec for the job messages (default: JSON).
+        store (profile_store.ProfileStoreWriter): Claim-check store for the profiles, or None to
+            put them in the job messages.
+        checkpoint_name (str): Name the offset is stored under (default: the dataset's file name).
+        restart (bool): Ignore the stored offset.
+
+    Returns:
+        int: The number of profiles pushed to Redis by this run.
+    """
+    if num_queues <= 0 or not 0 <= low_watermark < high_watermark:
+        print("Error: Need a positive number of queues and 0 <= low watermark < high watermark.")
+        return 0
+
+    checkpoint_key = feeder_checkpoint_key(queue_prefix)
+    encoder = encoder or JobEncoder()
+    checkpoint_name = checkpoint_name or os.path.basename(dataset_path)
+    offset = 0 if restart else int(redis_client.hget(checkpoint_key, checkpoint_name) or 0)
+    queues = [f"{queue_prefix}:queue:{queue_offset + i}" for i in range(num_queues)]
+    profiles = (profile_dict for chunk in iter_profile_chunks(dataset_path, chunk_size, skip=offset)
+                for profile_dict in chunk)
+
+    print(f"Feeding {', '.join(queues)} from {dataset_path} starting at profile {offset} "
+          f"(watermarks {low_watermark}/{high_watermark})")
+
+    total_dispatched = 0
+    skipped = 0
+    exhausted = False
+    last_report = time.monotonic()
+
+    try:
+        while not exhausted:
+            pipe = redis_client.pipeline(transaction=False)
+            for queue_name in queues:
+                pipe.llen(queue_name)
+            depths = dict(zip(queues, pipe.execute()))
+
+            # Read ahead only as far as the drained queues need
+            records = []
+            targets = []
+            for queue_name, depth in depths.items():
+                if depth >= low_watermark or exhausted:
+                    continue
+                refill = list(islice(profiles, min(high_watermark - depth, chunk_size)))
+                if not refill:
+                    exhausted = True
+                    continue
+                records.extend(refill)
+                targets.extend([queue_name] * len(refill))
+            consumed = len(records)
+
+            if consumed == 0:
+                if not exhausted:
+                    time.sleep(poll_interval)
+                continue
+
+            # Pushes, dedup claims and the new offset land together, so a restart neither skips
+            # nor repeats profiles
+            new_offset = offset + consumed
+            batches = push_profiles(redis_client, records, lambda index, position: targets[index], dedup,
+                                    compaction, encoder, store,
+                                    finish=lambda pipe: pipe.hset(checkpoint_key, checkpoint_name, new_offset))
+            offset = new_offset
+            pushed = sum(len(messages) for messages in batches.values())
+            skipped += consumed - pushed
+            if dedup is not None:
+                metrics.PROFILES_SKIPPED.inc(consumed - pushed)
+            for queue_name, messages in batches.items():
+                total_dispatched += len(messages)
+                metrics.JOBS_DISPATCHED.inc(len(messages), queue=queue_name)
+
+            now = time.monotonic()
+            if now - last_report >= progress_interval:
+                print(f"  Fed {total_dispatched} profiles, dataset offset {offset}, queue depths "
+                      f"{min(depths.values())}-{max(depths.values())} before refill")
+                last_report = now
+    except KeyboardInterrupt:
+        print(f"\nFeeder stopped at dataset offset {offset}; rerun to resume from there.")
+        return total_dispatched
+
+    print(f"\nDataset exhausted at offset {offset}. Total profiles sent by this run: {total_dispatched}.")
+    if dedup is not None:
+        print(f"Skipped {skipped} duplicate profiles.")
+    return total_dispatched
 
 
 if __name__ == '__main__':
-    # --- Configuration ---
-    REDIS_HOST = 'localhost'
-    REDIS_PORT = 6379
-    NUMBER_OF_QUEUES = 4  # The number of parallel queues you want to use
-    DATASET_PATH = "./LinkedIn_Dataset.pcl"  # Path to the LinkedIn dataset
+    parser = argparse.ArgumentParser(description="Dispatch LinkedIn profiles to Redis queues")
+    parser.add_argument("--redis-host", default="localhost", help="Redis host")
+    parser.add_argument("--redis-port", default=6379, type=int, help="Redis port")
+    parser.add_argument("--redis-db", default=0, type=int, help="Redis database number")
+    parser.add_argument("--num-queues", default=4, type=int, help="The number of parallel queues you want to use")
+    parser.add_argument("--queue-offset", default=0, type=int, help="Offset for queue numbers (allows multiple instances)")
+    parser.add_argument("--queue-prefix", default="profiles", help="Prefix for queue names")
+    parser.add_argument("--dataset", default="./LinkedIn_Dataset.pcl", help="Path to the LinkedIn dataset (.pcl, or .jsonl/.jsonl.gz/.parquet to stream it)")
+    parser.add_argument("--batch", action="store_true", help="Serialize profiles in bulk and push them through Redis pipelines")
+    parser.add_argument("--chunk-size", default=1000, type=int, help="Profiles per pipeline flush in batch and streaming mode")
+    parser.add_argument("--compact-profile", action="store_true", help="Store profiles as compacted prompt-ready text instead of raw JSON")
+    parser.add_argument("--profile-allow", default=None, help="Comma-separated top-level profile fields to keep in compacted profiles")
+    parser.add_argument("--profile-deny", default=",".join(DEFAULT_DENYLIST), help="Comma-separated profile fields to drop at any depth from compacted profiles")
+    parser.add_argument("--max-list-items", default=DEFAULT_MAX_LIST_ITEMS, type=int, help="Longest list kept in compacted profiles; 0 keeps all")
+    parser.add_argument("--keep-empty", action="store_true", help="Keep null and empty fields in compacted profiles")
+    parser.add_argument("--progress-interval", default=5.0, type=float, help="Seconds between progress lines in batch, streaming and feed mode")
+    parser.add_argument("--dedup", default="off", choices=["off", "set", "bloom"], help="Skip profiles (same urn/username) already dispatched by this or any earlier run, tracked in a Redis set or Bloom filter")
+    parser.add_argument("--dedup-capacity", default=10000000, type=int, help="Profiles the Bloom filter is sized for when first created")
+    parser.add_argument("--dedup-error-rate", default=0.001, type=float, help="Bloom filter false-positive rate when first created")
+    parser.add_argument("--dedup-reset", action="store_true", help="Forget previously dispatched profiles before dispatching")
+    parser.add_argument("--feed", action="store_true", help="Keep the queues between the watermarks from the dataset instead of pushing all of it, resuming from the checkpointed offset")
+    parser.add_argument("--low-watermark", default=1000, type=int, help="Queue depth below which the feeder refills a queue (feed mode)")
+    parser.add_argument("--high-watermark", default=5000, type=int, help="Queue depth the feeder refills a queue up to (feed mode)")
+    parser.add_argument("--poll-interval", default=2.0, type=float, help="Seconds between queue depth checks (feed mode)")
+    parser.add_argument("--checkpoint-name", default=None, help="Name of the dataset offset checkpoint in <prefix>:feeder:offsets (feed mode, default: dataset file name)")
+    parser.add_argument("--feed-restart", action="store_true", help="Ignore the checkpoint and feed from the start of the dataset (feed mode)")
+    parser.add_argument("--job-codec", default="json", choices=CODECS, help="Encoding of job messages: JSON text, msgpack, or msgpack compressed with zstd (optionally with a trained dictionary); workers read all of them")
+    parser.add_argument("--codec-dict", default=None, help="zstd dictionary trained with 'python job_codec.py train' (zstd-dict codec)")
+    parser.add_argument("--codec-level", default=3, type=int, help="zstd compression level (zstd codecs)")
+    parser.add_argument("--metrics-port", default=None, type=int, help="Serve Prometheus metrics (dispatch counts, queue depths) on this port at /metrics while dispatching")
+    parser.add_argument("--profile-store", default=None, help="Append profiles to this local store file and enqueue only references to them (workers must be able to read the file)")
+
+    args = parser.parse_args()
+
+    compaction = None
+    if args.compact_profile:
+        # The same options as prompt.py --compact-profile: workers splice this text as-is
+        compaction = {
+            "allowlist": args.profile_allow.split(",") if args.profile_allow else None,
+            "denylist": args.profile_deny.split(",") if args.profile_deny else (),
+            "drop_empty": not args.keep_empty,
+            "max_list_items": args.max_list_items if args.max_list_items > 0 else None
+        }
 
+    store = None
     try:
-        # Load the LinkedIn dataset
-        print("Loading LinkedIn dataset...")
-        dataset = pd.read_pickle(DATASET_PATH)
-        print(f"Loaded {len(dataset)} profiles from dataset.")
+        streaming = is_streamable(args.dataset) or args.feed
+        if streaming:
+            # JSONL/Parquet datasets are read a chunk at a time while dispatching
+            print(f"Streaming LinkedIn dataset from {args.dataset}...")
+        else:
+            # Load the LinkedIn dataset
+            print("Loading LinkedIn dataset...")
+            dataset = pd.read_pickle(args.dataset)
+            print(f"Loaded {len(dataset)} profiles from dataset.")
 
         # Establish a connection to the Redis server
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+        r = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db)
         
         # Check if the server is available
         r.ping()
-        print(f"Successfully connected to Redis at {REDIS_HOST}:{REDIS_PORT}")
+        print(f"Successfully connected to Redis at {args.redis_host}:{args.redis_port}")
+
+        if args.metrics_port is not None:
+            metrics.watch_queues(r, [args.queue_prefix])
+            metrics.start_server(args.metrics_port)
+
+        dedup = None
+        if args.dedup == "set":
+            dedup = RedisSetDedup(r, args.queue_prefix)
+        elif args.dedup == "bloom":
+            dedup = RedisBloomDedup(r, args.queue_prefix, args.dedup_capacity, args.dedup_error_rate)
+        if dedup is not None:
+            if args.dedup_reset:
+                dedup.reset()
+            print(f"Deduplicating against {dedup.describe()}")
+
+        dictionary = None
+        if args.job_codec == "zstd-dict":
+            if args.codec_dict is None:
+                parser.error("--job-codec zstd-dict needs --codec-dict")
+            # Workers fetch the dictionary from Redis by the id in each job's header
+            dictionary = load_dictionary(args.codec_dict)
+            print(f"Published compression dictionary {publish_dictionary(r, dictionary, args.queue_prefix)}")
+        encoder = JobEncoder(args.job_codec, dictionary, args.codec_level)
+
+        if args.profile_store:
+            store = ProfileStoreWriter(args.profile_store, "text" if compaction is not None else "json")
+            print(f"Storing profiles in {store.path} (starting at row {store.rows})")
 
         # Run the dispatcher function with the LinkedIn dataset
-        dispatch_to_redis_queues(r, dataset, NUMBER_OF_QUEUES)
+        if args.feed:
+            feed_queues(r, args.dataset, args.num_queues, low_watermark=args.low_watermark,
+                        high_watermark=args.high_watermark, queue_offset=args.queue_offset,
+                        queue_prefix=args.queue_prefix, chunk_size=args.chunk_size,
+                        poll_interval=args.poll_interval, progress_interval=args.progress_interval,
+                        compaction=compaction, dedup=dedup, checkpoint_name=args.checkpoint_name,
+                        restart=args.feed_restart, encoder=encoder, store=store)
+        elif streaming:
+            dispatch_chunks(r, iter_profile_chunks(args.dataset, args.chunk_size), args.num_queues,
+                            queue_offset=args.queue_offset, queue_prefix=args.queue_prefix,
+                            progress_interval=args.progress_interval, compaction=compaction, dedup=dedup,
+                            encoder=encoder, store=store)
+        elif args.batch:
+            dispatch_batched(r, dataset, args.num_queues, chunk_size=args.chunk_size,
+                             queue_offset=args.queue_offset, queue_prefix=args.queue_prefix,
+                             progress_interval=args.progress_interval, compaction=compaction, dedup=dedup,
+                             encoder=encoder, store=store)
+        else:
+            dispatch_to_redis_queues(r, dataset, args.num_queues, queue_offset=args.queue_offset,
+                                     queue_prefix=args.queue_prefix, compaction=compaction, dedup=dedup,
+                                     encoder=encoder, store=store)
 
     except FileNotFoundError:
-        print(f"Error: Could not find the dataset file at {DATASET_PATH}")
+        print(f"Error: Could not find the dataset file at {args.dataset}")
     except redis.exceptions.ConnectionError as e:
         print(f"Could not connect to Redis: {e}")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-
+    finally:
+        if store is not None:
+            # Flushes the last rows and lists the ones no job references
+            store.close()
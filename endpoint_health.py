@@ -0,0 +1,237 @@
+import random
+import threading
+import time
+
+import requests
+
+import http_sessions
+
+# Per-endpoint health tracking: exponential backoff with jitter and a circuit breaker.
+#
+# While an endpoint keeps failing (connection refused, timeouts, 5xx, or the 404s Ollama returns
+# for a model it doesn't have), workers stop taking jobs for it instead of draining the queue into
+# failed requests. After failure_threshold consecutive failures the breaker opens for a cooldown;
+# then a single probe request is let through (half-open) and its outcome closes or re-opens the
+# breaker, with the cooldown doubling on every re-open up to max_cooldown.
+#
+# Workers check is_available() before taking a job, which claims nothing; the request itself
+# claims permission with allow_request() right before it is sent, so a job that never reaches the
+# model (undecodable, already completed, answered from the cache) can't hold the probe slot.
+# Requests that find the probe in flight (other workers that took a job at the same time, or a
+# job's further perspectives) wait for its outcome with wait_for_request() instead of being
+# refused, so they don't count as endpoint failures of a recovering endpoint.
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# allow_request's answer when the request is the half-open probe
+PROBE = "probe"
+
+# HTTP statuses that say the endpoint, not the request, is the problem
+ENDPOINT_FAILURE_STATUSES = {404, 408, 429}
+
+
+def is_endpoint_failure(status_code):
+    """
+    True if an HTTP status should count against the endpoint's health
+    """
+    return status_code is None or status_code >= 500 or status_code in ENDPOINT_FAILURE_STATUSES
+
+
+class EndpointHealth:
+    """
+    Backoff and circuit breaker state for one model endpoint, shared by its worker threads
+    """
+
+    def __init__(self, base_url, failure_threshold=5, base_delay=0.5, max_delay=30.0,
+                 cooldown=15.0, max_cooldown=300.0):
+        self.base_url = base_url
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.current_cooldown = cooldown
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+        # Notified whenever the probe in flight ends
+        self._probe_done = threading.Condition(self._lock)
+
+    def allow_request(self):
+        """
+        Claim permission to send a request now: False, True, or PROBE for the single half-open
+        probe, which must end in record_success, record_failure or cancel_probe
+        """
+        with self._lock:
+            return self._allow()
+
+    def _allow(self):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() >= self.open_until:
+            self.state = HALF_OPEN
+            self.probe_in_flight = False
+        if self.state == HALF_OPEN and not self.probe_in_flight:
+            # Let exactly one probe through; everyone else keeps waiting
+            self.probe_in_flight = True
+            return PROBE
+        return False
+
+    def probe_pending(self):
+        """
+        Whether the half-open probe is in flight, so a refused request should wait for its outcome
+        """
+        with self._lock:
+            return self.state == HALF_OPEN and self.probe_in_flight
+
+    def wait_for_request(self, timeout=None):
+        """
+        allow_request, but while the half-open probe is in flight wait up to timeout seconds for
+        its outcome instead of refusing: True once it closed the breaker, PROBE if the probe was
+        given back, False if the breaker is open (again) or the wait timed out
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._probe_done:
+            while True:
+                permit = self._allow()
+                if permit or not (self.state == HALF_OPEN and self.probe_in_flight):
+                    return permit
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._probe_done.wait(remaining)
+
+    def is_available(self):
+        """
+        Whether allow_request could currently succeed, without claiming a probe slot
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.monotonic() >= self.open_until
+            return not self.probe_in_flight
+
+    def cancel_probe(self):
+        """
+        Give back a probe slot that was granted but whose request never completed
+        """
+        with self._lock:
+            self.probe_in_flight = False
+            self._probe_done.notify_all()
+
+    def wait_time(self):
+        """
+        Seconds until the breaker may let a request through again
+        """
+        with self._lock:
+            if self.state == OPEN:
+                return max(self.open_until - time.monotonic(), 0.0)
+            return 0.0
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"Endpoint {self.base_url} recovered, resuming consumption")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.current_cooldown = self.cooldown
+            self.probe_in_flight = False
+            self._probe_done.notify_all()
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.probe_in_flight = False
+
+            if self.state == HALF_OPEN:
+                # The probe failed: stay away longer this time
+                self.current_cooldown = min(self.current_cooldown * 2, self.max_cooldown)
+                self._open()
+            elif self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+                self._open()
+            self._probe_done.notify_all()
+
+    def _open(self):
+        self.state = OPEN
+        self.open_until = time.monotonic() + self.current_cooldown
+        print(f"Circuit breaker for {self.base_url} opened after {self.consecutive_failures} consecutive "
+              f"failures, pausing for {self.current_cooldown:.0f}s")
+
+    def backoff_delay(self):
+        """
+        Exponential backoff with full jitter based on the current failure streak
+        """
+        with self._lock:
+            failures = self.consecutive_failures
+        if failures == 0:
+            return 0.0
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (failures - 1)))
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+_settings = {}
+
+
+def configure(**settings):
+    """
+    Set EndpointHealth parameters for endpoints created from now on
+    """
+    _settings.update(settings)
+
+
+def get_health(base_url):
+    """
+    Shared EndpointHealth for an endpoint, created on first use
+    """
+    health = _registry.get(base_url)
+    if health is None:
+        with _registry_lock:
+            health = _registry.setdefault(base_url, EndpointHealth(base_url, **_settings))
+    return health
+
+
+def probe_ready(base_url, model_name=None):
+    """
+    Check /v1/models once.
+
+    Returns:
+        tuple: (ready, reason) - ready is True if the server answers and, when model_name is
+        given, lists that model.
+    """
+    try:
+        response = http_sessions.get_session(base_url).get(f"{base_url}/v1/models",
+                                                          timeout=http_sessions.get_timeout())
+        response.raise_for_status()
+        models = [model.get("id") for model in response.json().get("data", [])]
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return False, str(e)
+
+    if model_name is not None and model_name not in models:
+        return False, f"model {model_name} not served (available: {', '.join(map(str, models)) or 'none'})"
+    return True, "ready"
+
+
+def wait_until_ready(base_url, model_name=None, timeout=300, interval=5):
+    """
+    Block until the endpoint passes the readiness probe or the timeout expires.
+
+    Returns True if the endpoint became ready.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        ready, reason = probe_ready(base_url, model_name)
+        if ready:
+            print(f"Endpoint {base_url} is ready")
+            return True
+        if time.monotonic() >= deadline:
+            print(f"Endpoint {base_url} not ready after {timeout}s ({reason}); starting anyway")
+            return False
+        print(f"Waiting for endpoint {base_url}: {reason}")
+        time.sleep(interval)
@@ -0,0 +1,158 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Shared, pooled HTTP sessions for the model endpoints.
+#
+# Every worker thread talking to the same endpoint shares one requests.Session whose adapter keeps
+# up to pool_size keep-alive connections open, so a job pays for a TCP handshake only when the
+# pool has to grow. Request counts come straight from the urllib3 connection pools; new
+# connections are counted as they are opened, since urllib3 reconnects a dropped connection in
+# place and its pools' num_connections misses those reconnects (every request, without keep-alive).
+
+
+class CountingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that counts the TCP connections its pools open
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.connections_opened = 0
+        self._count_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        def counting(connection_class):
+            class CountingConnection(connection_class):
+                def connect(self):
+                    super().connect()
+                    with adapter._count_lock:
+                        adapter.connections_opened += 1
+            return CountingConnection
+
+        class CountingPool(HTTPConnectionPool):
+            ConnectionCls = counting(HTTPConnection)
+
+        class CountingHTTPSPool(HTTPSConnectionPool):
+            ConnectionCls = counting(HTTPSConnection)
+
+        self.poolmanager.pool_classes_by_scheme = {"http": CountingPool, "https": CountingHTTPSPool}
+
+
+class EndpointSessions:
+    """
+    Per-endpoint requests.Session registry shared by worker threads
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=5.0, read_timeout=60.0, keep_alive=True):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keep_alive = keep_alive
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        """
+        (connect, read) timeout tuple for requests
+        """
+        return (self.connect_timeout, self.read_timeout)
+
+    def get(self, base_url):
+        """
+        Return the session for an endpoint, creating it on first use
+        """
+        session = self._sessions.get(base_url)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(base_url)
+            if session is None:
+                session = requests.Session()
+                adapter = CountingAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=False)
+                session.mount(base_url, adapter)
+                session.headers["Content-Type"] = "application/json"
+                if not self.keep_alive:
+                    session.headers["Connection"] = "close"
+                self._sessions[base_url] = session
+        return session
+
+    def stats(self):
+        """
+        Connection reuse counters per endpoint.
+
+        Returns:
+            dict: base_url -> {"requests", "connections", "reused"}
+        """
+        with self._lock:
+            sessions = dict(self._sessions)
+
+        stats = {}
+        for base_url, session in sessions.items():
+            adapter = session.get_adapter(base_url)
+            num_requests = 0
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                num_requests += pool.num_requests
+            num_connections = adapter.connections_opened
+            stats[base_url] = {
+                "requests": num_requests,
+                "connections": num_connections,
+                "reused": max(num_requests - num_connections, 0)
+            }
+        return stats
+
+    def close(self):
+        """
+        Close every session and its pooled connections
+        """
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+default_sessions = EndpointSessions()
+
+
+def configure(pool_size=10, connect_timeout=5.0, read_timeout=60.0, keep_alive=True):
+    """
+    Replace the shared session registry, e.g. with settings from the command line
+    """
+    global default_sessions
+    default_sessions.close()
+    default_sessions = EndpointSessions(pool_size, connect_timeout, read_timeout, keep_alive)
+    return default_sessions
+
+
+def get_session(base_url):
+    """
+    Session for an endpoint from the shared registry
+    """
+    return default_sessions.get(base_url)
+
+
+def get_timeout():
+    """
+    (connect, read) timeout tuple from the shared registry
+    """
+    return default_sessions.timeout
+
+
+def print_stats():
+    """
+    Print connection reuse counters for every endpoint used so far
+    """
+    for base_url, stats in default_sessions.stats().items():
+        print(f"  {base_url}: {stats['requests']} requests over {stats['connections']} connections "
+              f"({stats['reused']} reused)")
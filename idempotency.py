@@ -0,0 +1,100 @@
+import glob
+import hashlib
+import os
+import threading
+
+import output_sink
+
+# Idempotent outputs.
+#
+# Every conversation is stored under a key derived from the job, the model and the prompt variant
+# instead of a per-thread counter and a timestamp. Workers sharing an output directory can't
+# overwrite each other, and with a completion index a job that already has an output for this
+# model and variant is skipped before the model is called, so restarts and re-dispatches don't
+# spend GPU time on duplicates.
+#
+# Two index backends:
+#   redis  a set {queue_prefix}:completed shared by every worker and host
+#   local  the keys found in the output directory at startup plus everything saved since; only
+#          sees other processes' outputs from before it started
+
+
+def output_key(job_id, model_name, variant):
+    """
+    Collision-free name of a job's output for a (clean) model name and prompt variant
+    """
+    return f"{model_name}_{job_id}_p{variant:02d}"
+
+
+def variants_for_job(job_id, num_variants, count=1, seed=0):
+    """
+    count distinct prompt variants for a job, stable across retries so a retried job maps to the
+    same output keys.
+
+    The first variant is a hash of the job id (and seed) and the rest follow it cyclically, so over
+    many jobs every variant is used equally often whatever count is.
+    """
+    token = str(job_id) if not seed else f"{seed}:{job_id}"
+    first = int(hashlib.sha1(token.encode('utf-8')).hexdigest(), 16) % num_variants
+    return [(first + offset) % num_variants for offset in range(min(count, num_variants))]
+
+
+def variant_for_job(job_id, num_variants, seed=0):
+    """
+    Prompt variant of a single-perspective job
+    """
+    return variants_for_job(job_id, num_variants, 1, seed)[0]
+
+
+def completed_set_name(queue_prefix="profiles"):
+    """
+    Name of the Redis set holding completed output keys
+    """
+    return f"{queue_prefix}:completed"
+
+
+class RedisCompletionIndex:
+    """
+    Completed output keys in a Redis set shared by all workers
+    """
+
+    def __init__(self, redis_client, queue_prefix="profiles"):
+        self.redis_client = redis_client
+        self.key = completed_set_name(queue_prefix)
+
+    def contains(self, output_key):
+        return bool(self.redis_client.sismember(self.key, output_key))
+
+    def add(self, output_key):
+        self.redis_client.sadd(self.key, output_key)
+
+    def __len__(self):
+        return self.redis_client.scard(self.key)
+
+
+class LocalCompletionIndex:
+    """
+    Completed output keys found in an output directory, kept up to date by this process
+    """
+
+    def __init__(self, output_dir):
+        self._keys = set()
+        self._lock = threading.Lock()
+        for filepath in glob.glob(os.path.join(output_dir, "**", "*.json"), recursive=True):
+            self._keys.add(os.path.splitext(os.path.basename(filepath))[0])
+        for shard in output_sink.shard_files(output_dir) if os.path.isdir(output_dir) else []:
+            for record in output_sink.iter_shard(shard):
+                if "id" in record:
+                    self._keys.add(record["id"])
+
+    def contains(self, output_key):
+        with self._lock:
+            return output_key in self._keys
+
+    def add(self, output_key):
+        with self._lock:
+            self._keys.add(output_key)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._keys)
@@ -0,0 +1,329 @@
+import argparse
+import copy
+import json
+import random
+import struct
+import threading
+import time
+
+from profile_store import ProfileStores, ProfileStoreError
+
+# Binary job payloads.
+#
+# Jobs used to be JSON text: every profile repeats the same keys, media URLs and boilerplate, so
+# most of the bytes Redis stores and ships to the workers carry no information. A codec packs the
+# job payload with msgpack and optionally compresses it with zstd, optionally with a dictionary
+# trained on sample profiles (the shared keys and URL prefixes then cost next to nothing even in a
+# single small job).
+#
+# Binary messages start with a small header; JSON jobs always start with "{", so old queues keep
+# decoding and workers accept every format whatever the dispatcher used:
+#
+#   byte 0     0x00 marker (never the first byte of a JSON document)
+#   byte 1     header version (1)
+#   byte 2     codec: 1 msgpack, 2 msgpack + zstd, 3 msgpack + zstd with a dictionary
+#   bytes 3-6  dictionary id, big-endian (codec 3 only)
+#
+# Dictionaries are published to the Redis hash {queue_prefix}:codec:dicts under their id, so
+# workers on any host fetch the one a job needs on first sight.
+#
+# Jobs dispatched with --profile-store carry a profile_ref instead of the profile; the decoder
+# resolves it from the local store (profile_store.py), so the rest of the worker never sees it.
+#
+# Train a dictionary and compare the codecs:
+#   python job_codec.py train LinkedIn_Dataset.jsonl profiles.dict
+#   python job_codec.py bench [--dictionary profiles.dict]
+
+MARKER = 0x00
+HEADER_VERSION = 1
+CODEC_IDS = {"msgpack": 1, "zstd": 2, "zstd-dict": 3}
+CODECS = ("json",) + tuple(CODEC_IDS)
+DEFAULT_LEVEL = 3
+DEFAULT_DICT_SIZE = 110 * 1024
+
+
+class JobDecodeError(ValueError):
+    """
+    A job message that can't be decoded (unknown header, codec or dictionary, or corrupt data)
+    """
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError("binary job codecs require msgpack (pip install msgpack)")
+    return msgpack
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd job codecs require zstandard (pip install zstandard)")
+    return zstandard
+
+
+def dictionaries_key(queue_prefix="profiles"):
+    """
+    Name of the Redis hash holding published compression dictionaries
+    """
+    return f"{queue_prefix}:codec:dicts"
+
+
+def load_dictionary(path):
+    """
+    Read a trained dictionary file
+    """
+    with open(path, "rb") as f:
+        return _zstandard().ZstdCompressionDict(f.read())
+
+
+def publish_dictionary(redis_client, dictionary, queue_prefix="profiles"):
+    """
+    Make a dictionary available to the workers; returns its id
+    """
+    dict_id = dictionary.dict_id()
+    redis_client.hsetnx(dictionaries_key(queue_prefix), dict_id, dictionary.as_bytes())
+    return dict_id
+
+
+class JobEncoder:
+    """
+    Encodes job payloads with one codec; one instance per dispatcher (not thread-safe)
+    """
+
+    def __init__(self, codec="json", dictionary=None, level=DEFAULT_LEVEL):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown job codec: {codec}")
+        if codec == "zstd-dict" and dictionary is None:
+            raise ValueError("the zstd-dict codec needs a trained dictionary")
+        self.codec = codec
+        self.dictionary = dictionary
+        if codec == "json":
+            return
+
+        self._packb = _msgpack().packb
+        header = bytes([MARKER, HEADER_VERSION, CODEC_IDS[codec]])
+        if codec == "zstd":
+            self._compressor = _zstandard().ZstdCompressor(level=level)
+        elif codec == "zstd-dict":
+            # The id is in our header, so zstd doesn't need to repeat it in every frame
+            self._compressor = _zstandard().ZstdCompressor(level=level, dict_data=dictionary,
+                                                           write_dict_id=False)
+            header += struct.pack(">I", dictionary.dict_id())
+        self._header = header
+
+    def encode(self, job_payload):
+        """
+        The Redis message for a job payload: JSON text, or header + msgpack (+ zstd) bytes
+        """
+        if self.codec == "json":
+            return json.dumps(job_payload, default=str)
+        packed = self._packb(job_payload, default=str, use_bin_type=True)
+        if self.codec != "msgpack":
+            packed = self._compressor.compress(packed)
+        return self._header + packed
+
+
+class JobDecoder:
+    """
+    Decodes job messages in any format, shared by worker threads.
+
+    Dictionaries are looked up in Redis by id, under the prefix of the queue the job came from,
+    the first time a job needs them and kept in memory. Profile references are resolved through
+    stores (profile_store.ProfileStores).
+    """
+
+    def __init__(self, redis_client=None, queue_prefix="profiles", stores=None):
+        self.redis_client = redis_client
+        self.queue_prefix = queue_prefix
+        self.stores = stores or ProfileStores()
+        self._dictionaries = {}
+        self._local = threading.local()
+
+    def add_dictionary(self, dictionary):
+        self._dictionaries[dictionary.dict_id()] = dictionary
+
+    def _dictionary(self, dict_id, queue_prefix):
+        dictionary = self._dictionaries.get(dict_id)
+        if dictionary is None and self.redis_client is not None:
+            data = self.redis_client.hget(dictionaries_key(queue_prefix), dict_id)
+            if data is not None:
+                dictionary = _zstandard().ZstdCompressionDict(data)
+                self._dictionaries[dict_id] = dictionary
+        if dictionary is None:
+            raise JobDecodeError(f"unknown compression dictionary {dict_id}")
+        return dictionary
+
+    def _decompressor(self, dict_id=None, queue_prefix=None):
+        # zstandard decompressors aren't thread-safe: keep one per thread and dictionary
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            if dict_id is None:
+                decompressor = _zstandard().ZstdDecompressor()
+            else:
+                decompressor = _zstandard().ZstdDecompressor(dict_data=self._dictionary(dict_id, queue_prefix))
+            decompressors[dict_id] = decompressor
+        return decompressor
+
+    def decode(self, message, queue_prefix=None):
+        """
+        The job payload of a Redis message taken from a queue under queue_prefix
+        """
+        job_payload = self._unpack(message, queue_prefix)
+        if isinstance(job_payload, dict) and "profile_ref" in job_payload:
+            try:
+                self.stores.resolve(job_payload)
+            except ProfileStoreError as e:
+                raise JobDecodeError(f"unresolvable profile reference: {e}")
+        return job_payload
+
+    def _unpack(self, message, queue_prefix):
+        if isinstance(message, str) or not message or message[0] != MARKER:
+            return json.loads(message)
+
+        if len(message) < 3 or message[1] != HEADER_VERSION:
+            raise JobDecodeError(f"unsupported job header version {message[1] if len(message) > 1 else None}")
+        codec_id = message[2]
+        try:
+            if codec_id == CODEC_IDS["msgpack"]:
+                packed = message[3:]
+            elif codec_id == CODEC_IDS["zstd"]:
+                packed = self._decompressor().decompress(message[3:])
+            elif codec_id == CODEC_IDS["zstd-dict"]:
+                (dict_id,) = struct.unpack(">I", message[3:7])
+                packed = self._decompressor(dict_id, queue_prefix or self.queue_prefix).decompress(message[7:])
+            else:
+                raise JobDecodeError(f"unknown job codec {codec_id}")
+            return _msgpack().unpackb(packed, raw=False)
+        except (JobDecodeError, ImportError):
+            raise
+        except Exception as e:
+            raise JobDecodeError(f"corrupt job message: {e}")
+
+
+def train_dictionary(samples, dict_size=DEFAULT_DICT_SIZE):
+    """
+    Train a zstd dictionary on msgpack-encoded sample job payloads
+    """
+    packb = _msgpack().packb
+    packed = [packb(sample, default=str, use_bin_type=True) for sample in samples]
+    return _zstandard().train_dictionary(dict_size, packed)
+
+
+def synthetic_jobs(template, count, seed=0):
+    """
+    Job payloads shaped like template (e.g. profile_example.json) with varied names, ids and text,
+    so a benchmark doesn't measure the same bytes over and over
+    """
+    from dispatcher import build_job_payload
+
+    rng = random.Random(seed)
+    words = sorted({word for value in json.dumps(template).split() for word in [value.strip('",:{}[]')]
+                    if word.isalpha()})
+
+    def vary(value):
+        if isinstance(value, dict):
+            return {key: vary(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [vary(item) for item in value]
+        if isinstance(value, str) and value:
+            if value.startswith("http"):
+                # Same host and path layout, different asset ids
+                return value[:value.rfind("/") + 1] + "%016x" % rng.getrandbits(64)
+            return " ".join(rng.choice(words) for _ in value.split()) or value
+        if isinstance(value, int) and not isinstance(value, bool):
+            return rng.randint(0, max(value, 1) * 2)
+        return value
+
+    jobs = []
+    for index in range(count):
+        profile = vary(copy.deepcopy(template))
+        profile["urn"] = f"ACoAA{index:012d}"
+        profile["username"] = f"user-{index}"
+        jobs.append(build_job_payload(profile))
+    return jobs
+
+
+def benchmark(jobs, dictionary=None, repeat=3):
+    """
+    Print bytes per job and encode/decode time per job for every available codec
+    """
+    decoder = JobDecoder()
+    if dictionary is not None:
+        decoder.add_dictionary(dictionary)
+
+    print(f"{len(jobs)} jobs, best of {repeat} runs:")
+    print(f"  {'codec':<10} {'bytes/job':>10} {'vs json':>8} {'encode us':>10} {'decode us':>10}")
+    json_bytes = None
+    for codec in CODECS:
+        if codec == "zstd-dict" and dictionary is None:
+            continue
+        encoder = JobEncoder(codec, dictionary)
+        messages = [encoder.encode(job) for job in jobs]
+        sizes = [len(message.encode('utf-8') if isinstance(message, str) else message) for message in messages]
+        average = sum(sizes) / len(sizes)
+        json_bytes = json_bytes or average
+
+        encode_time = min(_timed(lambda: [encoder.encode(job) for job in jobs]) for _ in range(repeat))
+        decode_time = min(_timed(lambda: [decoder.decode(message) for message in messages]) for _ in range(repeat))
+        assert decoder.decode(messages[0]) == json.loads(json.dumps(jobs[0], default=str))
+        print(f"  {codec:<10} {average:>10.0f} {average / json_bytes:>7.0%} "
+              f"{encode_time / len(jobs) * 1e6:>10.1f} {decode_time / len(jobs) * 1e6:>10.1f}")
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train compression dictionaries for job payloads and benchmark the job codecs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser("train", help="Train a zstd dictionary on profiles from a dataset")
+    train.add_argument("dataset", help="Dataset to sample profiles from (.jsonl/.jsonl.gz/.parquet/.pcl)")
+    train.add_argument("output", help="Dictionary file to write")
+    train.add_argument("--samples", default=5000, type=int, help="Profiles to train on")
+    train.add_argument("--dict-size", default=DEFAULT_DICT_SIZE, type=int, help="Dictionary size in bytes")
+
+    bench = commands.add_parser("bench", help="Compare the codecs on profile_example.json-shaped jobs")
+    bench.add_argument("--profile", default="profile_example.json", help="Profile the benchmark jobs are shaped like")
+    bench.add_argument("--jobs", default=2000, type=int, help="Jobs to encode and decode")
+    bench.add_argument("--dictionary", default=None, help="Dictionary file to use (default: train one on other synthetic jobs)")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        from dataset_loader import iter_profile_chunks
+        from dispatcher import build_job_payload
+
+        samples = []
+        for chunk in iter_profile_chunks(args.dataset, chunk_size=min(args.samples, 1000)):
+            samples.extend(build_job_payload(profile) for profile in chunk)
+            if len(samples) >= args.samples:
+                break
+        dictionary = train_dictionary(samples[:args.samples], args.dict_size)
+        with open(args.output, "wb") as f:
+            f.write(dictionary.as_bytes())
+        print(f"Trained dictionary {dictionary.dict_id()} ({len(dictionary.as_bytes())} bytes) "
+              f"on {min(len(samples), args.samples)} profiles -> {args.output}")
+        return
+
+    with open(args.profile, "r", encoding="utf-8") as f:
+        template = json.load(f)
+    jobs = synthetic_jobs(template, args.jobs)
+    if args.dictionary:
+        dictionary = load_dictionary(args.dictionary)
+    else:
+        # Train on different jobs than the ones measured
+        dictionary = train_dictionary(synthetic_jobs(template, 1000, seed=1))
+    benchmark(jobs, dictionary)
+
+
+if __name__ == '__main__':
+    main()
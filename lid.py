@@ -1,9 +1,14 @@
 import pandas as pd
-dataset_directory = "./LinkedIn_Dataset.pcl" #Change this according to your directory
-dataset = pd.read_pickle(dataset_directory)
+from dataset_loader import iter_profile_chunks
+dataset_directory = "./LinkedIn_Dataset.pcl" #Change this according to your directory (.pcl, .jsonl[.gz] or .parquet)
+
+# Only the first chunk is inspected, so a streamable dataset is never loaded as a whole
+chunks = iter_profile_chunks(dataset_directory, chunk_size=1000)
+dataset = pd.DataFrame(next(chunks, []))
+total = len(dataset) + sum(len(chunk) for chunk in chunks)
 
 # Display DataFrame info
-print("\nDataFrame Info:")
+print(f"\nDataFrame Info (first {len(dataset)} of {total} profiles):")
 print(dataset.info())
 
 # Display all column names
@@ -12,4 +17,4 @@ print(dataset.columns.tolist())
 
 # Display a single row in more detail
 print("\nDetailed view of first row:")
-print(dataset.iloc[0].to_dict())
\ No newline at end of file
+print(dataset.iloc[0].to_dict())
@@ -0,0 +1,225 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import redis
+
+import reliable_queue
+
+# Live pipeline metrics in the Prometheus text exposition format.
+#
+# Counters, gauges and histograms are kept in this module's registry and updated in place by the
+# dispatcher and the workers; with --metrics-port a daemon thread serves them at /metrics for
+# Prometheus (or curl) to scrape. Queue depths are read from Redis at scrape time with one SCAN and
+# one pipelined LLEN per prefix, so they cost nothing between scrapes. No client library needed.
+#
+#   profilegen_jobs_dispatched_total          dispatcher pushes per queue
+#   profilegen_profiles_skipped_total         duplicates dropped by the dispatcher
+#   profilegen_jobs_dequeued_total            jobs taken by workers per queue
+#   profilegen_jobs_completed_total           jobs saved per queue, endpoint and model
+#   profilegen_jobs_failed_total              jobs not saved per queue, endpoint, model and reason
+#   profilegen_requests_total                 model requests per endpoint, model and outcome
+#   profilegen_request_latency_seconds        model request latency histogram per endpoint and model
+#   profilegen_tokens_total                   prompt/completion tokens reported in the reply's usage
+#   profilegen_requests_in_flight             model requests currently open per endpoint
+#   profilegen_queue_jobs                     jobs per queue and state (pending, claimed, dead, uncached)
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """
+    A family of samples sharing a name, one per combination of label values
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """
+        (suffix, label values, extra labels, value) of every sample
+        """
+        with self._lock:
+            return [("", key, (), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def replace(self, values):
+        """
+        Replace every sample at once; values maps label value tuples to values
+        """
+        with self._lock:
+            self._values = dict(values)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _format_value(bound)
+                    samples.append(("_bucket", key, (("le", le),), cumulative))
+                samples.append(("_sum", key, (), total))
+                samples.append(("_count", key, (), cumulative))
+        return samples
+
+
+JOBS_DISPATCHED = Counter("profilegen_jobs_dispatched_total", "Jobs pushed by the dispatcher", ["queue"])
+PROFILES_SKIPPED = Counter("profilegen_profiles_skipped_total", "Duplicate profiles skipped by the dispatcher")
+JOBS_DEQUEUED = Counter("profilegen_jobs_dequeued_total", "Jobs taken from a queue by a worker", ["queue"])
+JOBS_COMPLETED = Counter("profilegen_jobs_completed_total", "Jobs whose outputs were saved",
+                         ["queue", "endpoint", "model"])
+JOBS_FAILED = Counter("profilegen_jobs_failed_total", "Jobs that could not be saved",
+                      ["queue", "endpoint", "model", "reason"])
+REQUESTS = Counter("profilegen_requests_total", "Model requests by outcome", ["endpoint", "model", "outcome"])
+REQUEST_LATENCY = Histogram("profilegen_request_latency_seconds", "Model request latency",
+                            ["endpoint", "model"])
+TOKENS = Counter("profilegen_tokens_total", "Tokens reported in completion usage", ["model", "kind"])
+IN_FLIGHT = Gauge("profilegen_requests_in_flight", "Model requests currently open", ["endpoint"])
+QUEUE_JOBS = Gauge("profilegen_queue_jobs", "Jobs per queue and state", ["queue", "state"])
+
+REGISTRY = [JOBS_DISPATCHED, PROFILES_SKIPPED, JOBS_DEQUEUED, JOBS_COMPLETED, JOBS_FAILED, REQUESTS,
+            REQUEST_LATENCY, TOKENS, IN_FLIGHT, QUEUE_JOBS]
+
+# Callables run before every scrape to refresh gauges read from elsewhere
+_collectors = []
+
+
+def record_request(endpoint, model, seconds, outcome, result=None):
+    """
+    Count a finished model request, its latency and the tokens in its usage block
+    """
+    REQUESTS.inc(endpoint=endpoint, model=model, outcome=outcome)
+    REQUEST_LATENCY.observe(seconds, endpoint=endpoint, model=model)
+    usage = result.get("usage") if isinstance(result, dict) else None
+    if isinstance(usage, dict):
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if isinstance(usage.get(kind), int):
+                TOKENS.inc(usage[kind], model=model, kind=kind.split("_")[0])
+
+
+def watch_queues(redis_client, queue_prefixes):
+    """
+    Report the depth of every queue under the prefixes at each scrape
+    """
+    # Redis drops empty lists, so queues seen before are reported as 0 instead of vanishing
+    seen = {}
+
+    def collect():
+        values = dict.fromkeys(seen, 0)
+        try:
+            for prefix in queue_prefixes:
+                for queue_name, counts in reliable_queue.queue_depths(redis_client, prefix).items():
+                    for state, count in counts.items():
+                        values[(queue_name, state)] = count
+        except redis.exceptions.RedisError as e:
+            print(f"Redis error reading queue depths: {e}")
+            return
+        seen.update(values)
+        QUEUE_JOBS.replace(values)
+    _collectors.append(collect)
+
+
+def render():
+    """
+    Every metric in the Prometheus text format
+    """
+    for collect in _collectors:
+        collect()
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the job log
+        pass
+
+
+def start_server(port, host="0.0.0.0"):
+    """
+    Serve /metrics from a daemon thread; returns the server
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics at http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,251 @@
+import glob
+import gzip
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+# Append-only sharded JSONL output.
+#
+# Writing one pretty-printed file per conversation creates millions of small files, which is slow
+# on shared filesystems both to write and to load later. The writer here buffers conversations in
+# memory and appends them as compact JSON lines to the current shard of this process, starting a
+# new shard once it holds max_records conversations or max_bytes of JSON. Each flush is appended
+# as its own gzip member / zstd frame, so compressed shards stay valid to read after every flush.
+#
+# Shards are named <prefix>-<host>-<pid>-<start time>-<sequence>.jsonl[.gz|.zst], so several
+# workers can share one output directory.
+
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+SHARD_PATTERNS = ("*.jsonl", "*.jsonl.gz", "*.jsonl.zst")
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compressed shards require zstandard (pip install zstandard)")
+    return zstandard
+
+
+class ShardedJsonlWriter:
+    """
+    Thread-safe buffered sink appending one JSON line per conversation to rotating shards
+    """
+
+    def __init__(self, output_dir, prefix="conversations", max_records=10000, max_bytes=256 * 1024 * 1024,
+                 compression=None, buffer_size=100, flush_interval=5.0):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown shard compression: {compression}")
+        if compression == "zstd":
+            self._compressor = _zstandard().ZstdCompressor()
+
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        self.shard_stem = f"{prefix}-{socket.gethostname()}-{os.getpid()}-{int(time.time())}"
+        self.shard_index = 0
+        self.shard_records = 0
+        self.shard_bytes = 0
+        self.records_written = 0
+        self.shards_written = 0
+
+        self._buffer = []
+        self._callbacks = []
+        self._buffer_lock = threading.Lock()
+        # Held while writing so flushes from different threads reach the shard in order
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._timer = None
+        self._closed = False
+
+    @property
+    def shard_path(self):
+        """
+        Path of the shard the next flush appends to
+        """
+        suffix = COMPRESSION_SUFFIXES[self.compression]
+        return os.path.join(self.output_dir, f"{self.shard_stem}-{self.shard_index:05d}.jsonl{suffix}")
+
+    def start(self):
+        """
+        Start flushing on a timer in a daemon thread
+        """
+        if self.flush_interval and self._timer is None:
+            self._timer = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._timer.start()
+        return self
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def write(self, record, on_flush=None):
+        """
+        Buffer one conversation; on_flush is called once it has been written to disk.
+
+        Returns the shard path the record is going to.
+        """
+        line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode('utf-8')
+        with self._buffer_lock:
+            self._buffer.append(line)
+            if on_flush is not None:
+                self._callbacks.append(on_flush)
+            full = len(self._buffer) >= self.buffer_size
+            path = self.shard_path
+        if full:
+            self.flush()
+        return path
+
+    def flush(self):
+        """
+        Append buffered conversations to the current shard, rotating as needed.
+
+        Returns the number of conversations written.
+        """
+        with self._write_lock:
+            with self._buffer_lock:
+                lines, self._buffer = self._buffer, []
+                callbacks, self._callbacks = self._callbacks, []
+            if not lines:
+                return 0
+
+            start = 0
+            try:
+                os.makedirs(self.output_dir, exist_ok=True)
+                while start < len(lines):
+                    # Fill the current shard up to its record and size limits
+                    end = start
+                    size = 0
+                    while (end < len(lines) and self.shard_records + end - start < self.max_records
+                           and (self.shard_bytes + size + len(lines[end]) <= self.max_bytes
+                                or (self.shard_records == 0 and end == start))):
+                        size += len(lines[end])
+                        end += 1
+                    if end == start:
+                        self._rotate()
+                        continue
+
+                    self._append(lines[start:end])
+                    self.shard_records += end - start
+                    self.shard_bytes += size
+                    start = end
+                    if self.shard_records >= self.max_records or self.shard_bytes >= self.max_bytes:
+                        self._rotate()
+            except Exception as e:
+                print(f"Error writing conversations to {self.shard_path}: {e}")
+                # Keep the unwritten records (and their callbacks) for the next flush
+                with self._buffer_lock:
+                    self._buffer[:0] = lines[start:]
+                    self._callbacks[:0] = callbacks
+                return 0
+
+            self.records_written += len(lines)
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in output flush callback: {e}")
+        return len(lines)
+
+    def _append(self, lines):
+        data = b"".join(lines)
+        if self.compression == "gzip":
+            data = gzip.compress(data)
+        elif self.compression == "zstd":
+            data = self._compressor.compress(data)
+        if self.shard_records == 0:
+            self.shards_written += 1
+        with open(self.shard_path, 'ab') as f:
+            f.write(data)
+
+    def _rotate(self):
+        self.shard_index += 1
+        self.shard_records = 0
+        self.shard_bytes = 0
+
+    def close(self):
+        """
+        Stop the flush timer and write everything still buffered; later calls do nothing
+        """
+        if self._closed:
+            return 0
+        self._closed = True
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.join()
+            self._timer = None
+        written = self.flush()
+        print(f"Output sink: {self.records_written} conversations in {self.shards_written} shards "
+              f"under {self.output_dir}")
+        return written
+
+
+def shard_files(path):
+    """
+    Shards in an output directory (or the single shard given), oldest first
+    """
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for pattern in SHARD_PATTERNS:
+        files.extend(glob.glob(os.path.join(path, "**", pattern), recursive=True))
+    return sorted(files)
+
+
+def iter_shard(path):
+    """
+    Yield conversations from one shard.
+
+    A truncated last line (a writer killed mid-flush) is skipped with a warning.
+    """
+    if path.endswith(".zst"):
+        raw = open(path, 'rb')
+        stream = io.TextIOWrapper(_zstandard().ZstdDecompressor().stream_reader(raw, read_across_frames=True),
+                                  encoding='utf-8')
+    elif path.endswith(".gz"):
+        stream = gzip.open(path, 'rt', encoding='utf-8')
+    else:
+        stream = open(path, 'r', encoding='utf-8')
+
+    with stream:
+        try:
+            for line in stream:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Warning: skipping truncated record in {path}")
+        except EOFError:
+            print(f"Warning: {path} ends in an incomplete compressed block")
+
+
+def iter_conversations(path):
+    """
+    Yield every conversation under an output directory: sharded JSONL as well as the
+    one-file-per-conversation .json layout
+    """
+    for shard in shard_files(path):
+        yield from iter_shard(shard)
+    if os.path.isdir(path):
+        for filepath in sorted(glob.glob(os.path.join(path, "**", "*.json"), recursive=True)):
+            with open(filepath, 'r', encoding='utf-8') as f:
+                yield json.load(f)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python output_sink.py <output_dir|shard>")
+        sys.exit(1)
+    total = sum(1 for _ in iter_conversations(sys.argv[1]))
+    print(f"{total} conversations in {sys.argv[1]} ({len(shard_files(sys.argv[1]))} shards)")
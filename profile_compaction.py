@@ -0,0 +1,152 @@
+import json
+import math
+import sys
+
+# Token-lean profile serialization for prompts.
+#
+# Raw LinkedIn profiles are mostly signed image URLs, locale duplicates, identifiers and null
+# fields, none of which help the model judge someone's professional personality but all of which
+# are paid for as prefill tokens. compact_profile projects a profile down to the useful fields and
+# serialize_profile writes it without indentation whitespace.
+
+# Keys removed at any depth unless an allowlist says otherwise
+DEFAULT_DENYLIST = (
+    "urn",
+    "profilePicture",
+    "backgroundImage",
+    "companyLogo",
+    "companyURL",
+    "companyUsername",
+    "url",
+    "schoolId",
+    "supportedLocales",
+    "multiLocaleFirstName",
+    "multiLocaleLastName",
+    "multiLocaleHeadline",
+    "multiLocaleTitle",
+    "multiLocaleCompanyName",
+)
+
+# Longest list kept (positions, skills, educations, ...); the most recent entries come first
+DEFAULT_MAX_LIST_ITEMS = 10
+
+COMPACT_SEPARATORS = (",", ":")
+
+
+def is_empty(value):
+    """
+    True for null-like values that carry no information: None, NaN, "", [] and {}
+    """
+    if value is None:
+        return True
+    if isinstance(value, float) and math.isnan(value):
+        return True
+    if isinstance(value, (str, list, tuple, dict)) and len(value) == 0:
+        return True
+    return False
+
+
+def _compact_value(value, denylist, drop_empty, max_list_items):
+    if hasattr(value, 'to_dict'):
+        value = value.to_dict()
+
+    if isinstance(value, dict):
+        compacted = {}
+        for key, item in value.items():
+            if key in denylist:
+                continue
+            item = _compact_value(item, denylist, drop_empty, max_list_items)
+            if drop_empty and is_empty(item):
+                continue
+            compacted[key] = item
+        return compacted
+
+    if isinstance(value, (list, tuple)):
+        if max_list_items is not None:
+            value = value[:max_list_items]
+        compacted = []
+        for item in value:
+            item = _compact_value(item, denylist, drop_empty, max_list_items)
+            if drop_empty and is_empty(item):
+                continue
+            compacted.append(item)
+        return compacted
+
+    return value
+
+
+def compact_profile(profile, allowlist=None, denylist=DEFAULT_DENYLIST, drop_empty=True,
+                    max_list_items=DEFAULT_MAX_LIST_ITEMS):
+    """
+    Project a profile down to the fields worth sending to the model.
+
+    Args:
+        profile (dict): The profile, as stored in the job payload.
+        allowlist (iterable): If given, only these top-level keys are kept.
+        denylist (iterable): Keys dropped at any depth.
+        drop_empty (bool): Drop None/NaN values and empty strings, lists and dicts.
+        max_list_items (int): Truncate every list to this many items (None keeps all).
+
+    Returns:
+        dict: A new, compacted profile; the input is left untouched.
+    """
+    if hasattr(profile, 'to_dict'):
+        profile = profile.to_dict()
+
+    if allowlist is not None:
+        allowed = set(allowlist)
+        profile = {key: value for key, value in profile.items() if key in allowed}
+
+    return _compact_value(profile, frozenset(denylist or ()), drop_empty, max_list_items)
+
+
+def serialize_profile(profile, compact=True, **options):
+    """
+    Serialize a profile for a prompt.
+
+    With compact=False this is the historical json.dumps(..., indent=2) of the full profile;
+    otherwise the profile goes through compact_profile (options are passed along) and is dumped
+    with compact separators.
+    """
+    if not compact:
+        return json.dumps(profile, default=str, indent=2)
+    return json.dumps(compact_profile(profile, **options), default=str, ensure_ascii=False,
+                      separators=COMPACT_SEPARATORS)
+
+
+def estimate_tokens(text):
+    """
+    Rough token count (about four characters per token for English JSON)
+    """
+    return (len(text) + 3) // 4
+
+
+def compaction_report(profile, compacted_text):
+    """
+    Before/after size of a profile in characters and estimated tokens
+    """
+    original_text = serialize_profile(profile, compact=False)
+    return {
+        "chars_before": len(original_text),
+        "chars_after": len(compacted_text),
+        "tokens_before": estimate_tokens(original_text),
+        "tokens_after": estimate_tokens(compacted_text)
+    }
+
+
+def format_report(report):
+    """
+    One-line summary of a compaction_report
+    """
+    saved = 1 - report["chars_after"] / report["chars_before"] if report["chars_before"] else 0.0
+    return (f"{report['chars_before']} -> {report['chars_after']} chars, "
+            f"~{report['tokens_before']} -> ~{report['tokens_after']} tokens ({saved:.0%} saved)")
+
+
+if __name__ == '__main__':
+    # Usage: python profile_compaction.py [profile.json ...]
+    for path in sys.argv[1:] or ["profile_example.json"]:
+        with open(path, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+        compacted_text = serialize_profile(profile)
+        print(f"{path}: {format_report(compaction_report(profile, compacted_text))}")
@@ -0,0 +1,273 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+
+# Claim-check profile storage.
+#
+# With --profile-store the dispatcher keeps profiles out of Redis: each profile is appended to a
+# local store file and the job only carries its job_id and a reference to the row, e.g.
+#   {"job_id": "...", "profile_ref": {"store": "/scratch/profiles.store", "row": 1234}}
+# so queues stay a few dozen bytes per job whatever the profile size. Workers on the same node (or
+# a shared filesystem) map the store read-only and slice the row straight out of the page cache.
+#
+# A store is two files:
+#
+#   profiles.store      the records back to back, each followed by "\n" (raw profile JSON, so a
+#                       JSON store is also a valid .jsonl dataset, or compacted profile text)
+#   profiles.store.idx  16-byte header (magic, record kind), then one little-endian uint64 per
+#                       row: the offset just past the row's record in the data file
+#
+# Rows are only ever appended. The writer flushes the data file before the index, so a row that a
+# reader finds in the index is always complete; readers remap when asked for a row past the end
+# of their mapping. A writer reopening a store after a crash drops any torn tail.
+#
+# Rows are written before the jobs that reference them are pushed, so a push that fails leaves
+# rows no job points to. The writer reuses such a row when the same record is appended again, and
+# lists the ones still unreferenced when it is closed in profiles.store.orphans (one row per line)
+# so a later compaction can drop them.
+
+INDEX_MAGIC = b"PROFIDX1"
+KINDS = {"json": 0, "text": 1}
+HEADER = struct.Struct("<8sQ")
+ENTRY = struct.Struct("<Q")
+
+
+class ProfileStoreError(LookupError):
+    """
+    A profile reference that can't be resolved (missing store, unknown row or corrupt index)
+    """
+
+
+def index_path(path):
+    """
+    Path of a store's row index
+    """
+    return path + ".idx"
+
+
+def orphans_path(path):
+    """
+    Path of the list of a store's rows that no job references
+    """
+    return path + ".orphans"
+
+
+def _read_header(index_file, path):
+    header = index_file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ProfileStoreError(f"{index_path(path)} has no header")
+    magic, kind_id = HEADER.unpack(header)
+    kind = next((name for name, value in KINDS.items() if value == kind_id), None)
+    if magic != INDEX_MAGIC or kind is None:
+        raise ProfileStoreError(f"{index_path(path)} is not a profile store index")
+    return kind
+
+
+class ProfileStoreWriter:
+    """
+    Appends records to a store; one instance per dispatcher (not thread-safe)
+    """
+
+    def __init__(self, path, kind="json"):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown profile store kind: {kind}")
+        # References carry the path, so make it mean the same thing to every worker on the node
+        self.path = os.path.abspath(path)
+        self.kind = kind
+        index_file = index_path(self.path)
+
+        if os.path.exists(index_file) and os.path.getsize(index_file) > 0:
+            with open(index_file, "rb") as f:
+                existing = _read_header(f, self.path)
+            if existing != kind:
+                raise ValueError(f"{self.path} holds {existing} records, not {kind}")
+            self.rows, self.end = self._recover()
+        else:
+            with open(index_file, "wb") as f:
+                f.write(HEADER.pack(INDEX_MAGIC, KINDS[kind]))
+            open(self.path, "wb").close()
+            self.rows, self.end = 0, 0
+
+        self._data = open(self.path, "ab")
+        self._index = open(index_file, "ab")
+        # Rows not yet referenced by a pushed job, by record
+        self._unpublished = {}
+
+    def _recover(self):
+        # Keep the rows whose records made it to disk and cut everything after them
+        index_file = index_path(self.path)
+        data_size = os.path.getsize(self.path)
+        with open(index_file, "rb") as f:
+            f.seek(HEADER.size)
+            entries = f.read()
+        rows, end = 0, 0
+        for (offset,) in ENTRY.iter_unpack(entries[:len(entries) - len(entries) % ENTRY.size]):
+            if offset > data_size:
+                break
+            rows, end = rows + 1, offset
+        os.truncate(index_file, HEADER.size + rows * ENTRY.size)
+        os.truncate(self.path, end)
+        return rows, end
+
+    def append(self, record):
+        """
+        Append a record (str) and return its row; call flush() before publishing the row, and
+        published() once a pushed job references it. A record whose row is still unpublished
+        (its push failed) gets that row again instead of a new one.
+        """
+        row = self._unpublished.get(record)
+        if row is not None:
+            return row
+        data = record.encode('utf-8') + b"\n"
+        self._data.write(data)
+        self.end += len(data)
+        self._index.write(ENTRY.pack(self.end))
+        row = self.rows
+        self.rows += 1
+        self._unpublished[record] = row
+        return row
+
+    def published(self, rows):
+        """
+        Mark rows as referenced by jobs that were pushed
+        """
+        rows = set(rows)
+        self._unpublished = {record: row for record, row in self._unpublished.items() if row not in rows}
+
+    def reference(self, row):
+        """
+        The profile_ref a job carries for a row
+        """
+        return {"store": self.path, "row": row}
+
+    def flush(self):
+        # Data first: an index entry must never point past the data a reader can see
+        self._data.flush()
+        self._index.flush()
+
+    def close(self):
+        self.flush()
+        self._data.close()
+        self._index.close()
+        if self._unpublished:
+            orphans = sorted(self._unpublished.values())
+            with open(orphans_path(self.path), "a", encoding="utf-8") as f:
+                f.writelines(f"{row}\n" for row in orphans)
+            print(f"{len(orphans)} rows of {self.path} belong to no job; listed in {orphans_path(self.path)}")
+            self._unpublished = {}
+
+
+class ProfileStore:
+    """
+    Read-only, memory-mapped view of a store, shared by worker threads
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(index_path(path), "rb") as f:
+                self.kind = _read_header(f, path)
+        except FileNotFoundError:
+            raise ProfileStoreError(f"profile store {path} not found")
+        self._map()
+
+    @staticmethod
+    def _map_file(path):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _map(self):
+        # The index first: the data file is flushed ahead of it, so it covers every mapped row.
+        # Old maps are left to the garbage collector, since other threads may still hold views
+        index = self._map_file(index_path(self.path))
+        data = self._map_file(self.path)
+        self._index, self._data = index, data
+        self.rows = max(len(index) - HEADER.size, 0) // ENTRY.size
+
+    def __len__(self):
+        return self.rows
+
+    def record(self, row):
+        """
+        The record of a row as a memoryview into the mapped file (no copy), without its newline
+        """
+        if not 0 <= row < self.rows:
+            with self._lock:
+                if row >= self.rows:
+                    self._map()
+            if not 0 <= row < self.rows:
+                raise ProfileStoreError(f"row {row} is not in {self.path} ({self.rows} rows)")
+        index, data = self._index, self._data
+        start = ENTRY.unpack_from(index, HEADER.size + (row - 1) * ENTRY.size)[0] if row else 0
+        (end,) = ENTRY.unpack_from(index, HEADER.size + row * ENTRY.size)
+        return memoryview(data)[start:end - 1]
+
+    def text(self, row):
+        return str(self.record(row), 'utf-8')
+
+
+class ProfileStores:
+    """
+    Resolves profile references in job payloads, opening each store once.
+
+    References name the store by the dispatcher's absolute path; with store_dir the file of the
+    same name in that directory is used instead (the store was copied or mounted elsewhere).
+    """
+
+    def __init__(self, store_dir=None):
+        self.store_dir = store_dir
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        store = self._stores.get(path)
+        if store is None:
+            with self._lock:
+                store = self._stores.get(path)
+                if store is None:
+                    local = os.path.join(self.store_dir, os.path.basename(path)) if self.store_dir else path
+                    store = self._stores[path] = ProfileStore(local)
+        return store
+
+    def resolve(self, job_payload):
+        """
+        Replace a job's profile_ref with the profile_data (or profile_text) it points to
+        """
+        reference = job_payload.pop("profile_ref", None)
+        if reference is None:
+            return job_payload
+        try:
+            store = self.get(reference["store"])
+            text = store.text(int(reference["row"]))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ProfileStoreError(f"bad profile reference {reference!r}: {e}")
+        if store.kind == "text":
+            job_payload["profile_text"] = text
+        else:
+            job_payload["profile_data"] = json.loads(text)
+        return job_payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a claim-check profile store")
+    parser.add_argument("store", help="Store written by dispatcher.py --profile-store")
+    parser.add_argument("rows", nargs="*", type=int, help="Rows to print")
+    args = parser.parse_args()
+
+    store = ProfileStore(args.store)
+    print(f"{args.store}: {len(store)} {store.kind} rows, {len(store._data)} bytes")
+    if os.path.exists(orphans_path(args.store)):
+        with open(orphans_path(args.store), encoding="utf-8") as f:
+            print(f"{len(set(f.read().split()))} rows belong to no job (see {orphans_path(args.store)})")
+    for row in args.rows:
+        print(store.text(row))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,30 @@ import requests
 import os
 import time
 import random
-from threading import Thread
+import signal
+import tempfile
+from threading import Thread, Event, Lock, current_thread, main_thread, get_ident
+from concurrent.futures import ThreadPoolExecutor
 import argparse
+import atexit
+import socket
+from functools import partial
+
+import reliable_queue
+import queue_scheduler
+import metrics
+import job_codec
+import profile_store
+import http_sessions
+import endpoint_health
+import router as router_module
+import output_sink
+import idempotency
+import response_cache
+from profile_compaction import serialize_profile, compaction_report, format_report, DEFAULT_DENYLIST
+import prompt_templates
+from prompt_templates import splice_prompt, RESPONSE_JSON_SCHEMA, GUIDED_MODES, LAYOUTS
+from response_validation import ResponseValidator
 
 subprompts = ["You are a professional personality analyst. Analyze this LinkedIn profile and provide insights about how this person comes across professionally.",
               "You are a seasoned executive coach. Review the provided LinkedIn profile and offer your analysis of this individual's professional persona.",
@@ -29,7 +51,14 @@ subprompts = ["You are a professional personality analyst. Analyze this LinkedIn
               "Assume the persona of a digital identity advisor. How does this person come across professionally, based on an analysis of their LinkedIn profile?",
               "You are a recruitment AI. Process the following LinkedIn profile and output your analysis of the candidate's professional personality."]
 
-def buildprompt(subprompt, profile):
+def buildprompt(subprompt, profile, compaction=None, layout="persona_first"):
+    """
+    Build the full prompt for a profile
+
+    compaction is None to embed the full, indented profile, or a dict of
+    profile_compaction.compact_profile options to embed a compacted one.
+    layout orders subprompt, schema instructions and profile (see prompt_templates).
+    """
     # Convert profile to native Python types if it's a string
     if isinstance(profile, str):
         try:
@@ -43,39 +72,30 @@ def buildprompt(subprompt, profile):
     if hasattr(profile_data, 'to_dict'):
         profile_data = profile_data.to_dict()
 
-    prompt = f'''{subprompt}
-
-Based on the profile data below, analyze their professional personality and return ONLY a valid JSON response with this exact structure:
-
-{{
-  "personality_traits": ["trait1", "trait2", "trait3", "trait4", "trait5"],
-  "communication_style": "Formal|Casual|Inspiring|Analytical|Collaborative|Strategic|Visionary|Methodical|Approachable|Direct|Results-Driven|Detail-Oriented|Creative|Supportive|Diplomatic|Energetic|Pragmatic|Authoritative|Technical|Nurturing",
-  "vibe_category": "Leader|Innovator|Collaborator|Expert|Strategist|Mentor|Builder|Connector|Problem-Solver|Communicator|Organizer|Visionary|Executor|Analyst|Mediator|Pioneer|Motivator|Guardian|Architect|Advocate",
-  "confidence_score": 93,
-  "key_strength": "one sentence describing their main professional strength",
-  "growth_area": "one sentence describing an area for potential growth",
-  "radar_data": [
-    {{"trait": "Leadership", "score": 83}},
-    {{"trait": "Innovation", "score": 76}},
-    {{"trait": "Empathy", "score": 89}},
-    {{"trait": "Analytics", "score": 74}},
-    {{"trait": "Communication", "score": 82}}
-  ]
-}}
-
-Profile Data:
-{json.dumps(profile_data, default=str, indent=2)}
-'''
-    return prompt
+    if compaction is not None and isinstance(profile_data, dict):
+        profile_text = serialize_profile(profile_data, **compaction)
+    else:
+        profile_text = json.dumps(profile_data, default=str, indent=2)
+
+    return splice_prompt(subprompt, profile_text, layout)
 
-def call_model_api(prompt, port, model_name):
+def prompt_for_job(subprompt, job_payload, compaction=None, layout="persona_first"):
     """
-    Make API call to vLLM model running on localhost at specified port
-    Uses the /v1/chat/completions endpoint as specified in models.md
+    Build the prompt for a decoded job payload
+
+    Jobs dispatched with --compact-profile carry a ready-made profile_text that is spliced in
+    as-is: it was compacted with the dispatcher's options, and the worker's compaction options
+    don't apply to it. Other jobs carry profile_data, which is serialized exactly once here.
+    """
+    profile_text = job_payload.get('profile_text')
+    if profile_text is not None:
+        return splice_prompt(subprompt, profile_text, layout)
+    return buildprompt(subprompt, job_payload.get('profile_data'), compaction, layout)
+
+def build_chat_payload(prompt, model_name):
+    """
+    Build the /v1/chat/completions request body for a prompt
     """
-    url = f"http://localhost:{port}/v1/chat/completions"
-    clean_model_name = model_name.replace(":", "").lower()  # Clean model name for filenames
-    
     payload = {
         "model": model_name,
         "messages": [
@@ -85,110 +105,584 @@ def call_model_api(prompt, port, model_name):
             }
         ],
         "temperature": 0.7,
-        "max_tokens": 3000
+        "max_tokens": prompt_templates.decoding_options["max_tokens"]
     }
-    
-    headers = {
-        "Content-Type": "application/json"
+
+    guided = prompt_templates.decoding_options["guided"]
+    if guided == "guided_json":
+        payload["guided_json"] = RESPONSE_JSON_SCHEMA
+    elif guided is not None:
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "personality_analysis", "schema": RESPONSE_JSON_SCHEMA, "strict": True}
+        }
+        if guided == "ollama":
+            payload["format"] = RESPONSE_JSON_SCHEMA
+    return payload
+
+def extract_reply(result):
+    """
+    Pull the assistant reply out of a chat completion response, or None if there is none
+    """
+    if 'choices' in result and len(result['choices']) > 0:
+        return result['choices'][0]['message']['content'].strip()
+    return None
+
+def clean_model_name_for(model_name):
+    """
+    Clean model name for filenames
+    """
+    return model_name.replace(":", "").replace("/", "_").lower()
+
+def conversation_for(prompt, response):
+    """
+    Create conversation data in the required format
+    """
+    return {
+        "messages": [
+            {
+                "role": "user", 
+                "content": prompt
+            },
+            {
+                "role": "assistant", 
+                "content": response
+            }
+        ]
     }
+
+def request_completion(prompt, port, model_name):
+    """
+    Make API call to vLLM model running on localhost at specified port
+    Uses the /v1/chat/completions endpoint as specified in models.md
+
+    Requests go through the pooled keep-alive session shared by all threads using this endpoint,
+    and every outcome is recorded in the endpoint's health (backoff and circuit breaker).
+
+    Returns (reply or None, clean model name, endpoint_failed). endpoint_failed is True when the
+    endpoint itself misbehaved (unreachable, timeout, 5xx, 404, 429) rather than the request
+    being rejected or answered without choices.
+    """
+    base_url = f"http://localhost:{port}"
+    url = f"{base_url}/v1/chat/completions"
+    clean_model_name = clean_model_name_for(model_name)
+    health = endpoint_health.get_health(base_url)
+    
+    payload = build_chat_payload(prompt, model_name)
+    endpoint = f"localhost:{port}"
     
+    # A request that finds the half-open probe in flight follows its outcome
+    permit = health.wait_for_request()
+    if not permit:
+        # The breaker just opened (or the probe failed)
+        print(f"Endpoint {base_url} is paused by its circuit breaker")
+        return None, clean_model_name, True
+
+    metrics.IN_FLIGHT.inc(endpoint=endpoint)
+    started = time.monotonic()
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
+        session = http_sessions.get_session(base_url)
+        response = session.post(url, json=payload, timeout=http_sessions.get_timeout())
         response.raise_for_status()
         
         result = response.json()
-        if 'choices' in result and len(result['choices']) > 0:
-            return result['choices'][0]['message']['content'].strip(), clean_model_name
-        else:
-            return None, clean_model_name
+        health.record_success()
+        metrics.record_request(endpoint, model_name, time.monotonic() - started, "ok", result)
+        return extract_reply(result), clean_model_name, False
             
+    except ValueError as e:
+        # A 200 whose body isn't JSON is the endpoint's fault, not the job's (requests'
+        # JSONDecodeError is also a RequestException, so this has to come first)
+        print(f"Invalid response from model API on port {port}: {e}")
+        metrics.record_request(endpoint, model_name, time.monotonic() - started, "invalid")
+        health.record_failure()
+        return None, clean_model_name, True
     except requests.exceptions.RequestException as e:
         print(f"Error calling model API on port {port}: {e}")
-        return None, clean_model_name
+        status_code = e.response.status_code if e.response is not None else None
+        metrics.record_request(endpoint, model_name, time.monotonic() - started,
+                               "error" if status_code is None else str(status_code))
+        if endpoint_health.is_endpoint_failure(status_code):
+            health.record_failure()
+            return None, clean_model_name, True
+        health.record_success()
+        return None, clean_model_name, False
+    except BaseException:
+        if permit == endpoint_health.PROBE:
+            health.cancel_probe()
+        raise
+    finally:
+        metrics.IN_FLIGHT.dec(endpoint=endpoint)
+
+def call_model_api(prompt, port, model_name):
+    """
+    Make API call to vLLM model running on localhost at specified port
+
+    Returns (reply or None, clean model name); see request_completion
+    """
+    response, clean_model_name, _ = request_completion(prompt, port, model_name)
+    return response, clean_model_name
 
-def save_conversation(model_name, index, conversation_data, output_dir="../output"):
+def save_conversation(model_name, index, conversation_data, output_dir="../output", key=None):
     """
-    Save conversation in the specified format to output folder with timestamp to prevent overwriting
+    Save conversation in the specified format to output folder
+
+    With an output key (see idempotency.output_key) the file is named after it, so a job's output
+    has one name whichever worker writes it; otherwise a timestamp is added to prevent overwriting.
+    The file is written under a temporary name and renamed, so it never exists half-written.
+
+    Returns the path of the saved file, or None if it could not be written
     """
     os.makedirs(output_dir, exist_ok=True)
     
-    # Add timestamp to filename
-    timestamp = int(time.time())
-    filename = f"{model_name}_{index}_{timestamp}.json"
+    if key is not None:
+        filename = f"{key}.json"
+    else:
+        # Add timestamp to filename
+        timestamp = int(time.time())
+        filename = f"{model_name}_{index}_{timestamp}.json"
     filepath = os.path.join(output_dir, filename)
     
+    temp_path = None
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
+        # A unique temporary name per write: duplicate profiles share output keys, so two threads
+        # may save the same file at once, and each must publish a complete copy
+        fd, temp_path = tempfile.mkstemp(prefix=f"{filename}.", suffix=".tmp", dir=output_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
             json.dump(conversation_data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, filepath)
         print(f"Saved conversation to {filepath}")
+        return filepath
     except Exception as e:
         print(f"Error saving conversation to {filepath}: {e}")
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+def generate_reply(prompt, port, model_name, cache=None, cache_only=False, validator=None):
+    """
+    Reply to a prompt from the response cache if possible, otherwise from the model
+
+    With a validator (response_validation.ResponseValidator) only usable replies are returned,
+    normalized to their JSON; an invalid reply is asked for again up to validator.retries times.
+    Only usable replies are cached. cache_only never calls the model.
+
+    Returns (reply or None, clean model name, endpoint_failed, model requests made)
+    """
+    clean_model_name = clean_model_name_for(model_name)
+
+    if cache is not None:
+        request_key = response_cache.cache_key(build_chat_payload(prompt, model_name))
+        reply = cache.get(request_key)
+        if reply is not None and validator is not None:
+            reply = validator.check(clean_model_name, reply)
+        if reply is not None:
+            print(f"Using cached reply from {model_name}")
+            return reply, clean_model_name, False, 0
+    if cache_only:
+        return None, clean_model_name, False, 0
+
+    attempts = 1 + (validator.retries if validator is not None else 0)
+    for attempt in range(1, attempts + 1):
+        reply, clean_model_name, endpoint_failed = request_completion(prompt, port, model_name)
+        if not reply:
+            return None, clean_model_name, endpoint_failed, attempt
+        if validator is not None:
+            reply = validator.check(clean_model_name, reply)
+            if reply is None:
+                if attempt < attempts:
+                    print(f"Asking {model_name} again ({attempt}/{attempts - 1} retries)")
+                continue
+        if cache is not None:
+            cache.put(request_key, model_name, reply)
+        return reply, clean_model_name, False, attempt
+    return None, clean_model_name, False, attempts
+
+def job_saved(redis_client, queue_name, processing_list, message, key=None, completed=None):
+    """
+    Bookkeeping once a job's output is on disk: acknowledge it if it was claimed into a
+    processing list and record its output key in the completion index
+    """
+    if processing_list is not None:
+        reliable_queue.ack_job(redis_client, queue_name, processing_list, message)
+    if completed is not None and key is not None:
+        completed.add(key)
+
+def return_job(redis_client, queue_name, processing_list, message):
+    """
+    Put a job that wasn't its own fault back at the head of its queue, without charging an attempt
+    """
+    if processing_list is not None:
+        return reliable_queue.release_job(redis_client, queue_name, processing_list, message,
+                                          front=True, count_attempt=False) == "requeued"
+    # Consumers pop from the right, so RPUSH makes this the next job out
+    redis_client.rpush(queue_name, message)
+    return True
+
+class InFlightJobs:
+    """
+    The job each worker thread is working on, so a shutdown can return the ones still unfinished
+    when the drain timeout runs out
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = Lock()
+
+    def started(self, queue_name, processing_list, message):
+        with self._lock:
+            self._jobs[get_ident()] = (queue_name, processing_list, message)
+
+    def finished(self):
+        with self._lock:
+            self._jobs.pop(get_ident(), None)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def return_all(self, redis_client):
+        """
+        Return every unfinished job to the head of its queue; returns how many were returned
+        """
+        with self._lock:
+            jobs = list(self._jobs.values())
+            self._jobs.clear()
+        returned = 0
+        # Newest first, so the job started first ends up first in line again
+        for queue_name, processing_list, message in reversed(jobs):
+            try:
+                returned += return_job(redis_client, queue_name, processing_list, message)
+            except redis.exceptions.RedisError as e:
+                print(f"Could not return a job to {queue_name}: {e}")
+        return returned
+
+def drain_workers(threads, stop, in_flight, redis_client, drain_timeout):
+    """
+    Stop the worker threads taking jobs and wait up to drain_timeout seconds for the jobs in
+    flight; those still unfinished then are returned to the head of their queues. A Ctrl+C while
+    waiting stops waiting. Returns (threads still busy, jobs returned)
+    """
+    stop.set()
+    deadline = time.monotonic() + drain_timeout
+    try:
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+    except KeyboardInterrupt:
+        print("Not waiting any longer.")
+    busy = sum(thread.is_alive() for thread in threads)
+    return busy, in_flight.return_all(redis_client) if busy else 0
 
-def process_queue(queue_id, redis_client, port, model_name, output_dir="../output", queue_prefix="profiles"):
+def process_queue(queue_id, redis_client, port, model_name, output_dir="../output", queue_prefix="profiles",
+                  reliable=False, worker_id=None, max_attempts=3, compaction=None, report_compaction=False,
+                  layout="persona_first", ready_timeout=0, router=None, sink=None,
+                  completed=None, cache=None, cache_only=False, validator=None, perspectives=1,
+                  persona_seed=0, fanout_models=None, scheduler=None, decoder=None, stop=None,
+                  in_flight=None):
     """
     Process jobs from a specific Redis queue for a specific model port
+
+    In reliable mode jobs are claimed into a per-worker processing list and only acknowledged
+    once the conversation has been saved; failed jobs are requeued (or dead-lettered after
+    max_attempts), and jobs of a crashed worker are recovered by the reaper.
+
+    compaction is passed to buildprompt; with report_compaction the before/after size of every
+    compacted profile is printed.
+
+    No jobs are taken while the endpoint's circuit breaker is open, and jobs that fail because
+    the endpoint is down are put back at the head of the queue instead of being dropped. With
+    ready_timeout > 0 the processor first waits up to that many seconds for /v1/models to list
+    the model.
+
+    With a router, port and model_name are ignored: every job is sent to the least-loaded healthy
+    endpoint of the router (restricted to model_name if it is not None).
+
+    With a sink (output_sink.ShardedJsonlWriter) conversations are appended to shared JSONL
+    shards instead of one file each; in reliable mode a job is then acknowledged once the shard
+    it went to has been flushed.
+
+    Outputs are keyed by job_id, model and prompt variant. With a completion index
+    (idempotency.RedisCompletionIndex or LocalCompletionIndex) a job whose key is already
+    completed is skipped before the model is called.
+
+    With a response cache (response_cache.SqliteResponseCache or RedisResponseCache) replies are
+    looked up by request before calling the model and stored afterwards. cache_only replays
+    cached replies without calling the model at all; jobs without one are moved to
+    <queue>:uncached.
+
+    With a validator, replies are checked against the advertised schema (and repaired where
+    possible) before they are saved; a job whose replies stay invalid is treated as failed.
+
+    Each job yields `perspectives` conversations with distinct subprompts, chosen from the job id
+    and persona_seed so every subprompt is used equally often, and requested concurrently. With
+    fanout_models the perspectives are spread over those models (all served on the same port)
+    instead of model_name. A job is acknowledged once all of its perspectives have been saved.
+
+    With a scheduler (queue_scheduler.WeightedQueueScheduler) jobs are taken from its weighted
+    queues instead of queue_prefix:queue:queue_id.
+
+    Jobs are decoded with decoder (job_codec.JobDecoder), which accepts JSON as well as the binary
+    job codecs and resolves claim-check profile references; a new one is made if none is shared.
+
+    Once stop (a threading.Event) is set the worker takes no new job, finishes the one in hand and
+    returns; a job taken just as stop was set goes back to the head of its queue unstarted. The
+    current job is registered in in_flight (InFlightJobs) so a shutdown that can't wait for it can
+    return it to its queue.
     """
     queue_name = f"{queue_prefix}:queue:{queue_id}"
+    queue_label = ", ".join(scheduler.weights) if scheduler is not None else queue_name
+    decoder = decoder or job_codec.JobDecoder(redis_client, queue_prefix)
+    stop = stop or Event()
     conversation_index = 1
+    base_url = f"http://localhost:{port}"
+    health = endpoint_health.get_health(base_url)
+
+    fanout_pool = ThreadPoolExecutor(max_workers=perspectives) if perspectives > 1 else None
+
+    processing_list = None
+    if reliable:
+        worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        processing_list = reliable_queue.processing_list_name(queue_name, worker_id)
     
-    print(f"Starting queue processor for {queue_name} -> localhost:{port}")
+    if router is not None:
+        model_filter = model_name
+        print(f"Starting routed queue processor for {queue_label} -> {len(router.endpoints)} endpoints")
+    else:
+        print(f"Starting queue processor for {queue_label} -> localhost:{port}")
+
+        if ready_timeout > 0 and not cache_only:
+            endpoint_health.wait_until_ready(base_url, model_name, timeout=ready_timeout)
     
-    while True:
+    while not stop.is_set():
+        message = None
+        endpoint = None
         try:
-            # Pop job from queue (blocking with 1 second timeout)
-            job_data = redis_client.brpop(queue_name, timeout=1)
-            
-            if job_data is None:
-                # No job available, continue polling
+            if router is not None:
+                # Leave jobs in the queue while no endpoint could take them
+                if not router.any_available(model_filter):
+                    stop.wait(0.5)
+                    continue
+            elif not cache_only and not health.is_available():
+                # Leave jobs in the queue while the endpoint is failing
+                stop.wait(min(max(health.wait_time(), 0.1), 1))
                 continue
-                
+
+            if scheduler is not None:
+                # Take the job from the queue whose turn it is, blocking with 1 second timeout
+                claimed = scheduler.next_job(redis_client, worker_id if reliable else None, timeout=1)
+                if claimed is None:
+                    continue
+                queue_name, message = claimed
+                if reliable:
+                    processing_list = reliable_queue.processing_list_name(queue_name, worker_id)
+            elif reliable:
+                # Move job into our processing list (blocking with 1 second timeout)
+                message = reliable_queue.claim_job(redis_client, queue_name, processing_list, timeout=1)
+                if message is None:
+                    continue
+            else:
+                # Pop job from queue (blocking with 1 second timeout)
+                job_data = redis_client.brpop(queue_name, timeout=1)
+
+                if job_data is None:
+                    # No job available, continue polling
+                    continue
+
+                queue_name_from_redis, message = job_data
+            metrics.JOBS_DEQUEUED.inc(queue=queue_name)
+
+            if stop.is_set():
+                # Shutting down: the job hasn't been started, so it goes back for the next worker
+                return_job(redis_client, queue_name, processing_list, message)
+                break
+            if in_flight is not None:
+                in_flight.started(queue_name, processing_list, message)
+
+            if router is not None:
+                # Reserve the least-loaded healthy endpoint for this job
+                endpoint = router.acquire(model_filter)
+                if endpoint is None:
+                    # Another worker took the last available endpoint: give the job back
+                    return_job(redis_client, queue_name, processing_list, message)
+                    continue
+                port, model_name, health = endpoint.port, endpoint.model, endpoint.health
+
             # Parse the job
-            queue_name_from_redis, message = job_data
-            job_payload = json.loads(message.decode('utf-8'))
+            job_payload = decoder.decode(message, queue_name.rsplit(":queue:", 1)[0])
             
             job_id = job_payload.get('job_id')
-            profile_data = job_payload.get('profile_data')
             
             print(f"Processing job {job_id} from {queue_name} on port {port}")
             
-            # Select a random subprompt
-            selected_subprompt = random.choice(subprompts)
-            prompt = buildprompt(selected_subprompt, json.dumps(profile_data, indent=2))
-            
-            # Call the model API
-            response, model_name_clean = call_model_api(prompt, port, model_name)
+            # Plan the job's perspectives: `perspectives` subprompts, spread over the fan-out models.
+            # The selection is stable, so a retried job maps to the same output keys
+            models = fanout_models or [model_name]
+            if job_id is not None:
+                variants = idempotency.variants_for_job(job_id, len(subprompts), perspectives, persona_seed)
+            else:
+                variants = random.sample(range(len(subprompts)), min(perspectives, len(subprompts)))
+            planned = []
+            for position, variant in enumerate(variants):
+                target_model = models[position % len(models)]
+                key = None
+                if job_id is not None:
+                    key = idempotency.output_key(job_id, clean_model_name_for(target_model), variant)
+                if completed is not None and key is not None and completed.contains(key):
+                    print(f"Skipping {key}: already completed")
+                    continue
+                planned.append((variant, target_model, key))
+
+            if not planned:
+                print(f"Skipping job {job_id}: already completed")
+                job_saved(redis_client, queue_name, processing_list, message)
+                continue
+
+            prompts = [prompt_for_job(subprompts[variant], job_payload, compaction, layout)
+                       for variant, _, _ in planned]
+
+            profile_data = job_payload.get('profile_data')
+            if report_compaction and compaction is not None and profile_data is not None:
+                report = compaction_report(profile_data, serialize_profile(profile_data, **compaction))
+                print(f"Profile for job {job_id}: {format_report(report)}")
             
-            if response:
-                # Create conversation data in the required format
-                conversation_data = {
-                    "messages": [
-                        {
-                            "role": "user", 
-                            "content": prompt
-                        },
-                        {
-                            "role": "assistant", 
-                            "content": response
-                        }
-                    ]
-                }
+            # Get replies from the cache or the model API. A job's perspectives are requested
+            # together so the server can share the KV cache of their common prefix
+            started = time.monotonic()
+            calls = [(prompt, port, target_model, cache, cache_only, validator)
+                     for prompt, (_, target_model, _) in zip(prompts, planned)]
+            if fanout_pool is not None and len(calls) > 1:
+                results = list(fanout_pool.map(lambda call: generate_reply(*call), calls))
+            else:
+                results = [generate_reply(*call) for call in calls]
+            endpoint_failed = any(result[2] for result in results)
+            if endpoint is not None and any(result[3] for result in results):
+                router.release(endpoint, None if endpoint_failed else time.monotonic() - started)
+                endpoint = None
+
+            # Save every reply; the job is done only if all of its perspectives were
+            complete = not endpoint_failed and all(result[0] for result in results)
+            saved = 0
+            for index, ((variant, target_model, key), prompt, result) in enumerate(zip(planned, prompts, results)):
+                response, model_name_clean = result[0], result[1]
+                if not response:
+                    print(f"Failed to get response for job {job_id} from {target_model} (subprompt {variant})")
+                    continue
+                conversation_data = conversation_for(prompt, response)
                 
                 # Save the conversation
-                save_conversation(model_name_clean, conversation_index, conversation_data, output_dir)
-                conversation_index += 1
-                
+                if sink is not None:
+                    # Outputs are marked completed once their shard has been flushed, and the job
+                    # is acknowledged with the last of them
+                    ack_list = processing_list if complete and index == len(planned) - 1 else None
+                    record = dict(id=key, **conversation_data) if key is not None else conversation_data
+                    path = sink.write(record, partial(job_saved, redis_client, queue_name, ack_list,
+                                                      message, key, completed))
+                else:
+                    path = save_conversation(model_name_clean, conversation_index, conversation_data,
+                                             output_dir, key)
+                    conversation_index += 1
+                    if path:
+                        job_saved(redis_client, queue_name, None, message, key, completed)
+                if path:
+                    saved += 1
+            done = complete and saved == len(planned)
+            if done and sink is None:
+                job_saved(redis_client, queue_name, processing_list, message)
+
+            if endpoint_failed:
+                # Not the job's fault: return it to the head of the queue without charging an attempt
+                return_job(redis_client, queue_name, processing_list, message)
+                print(f"Requeued job {job_id} after endpoint failure on port {port}")
+                stop.wait(health.backoff_delay())
+            elif cache_only and not complete:
+                # Replay never touches the model: park the job for a later run with the GPUs
+                redis_client.lpush(f"{queue_name}:uncached", message)
+                job_saved(redis_client, queue_name, processing_list, message)
+                print(f"No usable cached reply for job {job_id}, moved to {queue_name}:uncached")
+            elif reliable and not done:
+                outcome = reliable_queue.release_job(redis_client, queue_name, processing_list, message,
+                                                     max_attempts)
+                print(f"Job {job_id} {outcome or 'already released'}")
+
+            job_labels = dict(queue=queue_name, endpoint=f"localhost:{port}", model=model_name)
+            if done:
                 print(f"Successfully processed job {job_id}")
+                metrics.JOBS_COMPLETED.inc(**job_labels)
+                if scheduler is not None and scheduler.stats is not None:
+                    scheduler.stats.job_done(queue_name)
             else:
-                print(f"Failed to get response for job {job_id}")
+                reason = "endpoint" if endpoint_failed else "uncached" if cache_only else "no_output"
+                metrics.JOBS_FAILED.inc(reason=reason, **job_labels)
                 
         except redis.exceptions.RedisError as e:
             print(f"Redis error in queue processor for port {port}: {e}")
-            time.sleep(5)  # Wait before retrying
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error in queue processor for port {port}: {e}")
+            stop.wait(5)  # Wait before retrying
+        except (json.JSONDecodeError, job_codec.JobDecodeError) as e:
+            print(f"Job decode error in queue processor for port {port}: {e}")
+            if reliable and message is not None:
+                # A malformed job will never succeed, so don't let it cycle through the queue
+                reliable_queue.release_job(redis_client, queue_name, processing_list, message, dead=True)
         except Exception as e:
             print(f"Unexpected error in queue processor for port {port}: {e}")
-            time.sleep(1)  # Wait before continuing
+            stop.wait(1)  # Wait before continuing
+        finally:
+            if in_flight is not None:
+                in_flight.finished()
+            if endpoint is not None:
+                # Reserved but never used (an error before the request)
+                router.release(endpoint)
+
+    if fanout_pool is not None:
+        fanout_pool.shutdown()
+    print(f"Queue processor for {queue_label} stopped")
+
+def compaction_from_args(args):
+    """
+    compact_profile options from the command line, or None when compaction is disabled
+    """
+    if not args.compact_profile:
+        return None
+    return {
+        "allowlist": args.profile_allow.split(",") if args.profile_allow else None,
+        "denylist": args.profile_deny.split(",") if args.profile_deny else (),
+        "drop_empty": not args.keep_empty,
+        "max_list_items": args.max_list_items if args.max_list_items > 0 else None
+    }
+
+def output_sink_from_args(args):
+    """
+    Started sharded JSONL writer for --output-format shards, or None to write one file per conversation
+    """
+    if args.output_format != "shards":
+        return None
+    compression = None if args.shard_compression == "none" else args.shard_compression
+    sink = output_sink.ShardedJsonlWriter(args.output_dir, max_records=args.shard_max_records,
+                                          max_bytes=args.shard_max_mb * 1024 * 1024, compression=compression,
+                                          flush_interval=args.flush_interval)
+    # Flush whatever is still buffered when the process exits
+    atexit.register(sink.close)
+    return sink.start()
+
+def response_cache_from_args(args, redis_client):
+    """
+    Response cache for --response-cache, or None when replies are not cached
+    """
+    if args.response_cache == "sqlite":
+        return response_cache.SqliteResponseCache(args.cache_path, args.cache_max_entries)
+    if args.response_cache == "redis":
+        return response_cache.RedisResponseCache(redis_client, args.queue_prefix, args.cache_max_entries)
+    return None
+
+def completion_index_from_args(args, redis_client):
+    """
+    Completion index for --skip-completed, or None when completed jobs are not skipped
+    """
+    if args.skip_completed == "redis":
+        return idempotency.RedisCompletionIndex(redis_client, args.queue_prefix)
+    if args.skip_completed == "local":
+        index = idempotency.LocalCompletionIndex(args.output_dir)
+        print(f"Found {len(index)} completed outputs in {args.output_dir}")
+        return index
+    return None
 
 def main():
     """
@@ -202,10 +696,76 @@ def main():
     parser.add_argument("--num-queues", default=4, type=int, help="Number of queues/ports to process")
     parser.add_argument("--queue-offset", default=0, type=int, help="Offset for queue numbers (allows multiple instances)")
     parser.add_argument("--queue-prefix", default="profiles", help="Prefix for queue names")
+    parser.add_argument("--queue-weights", default=None, help="Consume the queues of several prefixes with weighted fair sharing, e.g. urgent=8,profiles=1 (threads engine)")
+    parser.add_argument("--starvation-limit", default=30.0, type=float, help="Seconds after which a weighted queue that hasn't been served goes first (with --queue-weights)")
+    parser.add_argument("--queue-stats-interval", default=60, type=int, help="Seconds between per-queue throughput reports (with --queue-weights)")
+    parser.add_argument("--metrics-port", default=None, type=int, help="Serve Prometheus metrics (jobs, latency, tokens, queue depths) on this port at /metrics")
+    parser.add_argument("--profile-store-dir", default=None, help="Directory holding the profile stores of jobs dispatched with --profile-store (default: the path the dispatcher wrote)")
     parser.add_argument("--output-dir", default="../output", help="Output directory for conversation files")
-    parser.add_argument("--model", required=True, help="Model name to use (e.g., qwen:32b)")
+    parser.add_argument("--output-format", default="files", choices=["files", "shards"], help="One JSON file per conversation, or buffered JSONL shards shared by all workers")
+    parser.add_argument("--shard-max-records", default=10000, type=int, help="Conversations per JSONL shard before rotating (shards format)")
+    parser.add_argument("--shard-max-mb", default=256, type=int, help="Uncompressed megabytes per JSONL shard before rotating (shards format)")
+    parser.add_argument("--shard-compression", default="none", choices=["none", "gzip", "zstd"], help="Compress JSONL shards (shards format; zstd requires zstandard)")
+    parser.add_argument("--skip-completed", default="off", choices=["off", "redis", "local"], help="Skip jobs whose output for this model and prompt variant already exists, tracked in a Redis set or by scanning --output-dir")
+    parser.add_argument("--response-cache", default="off", choices=["off", "sqlite", "redis"], help="Reuse model replies for identical requests (model, sampling parameters and prompt)")
+    parser.add_argument("--cache-path", default="response_cache.sqlite", help="Database file of the sqlite response cache")
+    parser.add_argument("--cache-max-entries", default=1000000, type=int, help="Replies kept in the response cache before evicting the least recently used")
+    parser.add_argument("--cache-only", action="store_true", help="Replay cached replies without calling any model; uncached jobs go to <queue>:uncached")
+    parser.add_argument("--validate", action="store_true", help="Check replies against the JSON schema in the prompt and only save usable ones")
+    parser.add_argument("--validate-retries", default=2, type=int, help="Extra model requests per job while its reply stays invalid (with --validate)")
+    parser.add_argument("--no-repair", action="store_true", help="Reject replies with wrong-case enums or out-of-range scores instead of fixing them (with --validate)")
+    parser.add_argument("--guided-decoding", default=None, choices=GUIDED_MODES, help="Constrain replies to the response JSON schema: vLLM guided_json, OpenAI-style response_format, or Ollama format")
+    parser.add_argument("--max-tokens", default=None, type=int, help="max_tokens per request (default: 3000, or sized from the schema with --guided-decoding)")
+    parser.add_argument("--flush-interval", default=5.0, type=float, help="Seconds between flushes of buffered conversations (shards format)")
+    parser.add_argument("--model", default=None, help="Model name to use (e.g., qwen:32b); with --endpoints, only route to this model")
+    parser.add_argument("--reliable", action="store_true", help="Claim jobs into a processing list and acknowledge them only after saving")
+    parser.add_argument("--visibility-timeout", default=300, type=int, help="Seconds before an unacknowledged job is requeued (reliable mode)")
+    parser.add_argument("--max-attempts", default=3, type=int, help="Attempts before a job is moved to the dead-letter queue (reliable mode)")
+    parser.add_argument("--reaper-interval", default=30, type=int, help="Seconds between reaper sweeps (reliable mode)")
+    parser.add_argument("--drain-timeout", default=45.0, type=float, help="Seconds to let jobs in flight finish on Ctrl+C or SIGTERM before returning them to their queues")
+    parser.add_argument("--pool-size", default=10, type=int, help="Keep-alive connections kept open per model endpoint")
+    parser.add_argument("--connect-timeout", default=5.0, type=float, help="Seconds to wait for a connection to a model endpoint")
+    parser.add_argument("--read-timeout", default=60.0, type=float, help="Seconds to wait for a model response")
+    parser.add_argument("--no-keep-alive", action="store_true", help="Close the connection after every request")
+    parser.add_argument("--compact-profile", action="store_true", help="Embed a compacted profile (no images, ids, empties or indentation) in the prompt; jobs dispatched with --compact-profile are already compacted and keep the dispatcher's options")
+    parser.add_argument("--profile-allow", default=None, help="Comma-separated top-level profile fields to keep (compact mode)")
+    parser.add_argument("--profile-deny", default=",".join(DEFAULT_DENYLIST), help="Comma-separated profile fields to drop at any depth (compact mode)")
+    parser.add_argument("--max-list-items", default=10, type=int, help="Longest list kept, e.g. positions or skills; 0 keeps all (compact mode)")
+    parser.add_argument("--keep-empty", action="store_true", help="Keep null and empty fields (compact mode)")
+    parser.add_argument("--report-compaction", action="store_true", help="Print before/after character and token estimates per profile")
+    parser.add_argument("--prompt-layout", default="persona_first", choices=LAYOUTS, help="Order of persona, schema instructions and profile in the prompt (see prompt_templates.py)")
+    parser.add_argument("--schema-first", action="store_true", help="Shorthand for --prompt-layout schema_first, maximizing prefix-cache sharing across personas")
+    parser.add_argument("--perspectives", default=1, type=int, help="Conversations per job, each from a different subprompt, requested concurrently (threads engine)")
+    parser.add_argument("--persona-seed", default=0, type=int, help="Seed of the per-job subprompt selection; keep it fixed so retries reuse the same output keys")
+    parser.add_argument("--fanout-models", default=None, help="Comma-separated models served on each port to spread a job's perspectives over (threads engine, without --endpoints)")
+    parser.add_argument("--ready-timeout", default=120, type=int, help="Seconds to wait at startup for each endpoint to list the model on /v1/models (0 disables)")
+    parser.add_argument("--failure-threshold", default=5, type=int, help="Consecutive endpoint failures that open its circuit breaker")
+    parser.add_argument("--breaker-cooldown", default=15.0, type=float, help="Seconds a tripped circuit breaker pauses consumption before probing again")
+    parser.add_argument("--endpoints", default=None, help="Endpoint registry (JSON list of port/model/weight, or models.md) to route jobs from one shared queue")
+    parser.add_argument("--workers", default=None, type=int, help="Worker threads sharing the queue in routed mode (default: two per endpoint)")
+    parser.add_argument("--engine", default="threads", choices=["threads", "async"], help="Worker engine: one blocking thread per queue, or asyncio with concurrent requests")
+    parser.add_argument("--concurrency", default=8, type=int, help="Requests in flight per port (async engine)")
+    parser.add_argument("--prefetch", default=None, type=int, help="Jobs buffered per port ahead of the model (async engine, default: --concurrency)")
     
     args = parser.parse_args()
+
+    if args.model is None and args.endpoints is None:
+        parser.error("--model is required unless --endpoints is given")
+    if args.schema_first:
+        args.prompt_layout = "schema_first"
+    if args.cache_only and (args.response_cache == "off" or args.endpoints or args.engine != "threads"):
+        parser.error("--cache-only needs --response-cache and --model with the threads engine")
+    if not 1 <= args.perspectives <= len(subprompts):
+        parser.error(f"--perspectives must be between 1 and {len(subprompts)}")
+    if args.fanout_models and args.endpoints:
+        parser.error("--fanout-models can't be combined with --endpoints")
+    fanout_models = [model for model in (args.fanout_models or "").split(",") if model] or None
+    queue_weights = None
+    if args.queue_weights:
+        try:
+            queue_weights = queue_scheduler.parse_queue_weights(args.queue_weights)
+        except ValueError as e:
+            parser.error(f"--queue-weights: {e}")
     
     # Connect to Redis
     try:
@@ -215,36 +775,170 @@ def main():
     except redis.exceptions.ConnectionError as e:
         print(f"Could not connect to Redis: {e}")
         return
+
+    if args.metrics_port is not None:
+        metrics.watch_queues(redis_client, [prefix for prefix, _ in queue_weights] if queue_weights
+                             else [args.queue_prefix])
+        metrics.start_server(args.metrics_port)
+
+    http_sessions.configure(pool_size=args.pool_size, connect_timeout=args.connect_timeout,
+                            read_timeout=args.read_timeout, keep_alive=not args.no_keep_alive)
+    endpoint_health.configure(failure_threshold=args.failure_threshold, cooldown=args.breaker_cooldown)
+    prompt_templates.configure_decoding(args.guided_decoding, args.max_tokens)
+    if args.guided_decoding:
+        print(f"Guided decoding via {args.guided_decoding}, "
+              f"max_tokens {prompt_templates.decoding_options['max_tokens']}")
+    sink = output_sink_from_args(args)
+    completed = completion_index_from_args(args, redis_client)
+    cache = response_cache_from_args(args, redis_client)
+    validator = ResponseValidator(not args.no_repair, args.validate_retries) if args.validate else None
+
+    if args.engine == "async":
+        if args.reliable or args.endpoints or args.perspectives > 1 or fanout_models or queue_weights:
+            print("Reliable mode, routing, multi-perspective jobs and weighted queues are only supported "
+                  "by the threads engine.")
+            return
+        # Imported lazily so the threads engine doesn't require aiohttp
+        import async_worker
+        async_worker.main(args, sink, completed, cache, validator)
+        return
     
-    # Create threads for each queue/port combination
+    worker_options = {
+        "reliable": args.reliable, "max_attempts": args.max_attempts,
+        "compaction": compaction_from_args(args), "report_compaction": args.report_compaction,
+        "layout": args.prompt_layout, "ready_timeout": args.ready_timeout, "sink": sink,
+        "completed": completed, "cache": cache, "cache_only": args.cache_only,
+        "validator": validator, "perspectives": args.perspectives, "persona_seed": args.persona_seed,
+        "fanout_models": fanout_models, "decoder": job_codec.JobDecoder(redis_client, args.queue_prefix,
+                                                                 profile_store.ProfileStores(args.profile_store_dir)),
+        "stop": Event(), "in_flight": InFlightJobs()
+    }
     threads = []
-    
-    for i in range(args.num_queues):
-        queue_id = i + args.queue_offset
-        port = args.start_port + i
-        
-        thread = Thread(
-            target=process_queue,
-            args=(queue_id, redis_client, port, args.model, args.output_dir, args.queue_prefix),
-            daemon=True
-        )
-        threads.append(thread)
-        thread.start()
-        
-        print(f"Started processor for {args.queue_prefix}:queue:{queue_id} -> port:{port} -> {args.output_dir}")
+
+    scheduler_stats = queue_scheduler.SchedulerStats() if queue_weights else None
+
+    def scheduler_for(queue_id):
+        """
+        A worker's own scheduler over the queue_id queues of every weighted prefix
+        """
+        if not queue_weights:
+            return None
+        return queue_scheduler.WeightedQueueScheduler(
+            [(f"{prefix}:queue:{queue_id}", weight) for prefix, weight in queue_weights],
+            max_wait=args.starvation_limit, stats=scheduler_stats)
+
+    def queues_label(queue_id):
+        if not queue_weights:
+            return f"{args.queue_prefix}:queue:{queue_id}"
+        return ", ".join(f"{prefix}:queue:{queue_id} (weight {weight:g})" for prefix, weight in queue_weights)
+
+    if args.endpoints:
+        # Routed mode: every worker shares one queue and picks an endpoint per job
+        endpoints = router_module.load_registry(args.endpoints)
+        if args.model is not None:
+            endpoints = [endpoint for endpoint in endpoints if endpoint.model == args.model]
+        if not endpoints:
+            print(f"No endpoints for model {args.model} in {args.endpoints}. Exiting.")
+            return
+        job_router = router_module.Router(endpoints)
+
+        if args.ready_timeout > 0:
+            probes = [Thread(target=endpoint_health.wait_until_ready,
+                             args=(endpoint.base_url, endpoint.model, args.ready_timeout))
+                      for endpoint in endpoints]
+            for probe in probes:
+                probe.start()
+            for probe in probes:
+                probe.join()
+
+        queue_id = args.queue_offset
+        num_workers = args.workers or 2 * len(endpoints)
+        for i in range(num_workers):
+            thread = Thread(
+                target=process_queue,
+                args=(queue_id, redis_client, None, args.model, args.output_dir, args.queue_prefix),
+                kwargs=dict(worker_options, router=job_router, ready_timeout=0,
+                            worker_id=f"{socket.gethostname()}-{os.getpid()}-{i}",
+                            scheduler=scheduler_for(queue_id)),
+                daemon=True
+            )
+            threads.append(thread)
+            thread.start()
+
+        print(f"Started {num_workers} routed processors for {queues_label(queue_id)} -> "
+              f"{', '.join(f'{endpoint.model}@{endpoint.port}' for endpoint in endpoints)} -> {args.output_dir}")
+    else:
+        # Create threads for each queue/port combination
+        for i in range(args.num_queues):
+            queue_id = i + args.queue_offset
+            port = args.start_port + i
+            
+            thread = Thread(
+                target=process_queue,
+                args=(queue_id, redis_client, port, args.model, args.output_dir, args.queue_prefix),
+                kwargs=dict(worker_options, scheduler=scheduler_for(queue_id)),
+                daemon=True
+            )
+            threads.append(thread)
+            thread.start()
+            
+            print(f"Started processor for {queues_label(queue_id)} -> port:{port} -> {args.output_dir}")
     
     if not threads:
         print("No valid threads started. Exiting.")
         return
+
+    if args.reliable:
+        for prefix in [prefix for prefix, _ in queue_weights] if queue_weights else [args.queue_prefix]:
+            reaper = Thread(
+                target=reliable_queue.run_reaper,
+                args=(redis_client, prefix, args.visibility_timeout, args.max_attempts, args.reaper_interval),
+                daemon=True
+            )
+            reaper.start()
+
+    if scheduler_stats is not None and args.queue_stats_interval > 0:
+        Thread(target=queue_scheduler.run_stats_reporter, args=(scheduler_stats, args.queue_stats_interval),
+               daemon=True).start()
     
     print(f"Started {len(threads)} queue processors. Press Ctrl+C to stop.")
+
+    if current_thread() is main_thread():
+        # supervisor.py (and the batch system) stop workers with SIGTERM: shut down as on Ctrl+C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
     
     try:
         # Keep main thread alive
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("\nShutting down queue processors...")
+        if current_thread() is main_thread():
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        # Stop taking jobs and let the ones in flight finish; a second Ctrl+C stops waiting
+        print(f"\nShutting down queue processors: no new jobs, waiting up to {args.drain_timeout:g}s "
+              f"for {len(worker_options['in_flight'])} jobs in flight...")
+        busy, returned = drain_workers(threads, worker_options["stop"], worker_options["in_flight"],
+                                       redis_client, args.drain_timeout)
+        if busy:
+            print(f"{busy} queue processors still busy; returned {returned} unfinished jobs to the head of their queues")
+        else:
+            print("All jobs in flight finished.")
+        print("HTTP connection reuse:")
+        http_sessions.print_stats()
+        if args.endpoints:
+            print("Endpoint routing:")
+            job_router.print_stats()
+        if scheduler_stats is not None:
+            print("Queue throughput:")
+            scheduler_stats.print_stats()
+        if cache is not None:
+            print(f"Response cache: {cache.stats.format()}")
+        if validator is not None:
+            print("Reply validity:")
+            validator.stats.print_stats()
+        if sink is not None:
+            # Write out buffered conversations, which also acknowledges their jobs
+            sink.close()
 
 if __name__ == '__main__':
     main()
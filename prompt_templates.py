@@ -0,0 +1,221 @@
+import json
+import os
+from functools import lru_cache
+
+from profile_compaction import estimate_tokens
+
+# Precompiled prompt templates.
+#
+# A prompt is always <head> + <profile text> + <tail>. Heads and tails are built once per
+# (subprompt, layout) and cached, so per-job work is a single concatenation.
+#
+# Layouts:
+#   persona_first  the persona subprompt followed by the fixed schema instructions and the
+#                  profile, which is how prompts have always looked
+#   schema_first   the invariant instructions and schema first, then the persona and the profile,
+#                  so every prompt - whatever its persona - starts with the same long block. vLLM
+#                  and Ollama prefix caching can then reuse the KV cache of that block across all
+#                  requests instead of only across requests sharing a persona.
+#   profile_first  the invariant instructions, then the profile, then the persona, so prompts for
+#                  the same profile differ only in their last few tokens. Several perspectives on
+#                  one profile sent together share the KV cache of the whole profile.
+
+# Values the schema advertises; response_validation checks replies against them
+COMMUNICATION_STYLES = ["Formal", "Casual", "Inspiring", "Analytical", "Collaborative", "Strategic", "Visionary",
+                        "Methodical", "Approachable", "Direct", "Results-Driven", "Detail-Oriented", "Creative",
+                        "Supportive", "Diplomatic", "Energetic", "Pragmatic", "Authoritative", "Technical", "Nurturing"]
+
+VIBE_CATEGORIES = ["Leader", "Innovator", "Collaborator", "Expert", "Strategist", "Mentor", "Builder", "Connector",
+                   "Problem-Solver", "Communicator", "Organizer", "Visionary", "Executor", "Analyst", "Mediator",
+                   "Pioneer", "Motivator", "Guardian", "Architect", "Advocate"]
+
+RADAR_TRAITS = ["Leadership", "Innovation", "Empathy", "Analytics", "Communication"]
+
+NUM_PERSONALITY_TRAITS = 5
+
+SCHEMA_BLOCK = f'''{{
+  "personality_traits": ["trait1", "trait2", "trait3", "trait4", "trait5"],
+  "communication_style": "{"|".join(COMMUNICATION_STYLES)}",
+  "vibe_category": "{"|".join(VIBE_CATEGORIES)}",
+  "confidence_score": 93,
+  "key_strength": "one sentence describing their main professional strength",
+  "growth_area": "one sentence describing an area for potential growth",
+  "radar_data": [
+    {{"trait": "Leadership", "score": 83}},
+    {{"trait": "Innovation", "score": 76}},
+    {{"trait": "Empathy", "score": 89}},
+    {{"trait": "Analytics", "score": 74}},
+    {{"trait": "Communication", "score": 82}}
+  ]
+}}'''
+
+# Everything between the subprompt and the profile in the default ordering
+PROMPT_INSTRUCTIONS = f'''
+
+Based on the profile data below, analyze their professional personality and return ONLY a valid JSON response with this exact structure:
+
+{SCHEMA_BLOCK}
+
+Profile Data:
+'''
+
+# Invariant opening of every prompt in the schema-first ordering
+SCHEMA_FIRST_INSTRUCTIONS = f'''Analyze the professional personality shown in the LinkedIn profile data at the end of this message and return ONLY a valid JSON response with this exact structure:
+
+{SCHEMA_BLOCK}
+
+'''
+
+# Invariant opening of every prompt in the profile-first ordering
+PROFILE_FIRST_INSTRUCTIONS = f'''Analyze the professional personality shown in the LinkedIn profile data below, from the perspective described after it, and return ONLY a valid JSON response with this exact structure:
+
+{SCHEMA_BLOCK}
+
+Profile Data:
+'''
+
+PROMPT_TAIL = "\n"
+
+LAYOUTS = ("persona_first", "schema_first", "profile_first")
+
+# The same structure as a JSON Schema, for constrained (guided) decoding
+RESPONSE_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "personality_traits": {"type": "array", "items": {"type": "string"},
+                               "minItems": NUM_PERSONALITY_TRAITS, "maxItems": NUM_PERSONALITY_TRAITS},
+        "communication_style": {"type": "string", "enum": COMMUNICATION_STYLES},
+        "vibe_category": {"type": "string", "enum": VIBE_CATEGORIES},
+        "confidence_score": {"type": "integer", "minimum": 0, "maximum": 100},
+        "key_strength": {"type": "string"},
+        "growth_area": {"type": "string"},
+        "radar_data": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "trait": {"type": "string", "enum": RADAR_TRAITS},
+                    "score": {"type": "integer", "minimum": 0, "maximum": 100}
+                },
+                "required": ["trait", "score"],
+                "additionalProperties": False
+            },
+            "minItems": len(RADAR_TRAITS),
+            "maxItems": len(RADAR_TRAITS)
+        }
+    },
+    "required": ["personality_traits", "communication_style", "vibe_category", "confidence_score",
+                 "key_strength", "growth_area", "radar_data"],
+    "additionalProperties": False
+}
+
+# Generous length budgets for the free-text parts of a reply, in characters
+TRAIT_CHARS = 30
+SENTENCE_CHARS = 300
+
+
+@lru_cache(maxsize=None)
+def response_max_tokens():
+    """
+    max_tokens for a reply constrained to RESPONSE_JSON_SCHEMA.
+
+    Sized from the longest reply the schema allows with generous text fields, at a pessimistic
+    3 characters per token (JSON punctuation tokenizes poorly), rounded up to a multiple of 64.
+    """
+    longest = {
+        "personality_traits": ["x" * TRAIT_CHARS] * NUM_PERSONALITY_TRAITS,
+        "communication_style": max(COMMUNICATION_STYLES, key=len),
+        "vibe_category": max(VIBE_CATEGORIES, key=len),
+        "confidence_score": 100,
+        "key_strength": "x" * SENTENCE_CHARS,
+        "growth_area": "x" * SENTENCE_CHARS,
+        "radar_data": [{"trait": trait, "score": 100} for trait in RADAR_TRAITS]
+    }
+    tokens = len(json.dumps(longest, indent=2)) / 3
+    return int(-(-tokens // 64) * 64)
+
+
+@lru_cache(maxsize=None)
+def prompt_template(subprompt, layout="persona_first"):
+    """
+    Precompiled (head, tail) pair for a subprompt; a prompt is head + profile_text + tail
+    """
+    if layout == "schema_first":
+        return f"{SCHEMA_FIRST_INSTRUCTIONS}{subprompt}\n\nProfile Data:\n", PROMPT_TAIL
+    if layout == "profile_first":
+        return PROFILE_FIRST_INSTRUCTIONS, f"\n\nPerspective: {subprompt}{PROMPT_TAIL}"
+    if layout == "persona_first":
+        return f"{subprompt}{PROMPT_INSTRUCTIONS}", PROMPT_TAIL
+    raise ValueError(f"Unknown prompt layout: {layout}")
+
+
+def splice_prompt(subprompt, profile_text, layout="persona_first"):
+    """
+    Build a prompt around an already serialized profile without decoding it
+    """
+    head, tail = prompt_template(subprompt, layout)
+    return head + profile_text + tail
+
+
+def prefix_report(subprompts, layout="persona_first"):
+    """
+    Estimate how much of each template's prompt can be served from a prefix cache.
+
+    Returns:
+        dict: {"common_prefix_tokens": tokens shared by every template,
+               "templates": [(subprompt, head_tokens), ...]}
+    """
+    heads = [prompt_template(subprompt, layout)[0] for subprompt in subprompts]
+    return {
+        "common_prefix_tokens": estimate_tokens(os.path.commonprefix(heads)),
+        "templates": [(subprompt, estimate_tokens(head)) for subprompt, head in zip(subprompts, heads)]
+    }
+
+
+def print_prefix_report(subprompts):
+    """
+    Compare shared-prefix token estimates for every layout
+    """
+    for layout in LAYOUTS:
+        report = prefix_report(subprompts, layout)
+        ordering = layout.replace("_", " ") + (" (default)" if layout == "persona_first" else "")
+        head_tokens = [tokens for _, tokens in report["templates"]]
+        print(f"{ordering}:")
+        print(f"  prefix shared by all {len(head_tokens)} templates: ~{report['common_prefix_tokens']} tokens")
+        print(f"  prefix shared within a template: ~{min(head_tokens)}-{max(head_tokens)} tokens")
+        # KV cache needed to hold every template's prefix: the common part once, the rest per template
+        footprint = report["common_prefix_tokens"] + sum(tokens - report["common_prefix_tokens"]
+                                                         for tokens in head_tokens)
+        print(f"  prefix tokens to keep cached for all templates: ~{footprint}")
+        for index, (subprompt, tokens) in enumerate(report["templates"]):
+            print(f"    [{index:2d}] ~{tokens:4d} tokens  {subprompt[:60]}...")
+        if layout == "profile_first":
+            print("  (the profile itself is shared too by every perspective on the same profile)")
+
+
+# Request body options used by prompt.build_chat_payload, set with configure_decoding
+GUIDED_MODES = ("guided_json", "response_format", "ollama")
+decoding_options = {"guided": None, "max_tokens": 3000}
+
+
+def configure_decoding(guided=None, max_tokens=None):
+    """
+    Constrain replies to the response JSON schema for every request built from now on
+
+    guided selects how the schema is sent: "guided_json" (vLLM extra parameter),
+    "response_format" (OpenAI-style json_schema, also accepted by recent vLLM and Ollama) or
+    "ollama" (Ollama "format" plus response_format). max_tokens defaults to a budget derived from
+    the schema when decoding is guided.
+    """
+    if guided is not None and guided not in GUIDED_MODES:
+        raise ValueError(f"Unknown guided decoding mode: {guided}")
+    decoding_options["guided"] = guided
+    if max_tokens is None:
+        max_tokens = response_max_tokens() if guided is not None else 3000
+    decoding_options["max_tokens"] = max_tokens
+
+
+if __name__ == '__main__':
+    from prompt import subprompts
+
+    print_prefix_report(subprompts)
@@ -0,0 +1,165 @@
+import threading
+import time
+
+import reliable_queue
+
+# Weighted fair-share scheduling across several queue prefixes.
+#
+# With --queue-weights each worker consumes the queue with its queue id under every listed prefix
+# instead of a single list, e.g. urgent:queue:0 and profiles:queue:0 for urgent=8,profiles=1. The
+# queues are ranked by smooth weighted round-robin: every pick credits each queue with its weight,
+# the served queue pays the sum of all weights, and the ranking follows the credits. While all
+# queues have work they are served in proportion to their weights, interleaved rather than in
+# bursts; an empty queue is passed over at no cost. Credits are capped at the total weight so a
+# queue that sat empty for a long time can't monopolize the workers when jobs arrive.
+#
+# Starvation protection: a queue that hasn't been served for max_wait seconds is moved to the front
+# of the ranking, so even a queue with a tiny weight next to a busy one keeps moving.
+#
+# Jobs are taken with one multi-key BRPOP (Redis tries the keys in the order given), or in reliable
+# mode with a non-blocking LMOVE per queue in ranking order before blocking on the first one.
+
+
+def parse_queue_weights(text):
+    """
+    Parse "prefix=weight,..." into an ordered list of (prefix, weight); a missing weight is 1
+    """
+    weights = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        prefix, _, weight = item.partition("=")
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"invalid weight in {item!r}")
+        if weight <= 0:
+            raise ValueError(f"weight of {prefix} must be positive")
+        weights.append((prefix.strip(), weight))
+    if len(set(prefix for prefix, _ in weights)) != len(weights):
+        raise ValueError("each queue prefix may only be listed once")
+    return weights
+
+
+class SchedulerStats:
+    """
+    Per-queue counts of jobs taken and completed, shared by all workers
+    """
+
+    def __init__(self):
+        self._taken = {}
+        self._done = {}
+        self._reported_at = time.monotonic()
+        self._reported_done = {}
+        self._lock = threading.Lock()
+
+    def job_taken(self, queue_name):
+        with self._lock:
+            self._taken[queue_name] = self._taken.get(queue_name, 0) + 1
+
+    def job_done(self, queue_name):
+        with self._lock:
+            self._done[queue_name] = self._done.get(queue_name, 0) + 1
+
+    def print_stats(self):
+        """
+        Print totals per queue and the completion rate since the previous report
+        """
+        with self._lock:
+            now = time.monotonic()
+            minutes = max(now - self._reported_at, 1) / 60
+            total = sum(self._taken.values())
+            for queue_name in sorted(set(self._taken) | set(self._done)):
+                taken = self._taken.get(queue_name, 0)
+                done = self._done.get(queue_name, 0)
+                recent = done - self._reported_done.get(queue_name, 0)
+                share = 100 * taken / total if total else 0
+                print(f"  {queue_name}: {taken} taken ({share:.1f}%), {done} completed, "
+                      f"{recent / minutes:.1f} jobs/min")
+            self._reported_at = now
+            self._reported_done = dict(self._done)
+
+
+class WeightedQueueScheduler:
+    """
+    Picks the queue a worker takes its next job from. One instance per worker thread.
+
+    queues is a list of (queue_name, weight).
+    """
+
+    def __init__(self, queues, max_wait=30.0, stats=None):
+        self.weights = dict(queues)
+        self.total = sum(self.weights.values())
+        self.max_wait = max_wait
+        self.stats = stats
+        self.credits = {queue_name: 0.0 for queue_name in self.weights}
+        now = time.monotonic()
+        self.last_served = {queue_name: now for queue_name in self.weights}
+
+    def ranking(self, now=None):
+        """
+        Queue names in the order they should be tried for the next job
+        """
+        now = time.monotonic() if now is None else now
+        starved = sorted((served, queue_name) for queue_name, served in self.last_served.items()
+                         if now - served >= self.max_wait)
+        order = [queue_name for _, queue_name in starved]
+        order += sorted((queue_name for queue_name in self.weights if queue_name not in order),
+                        key=lambda queue_name: -(self.credits[queue_name] + self.weights[queue_name]))
+        return order
+
+    def served(self, queue_name, now=None):
+        """
+        Charge a queue for the job just taken from it
+        """
+        for name, weight in self.weights.items():
+            self.credits[name] = min(self.credits[name] + weight, self.total)
+        self.credits[queue_name] = max(self.credits[queue_name] - self.total, -self.total)
+        self.last_served[queue_name] = time.monotonic() if now is None else now
+        if self.stats is not None:
+            self.stats.job_taken(queue_name)
+
+    def next_job(self, redis_client, worker_id=None, timeout=1):
+        """
+        Take the next job, claiming it into the worker's processing list of its queue if worker_id
+        is given (reliable mode).
+
+        Returns (queue_name, message), or None if no job arrived within the timeout.
+        """
+        order = self.ranking()
+        if worker_id is None:
+            job_data = redis_client.brpop(order, timeout=timeout)
+            if job_data is None:
+                return None
+            queue_name, message = job_data
+            if isinstance(queue_name, bytes):
+                queue_name = queue_name.decode('utf-8')
+        else:
+            queue_name, message = None, None
+            for candidate in order:
+                processing_list = reliable_queue.processing_list_name(candidate, worker_id)
+                message = reliable_queue.claim_job(redis_client, candidate, processing_list, timeout=None)
+                if message is not None:
+                    queue_name = candidate
+                    break
+            else:
+                # Everything is empty: wait on the queue that is next in line
+                queue_name = order[0]
+                processing_list = reliable_queue.processing_list_name(queue_name, worker_id)
+                message = reliable_queue.claim_job(redis_client, queue_name, processing_list, timeout)
+                if message is None:
+                    return None
+
+        self.served(queue_name)
+        return queue_name, message
+
+
+def run_stats_reporter(stats, interval=60):
+    """
+    Periodically print per-queue throughput; meant to run in a daemon thread next to the workers
+    """
+    while True:
+        time.sleep(interval)
+        print("Queue throughput:")
+        stats.print_stats()
@@ -0,0 +1,260 @@
+import hashlib
+import time
+
+import redis
+
+# Reliable (at-least-once) consumption on top of plain Redis lists.
+#
+# A worker atomically moves a job from its queue into its own processing list with BLMOVE and
+# records the claim time. The job is removed from the processing list (acknowledged) only once
+# its conversation has been saved. Jobs whose claim is older than the visibility timeout - e.g.
+# because the worker crashed - are put back on their queue by the reaper, and jobs that keep
+# failing are moved to a dead-letter list after max_attempts tries.
+#
+# Key layout for a queue "profiles:queue:0":
+#   profiles:queue:0:processing:<worker_id>   jobs currently claimed by a worker
+#   profiles:queue:0:claimed_at               hash: claim field -> claim timestamp
+#   profiles:queue:0:attempts                 hash: job digest -> failed attempt count
+#   profiles:queue:0:dead                     dead-letter list
+#
+# A claim field is the job digest plus the processing list holding it, so byte-identical copies
+# of a job claimed by different workers keep their own claim times. The dispatcher gives every
+# dispatched copy its own dispatch_id, so the copies' attempt counts are separate as well.
+
+PROCESSING_MARKER = ":processing:"
+
+
+def processing_list_name(queue_name, worker_id):
+    """
+    Name of the per-worker processing list for a queue
+    """
+    return f"{queue_name}{PROCESSING_MARKER}{worker_id}"
+
+
+def dead_letter_name(queue_name):
+    """
+    Name of the dead-letter list for a queue
+    """
+    return f"{queue_name}:dead"
+
+
+def source_queue_name(processing_list):
+    """
+    Recover the queue a processing list belongs to
+    """
+    return processing_list.rsplit(PROCESSING_MARKER, 1)[0]
+
+
+def queue_depths(redis_client, queue_prefix="profiles"):
+    """
+    Count the jobs of every queue under a prefix, found with SCAN and counted in one pipeline.
+
+    Returns a dict mapping each queue name to its pending, claimed (in processing lists), dead and
+    uncached (parked by --cache-only) job counts.
+    """
+    marker = f"{queue_prefix}:queue:"
+    lists = []
+    for key in redis_client.scan_iter(match=f"{marker}*", count=1000):
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        queue_id, _, suffix = key[len(marker):].partition(":")
+        if not suffix:
+            state = "pending"
+        elif suffix == "dead":
+            state = "dead"
+        elif suffix == "uncached":
+            state = "uncached"
+        elif suffix.startswith(PROCESSING_MARKER[1:]):
+            state = "claimed"
+        else:
+            # The claim and attempt hashes
+            continue
+        lists.append((f"{marker}{queue_id}", state, key))
+
+    pipe = redis_client.pipeline(transaction=False)
+    for _, _, key in lists:
+        pipe.llen(key)
+    depths = {}
+    for (queue_name, state, _), length in zip(lists, pipe.execute()):
+        counts = depths.setdefault(queue_name, {"pending": 0, "claimed": 0, "dead": 0, "uncached": 0})
+        counts[state] += length
+    return dict(sorted(depths.items()))
+
+
+def job_digest(message):
+    """
+    Compact, stable identifier of a raw job message used as a hash field
+    """
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+    return hashlib.sha1(message).hexdigest()
+
+
+def claim_field(processing_list, message):
+    """
+    Field of a claimed job in the claimed_at hash: its digest and the processing list holding it
+    """
+    return f"{job_digest(message)}:{processing_list}"
+
+
+def claim_job(redis_client, queue_name, processing_list, timeout=1):
+    """
+    Atomically move the next job from a queue into a processing list.
+
+    With timeout None the call doesn't block. Returns the raw message, or None if no job arrived
+    within the timeout.
+    """
+    if timeout is None:
+        message = redis_client.lmove(queue_name, processing_list, src="RIGHT", dest="LEFT")
+    else:
+        message = redis_client.blmove(queue_name, processing_list, timeout, src="RIGHT", dest="LEFT")
+    if message is not None:
+        redis_client.hset(f"{queue_name}:claimed_at", claim_field(processing_list, message), time.time())
+    return message
+
+
+def ack_job(redis_client, queue_name, processing_list, message):
+    """
+    Acknowledge a job once its output has been saved, removing every trace of the claim.
+
+    Returns True if the job was still claimed by this processing list.
+    """
+    digest = job_digest(message)
+    pipe = redis_client.pipeline()
+    pipe.lrem(processing_list, 1, message)
+    pipe.hdel(f"{queue_name}:claimed_at", claim_field(processing_list, message))
+    pipe.hdel(f"{queue_name}:attempts", digest)
+    removed, _, _ = pipe.execute()
+    return removed > 0
+
+
+def release_job(redis_client, queue_name, processing_list, message, max_attempts=3, dead=False, front=False,
+                count_attempt=True):
+    """
+    Give a claimed job back after a failed attempt.
+
+    The job is pushed back onto its queue, or onto the dead-letter list once it has failed
+    max_attempts times (or immediately if dead is True). With front=True the job is returned to
+    the head of the queue so it is the next one consumed. count_attempt=False returns the job
+    without charging it an attempt, for failures that were not the job's fault.
+
+    Returns "requeued", "dead", or None if the job was no longer in the processing list
+    (another worker or reaper already released it).
+
+    Removing the job from the processing list and pushing it back happen in one MULTI, so the job
+    can't be lost in between; WATCH retries the release if another worker or reaper touches the
+    claim first.
+    """
+    digest = job_digest(message)
+    attempts_key = f"{queue_name}:attempts"
+    outcome = None
+
+    def release(pipe):
+        nonlocal outcome
+        outcome = None
+        if pipe.lpos(processing_list, message) is None:
+            return
+        attempts = int(pipe.hget(attempts_key, digest) or 0) + (1 if count_attempt else 0)
+
+        pipe.multi()
+        pipe.lrem(processing_list, 1, message)
+        pipe.hdel(f"{queue_name}:claimed_at", claim_field(processing_list, message))
+        if dead or (count_attempt and attempts >= max_attempts):
+            pipe.lpush(dead_letter_name(queue_name), message)
+            pipe.hdel(attempts_key, digest)
+            outcome = "dead"
+        else:
+            if count_attempt:
+                pipe.hset(attempts_key, digest, attempts)
+            if front:
+                # Consumers pop from the right, so RPUSH makes this the next job out
+                pipe.rpush(queue_name, message)
+            else:
+                pipe.lpush(queue_name, message)
+            outcome = "requeued"
+
+    redis_client.transaction(release, processing_list, attempts_key)
+    return outcome
+
+
+def requeue_claims(redis_client, worker_id):
+    """
+    Return every job still claimed by a worker that has exited to the head of its queue.
+
+    Covers the processing lists of worker_id and of its threads (worker_id-<n>). The jobs were
+    not the cause of the exit, so no attempt is charged.
+
+    Returns the number of jobs requeued.
+    """
+    requeued = 0
+    for pattern in (f"*{PROCESSING_MARKER}{worker_id}", f"*{PROCESSING_MARKER}{worker_id}-*"):
+        for processing_list in redis_client.scan_iter(match=pattern, count=1000):
+            if isinstance(processing_list, bytes):
+                processing_list = processing_list.decode('utf-8')
+            queue_name = source_queue_name(processing_list)
+            for message in redis_client.lrange(processing_list, 0, -1):
+                if release_job(redis_client, queue_name, processing_list, message, front=True,
+                               count_attempt=False) == "requeued":
+                    requeued += 1
+    return requeued
+
+
+def reap_expired(redis_client, queue_prefix="profiles", visibility_timeout=300, max_attempts=3):
+    """
+    Requeue jobs whose claim is older than the visibility timeout.
+
+    Scans every processing list under the prefix, so it also recovers jobs left behind by workers
+    that no longer exist. Safe to run from several processes at once: LREM decides which reaper
+    gets to release a given job.
+
+    Returns:
+        tuple: (number of jobs requeued, number of jobs moved to dead-letter lists)
+    """
+    now = time.time()
+    requeued = 0
+    dead = 0
+
+    for processing_list in redis_client.scan_iter(match=f"{queue_prefix}:queue:*{PROCESSING_MARKER}*"):
+        if isinstance(processing_list, bytes):
+            processing_list = processing_list.decode('utf-8')
+        queue_name = source_queue_name(processing_list)
+        claims_key = f"{queue_name}:claimed_at"
+
+        messages = redis_client.lrange(processing_list, 0, -1)
+        if not messages:
+            continue
+        fields = [claim_field(processing_list, message) for message in messages]
+        claimed_at = redis_client.hmget(claims_key, fields)
+
+        for message, field, claimed in zip(messages, fields, claimed_at):
+            if claimed is None:
+                # The worker died between BLMOVE and recording the claim; start the clock now
+                redis_client.hsetnx(claims_key, field, now)
+                continue
+            if now - float(claimed) < visibility_timeout:
+                continue
+
+            outcome = release_job(redis_client, queue_name, processing_list, message, max_attempts)
+            if outcome == "requeued":
+                requeued += 1
+            elif outcome == "dead":
+                dead += 1
+
+    return requeued, dead
+
+
+def run_reaper(redis_client, queue_prefix="profiles", visibility_timeout=300, max_attempts=3, interval=30):
+    """
+    Periodically reap expired jobs; meant to run in a daemon thread next to the workers
+    """
+    print(f"Starting reaper for {queue_prefix}:queue:* (visibility timeout: {visibility_timeout}s, "
+          f"max attempts: {max_attempts})")
+
+    while True:
+        try:
+            requeued, dead = reap_expired(redis_client, queue_prefix, visibility_timeout, max_attempts)
+            if requeued or dead:
+                print(f"Reaper requeued {requeued} expired jobs, moved {dead} to dead-letter queues")
+        except redis.exceptions.RedisError as e:
+            print(f"Redis error in reaper: {e}")
+        time.sleep(interval)
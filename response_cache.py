@@ -0,0 +1,184 @@
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+# Content-addressed cache of model replies.
+#
+# A reply is stored under the SHA-256 of the canonical chat completion request body - model name,
+# sampling parameters and the full prompt - so a rerun after a crash or a re-dispatch gets the
+# answer it already paid for instead of sending the same request to the GPU again. Both backends
+# are bounded to max_entries and evict the least recently used replies first.
+#
+# Backends:
+#   sqlite  a local database file (WAL mode, so several worker processes can share it); rows are
+#           counted once per batch of EVICTION_BATCH * max_entries stores (or when the running
+#           estimate reaches max_entries) rather than on every store, and a full cache evicts such
+#           a batch at once
+#   redis   {queue_prefix}:cache:<key> strings plus a {queue_prefix}:cache:lru sorted set of last use
+
+
+def cache_key(payload):
+    """
+    Cache key of a chat completion request body (see prompt.build_chat_payload)
+    """
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# Share of max_entries evicted at once by the sqlite cache when it is full
+EVICTION_BATCH = 0.01
+
+
+class CacheStats:
+    """
+    Hit/miss/store/eviction counters shared by the worker threads using a cache
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def count(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def format(self):
+        lookups = self.hits + self.misses
+        hit_rate = 100 * self.hits / lookups if lookups else 0.0
+        return (f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+                f"{self.stores} stored, {self.evictions} evicted")
+
+
+class SqliteResponseCache:
+    """
+    Replies in a local SQLite database, shared by all threads of a process
+    """
+
+    def __init__(self, path, max_entries=1000000):
+        self.path = path
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, "
+                                     "model TEXT, response TEXT, last_used REAL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            # Rows in the table as far as this process knows; replaced rows and other processes'
+            # stores make it drift, so it is corrected by a real count before evicting
+            self._estimate = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        self._batch = int(max_entries * EVICTION_BATCH)
+        self._uncounted = 0
+
+    def get(self, key):
+        """
+        Cached reply for a key, or None
+        """
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.stats.count("hits" if row is not None else "misses")
+        return row[0] if row is not None else None
+
+    def put(self, key, model_name, response):
+        """
+        Store a reply, evicting the least recently used ones beyond max_entries
+        """
+        evicted = 0
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                                     (key, model_name, response, time.time()))
+            self._estimate += 1
+            self._uncounted += 1
+            if self._estimate > self.max_entries or self._uncounted > self._batch:
+                self._uncounted = 0
+                count = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if count > self.max_entries:
+                    # Make room for a batch of stores before the table needs counting again
+                    evicted = count - self.max_entries + self._batch
+                    self._connection.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                                             "ORDER BY last_used LIMIT ?)", (evicted,))
+                self._estimate = count - evicted
+        self.stats.count("stores")
+        if evicted:
+            self.stats.count("evictions", evicted)
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class RedisResponseCache:
+    """
+    Replies in Redis, shared by every worker and host
+    """
+
+    def __init__(self, redis_client, queue_prefix="profiles", max_entries=1000000):
+        self.redis_client = redis_client
+        self.prefix = f"{queue_prefix}:cache"
+        self.lru_key = f"{self.prefix}:lru"
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+
+    def get(self, key):
+        """
+        Cached reply for a key, or None
+        """
+        response = self.redis_client.get(f"{self.prefix}:{key}")
+        if response is None:
+            self.stats.count("misses")
+            return None
+        self.redis_client.zadd(self.lru_key, {key: time.time()})
+        self.stats.count("hits")
+        return response.decode('utf-8') if isinstance(response, bytes) else response
+
+    def put(self, key, model_name, response):
+        """
+        Store a reply, evicting the least recently used ones beyond max_entries
+        """
+        pipe = self.redis_client.pipeline()
+        pipe.set(f"{self.prefix}:{key}", response)
+        pipe.zadd(self.lru_key, {key: time.time()})
+        pipe.zcard(self.lru_key)
+        size = pipe.execute()[-1]
+        self.stats.count("stores")
+
+        excess = size - self.max_entries
+        if excess > 0:
+            evicted = self.redis_client.zpopmin(self.lru_key, excess)
+            if evicted:
+                self.redis_client.delete(*(f"{self.prefix}:{self._decode(member)}" for member, _ in evicted))
+                self.stats.count("evictions", len(evicted))
+
+    @staticmethod
+    def _decode(member):
+        return member.decode('utf-8') if isinstance(member, bytes) else member
+
+    def __len__(self):
+        return self.redis_client.zcard(self.lru_key)
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python response_cache.py <cache.sqlite>")
+        sys.exit(1)
+    cache = SqliteResponseCache(sys.argv[1])
+    rows = cache._connection.execute("SELECT model, COUNT(*) FROM responses GROUP BY model").fetchall()
+    print(f"{len(cache)} cached replies in {sys.argv[1]}")
+    for model_name, count in rows:
+        print(f"  {model_name}: {count}")
@@ -0,0 +1,215 @@
+import json
+import math
+import re
+import threading
+
+from prompt_templates import COMMUNICATION_STYLES, VIBE_CATEGORIES, NUM_PERSONALITY_TRAITS
+
+# Validation and repair of model replies.
+#
+# Replies are supposed to be a bare JSON object in the shape of prompt_templates.SCHEMA_BLOCK, but
+# reasoning models wrap it in <think> blocks, others add markdown fences or prose, and some get the
+# JSON or the schema wrong. A reply is cleaned up (reasoning, fences and surrounding text removed,
+# trailing commas dropped), parsed and checked against the schema. With repair, fixable deviations
+# are corrected: enum values in the wrong case, scores outside 0-100, extra personality traits.
+# What is left is either a valid, normalized JSON reply or a list of errors.
+
+THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL | re.IGNORECASE)
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+_STYLE_LOOKUP = {style.lower(): style for style in COMMUNICATION_STYLES}
+_VIBE_LOOKUP = {vibe.lower(): vibe for vibe in VIBE_CATEGORIES}
+
+
+def extract_json_text(reply):
+    """
+    The JSON object inside a reply, without reasoning blocks, fences or surrounding prose.
+
+    Returns None if the reply holds no complete object (e.g. reasoning that never finished).
+    """
+    text = THINK_BLOCK.sub("", reply)
+    if re.search(r"<think>", text, re.IGNORECASE):
+        return None
+
+    start = text.find("{")
+    if start < 0:
+        return None
+
+    # Scan for the brace closing the first object, skipping braces inside strings
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return None
+
+
+def parse_reply(reply):
+    """
+    Parse the JSON object in a reply; returns (object or None, error or None)
+    """
+    text = extract_json_text(reply)
+    if text is None:
+        return None, "reply has no complete JSON object"
+    try:
+        return json.loads(text), None
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(TRAILING_COMMA.sub(r"\1", text)), None
+    except json.JSONDecodeError as e:
+        return None, f"reply is malformed JSON ({e.msg})"
+
+
+def _is_score(value):
+    # json.loads accepts NaN and Infinity, which can't be clamped into a score
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _clamp_score(value):
+    return int(round(min(max(value, 0), 100)))
+
+
+def check_schema(analysis, repair=True):
+    """
+    Check a parsed reply against the advertised schema, repairing it in place if allowed.
+
+    Every error starts with the name of the field it concerns.
+
+    Returns:
+        tuple: (errors, repairs) - lists of human-readable problems left and fixes applied
+    """
+    if not isinstance(analysis, dict):
+        return ["reply is not a JSON object"], []
+
+    errors = []
+    repairs = []
+
+    traits = analysis.get("personality_traits")
+    if not isinstance(traits, list) or not all(isinstance(trait, str) and trait.strip() for trait in traits):
+        errors.append("personality_traits is not a list of strings")
+    elif len(traits) > NUM_PERSONALITY_TRAITS and repair:
+        analysis["personality_traits"] = traits[:NUM_PERSONALITY_TRAITS]
+        repairs.append(f"kept first {NUM_PERSONALITY_TRAITS} personality_traits")
+    elif len(traits) != NUM_PERSONALITY_TRAITS:
+        errors.append(f"personality_traits has {len(traits)} entries instead of {NUM_PERSONALITY_TRAITS}")
+
+    for field, lookup in (("communication_style", _STYLE_LOOKUP), ("vibe_category", _VIBE_LOOKUP)):
+        value = analysis.get(field)
+        canonical = lookup.get(value.strip().lower()) if isinstance(value, str) else None
+        if canonical is None:
+            errors.append(f"{field} {value!r} is not an allowed value")
+        elif canonical != value:
+            if repair:
+                analysis[field] = canonical
+                repairs.append(f"{field} {value!r} -> {canonical!r}")
+            else:
+                errors.append(f"{field} {value!r} is not an allowed value")
+
+    for field in ("key_strength", "growth_area"):
+        value = analysis.get(field)
+        if not isinstance(value, str) or not value.strip():
+            errors.append(f"{field} is missing")
+
+    score_fields = [(analysis, "confidence_score")]
+    radar = analysis.get("radar_data")
+    if not isinstance(radar, list) or not radar:
+        errors.append("radar_data is not a list")
+    else:
+        for entry in radar:
+            if not isinstance(entry, dict) or not isinstance(entry.get("trait"), str):
+                errors.append("radar_data entry without a trait")
+            else:
+                score_fields.append((entry, "score"))
+
+    for container, field in score_fields:
+        value = container.get(field)
+        name = field if container is analysis else f"radar_data score for {container['trait']}"
+        if not _is_score(value):
+            errors.append(f"{name} is not a number")
+        elif not 0 <= value <= 100 or value != int(value):
+            if repair:
+                container[field] = _clamp_score(value)
+                repairs.append(f"{name} {value} -> {container[field]}")
+            else:
+                errors.append(f"{name} {value} is outside 0-100")
+
+    return errors, repairs
+
+
+class ValidityStats:
+    """
+    Per-model counts of valid, repaired and invalid replies, shared by worker threads
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name, outcome, errors=()):
+        with self._lock:
+            counts = self._counts.setdefault(model_name, {"valid": 0, "repaired": 0, "invalid": 0})
+            counts[outcome] += 1
+            for error in errors:
+                # Group by the field at fault, not the offending value
+                kind = error.split(" ", 1)[0]
+                self._errors[(model_name, kind)] = self._errors.get((model_name, kind), 0) + 1
+
+    def print_stats(self):
+        with self._lock:
+            for model_name, counts in sorted(self._counts.items()):
+                total = sum(counts.values())
+                usable = counts["valid"] + counts["repaired"]
+                print(f"  {model_name}: {usable}/{total} usable ({100 * usable / total:.1f}%), "
+                      f"{counts['repaired']} repaired, {counts['invalid']} invalid")
+                problems = sorted(((count, kind) for (model, kind), count in self._errors.items()
+                                   if model == model_name), reverse=True)
+                if problems:
+                    print(f"    most common problems: {', '.join(f'{kind} ({count})' for count, kind in problems[:5])}")
+
+
+class ResponseValidator:
+    """
+    Validates replies for the workers and keeps their validity statistics.
+
+    retries is the number of extra requests a job may make while its reply stays invalid.
+    """
+
+    def __init__(self, repair=True, retries=2):
+        self.repair = repair
+        self.retries = retries
+        self.stats = ValidityStats()
+
+    def check(self, model_name, reply):
+        """
+        Normalized JSON text of a usable reply, or None if it is invalid
+        """
+        analysis, error = parse_reply(reply)
+        if analysis is None:
+            errors, repairs = [error], []
+        else:
+            errors, repairs = check_schema(analysis, self.repair)
+
+        if errors:
+            self.stats.record(model_name, "invalid", errors)
+            print(f"Invalid reply from {model_name}: {'; '.join(errors)}")
+            return None
+
+        self.stats.record(model_name, "repaired" if repairs else "valid")
+        return json.dumps(analysis, ensure_ascii=False, indent=2)
@@ -0,0 +1,127 @@
+import json
+import re
+import threading
+
+import endpoint_health
+
+# Least-loaded routing across a fleet of model endpoints.
+#
+# Instead of binding queue i to port start_port + i, routed workers share one queue and pick an
+# endpoint per job. Each endpoint tracks its in-flight requests and an EWMA of its latency; a job
+# goes to the compatible endpoint with the lowest expected wait, (in_flight + 1) * latency / weight,
+# skipping endpoints whose circuit breaker is open.
+
+EWMA_ALPHA = 0.2
+
+
+class Endpoint:
+    """
+    One model server in the registry together with its live load statistics
+    """
+
+    def __init__(self, port, model, weight=1.0):
+        self.port = int(port)
+        self.model = model
+        self.weight = float(weight)
+        self.base_url = f"http://localhost:{self.port}"
+        self.in_flight = 0
+        self.ewma_latency = None
+        self.completed = 0
+
+    @property
+    def health(self):
+        return endpoint_health.get_health(self.base_url)
+
+    def __repr__(self):
+        return f"Endpoint({self.model} @ {self.base_url}, weight={self.weight})"
+
+
+def load_registry(path):
+    """
+    Load endpoints from a JSON list of {"port", "model", "weight"} objects, or from the model
+    table in a models.md-style markdown file (weight 1 for every row).
+    """
+    if path.endswith(".md"):
+        return registry_from_markdown(path)
+
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    return [Endpoint(entry["port"], entry["model"], entry.get("weight", 1.0)) for entry in entries]
+
+
+def registry_from_markdown(path):
+    """
+    Parse the | Port | Model | Version/Checkpoint | ... | table of models.md.
+
+    vLLM serves a model under its checkpoint name, so that column is used as the model name.
+    """
+    endpoints = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+            if len(cells) >= 3 and re.fullmatch(r"\d+", cells[0]):
+                endpoints.append(Endpoint(cells[0], cells[2]))
+    return endpoints
+
+
+class Router:
+    """
+    Picks the least-loaded healthy endpoint for each job; shared by all routed worker threads
+    """
+
+    def __init__(self, endpoints):
+        if not endpoints:
+            raise ValueError("Router needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self._lock = threading.Lock()
+
+    def _expected_wait(self, endpoint, default_latency):
+        latency = endpoint.ewma_latency if endpoint.ewma_latency is not None else default_latency
+        return (endpoint.in_flight + 1) * latency / endpoint.weight
+
+    def _candidates(self, model):
+        return [endpoint for endpoint in self.endpoints if model is None or endpoint.model == model]
+
+    def any_available(self, model=None):
+        """
+        Whether some compatible endpoint could take a job right now
+        """
+        return any(endpoint.health.is_available() for endpoint in self._candidates(model))
+
+    def acquire(self, model=None):
+        """
+        Reserve the best endpoint for a job, or None if no compatible endpoint is available.
+
+        Every successful acquire must be matched by a release.
+        """
+        with self._lock:
+            candidates = self._candidates(model)
+            known = [endpoint.ewma_latency for endpoint in candidates if endpoint.ewma_latency is not None]
+            # Endpoints without measurements look average so they get tried early on
+            default_latency = sum(known) / len(known) if known else 1.0
+
+            for endpoint in sorted(candidates, key=lambda e: self._expected_wait(e, default_latency)):
+                if endpoint.health.is_available():
+                    endpoint.in_flight += 1
+                    return endpoint
+        return None
+
+    def release(self, endpoint, latency=None):
+        """
+        Return an endpoint reservation; latency (seconds) of a completed request updates its EWMA
+        """
+        with self._lock:
+            endpoint.in_flight -= 1
+            if latency is not None:
+                endpoint.completed += 1
+                if endpoint.ewma_latency is None:
+                    endpoint.ewma_latency = latency
+                else:
+                    endpoint.ewma_latency = EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * endpoint.ewma_latency
+
+    def print_stats(self):
+        with self._lock:
+            for endpoint in self.endpoints:
+                latency = f"{endpoint.ewma_latency:.2f}s" if endpoint.ewma_latency is not None else "n/a"
+                print(f"  {endpoint.model} @ {endpoint.base_url}: {endpoint.completed} completed, "
+                      f"{endpoint.in_flight} in flight, EWMA latency {latency}")
@@ -25,32 +25,10 @@ echo "Started dispatcher (PID: $DISPATCHER_PID) - queues 0,1,2"
 # Wait a few seconds for dispatcher to initialize
 sleep 5
 
-echo "🤖 Starting three prompt processors..."
-
-# Start three prompt processors, each with its own queue
-# Each will process from a different queue and output to different subdirectories
-python3 prompt.py --num-queues 1 --queue-offset 0 --start-port 11434 --output-dir "../output/worker1" --model "$MODEL_NAME" &
-GENERATOR1_PID=$!
-echo "Started generator 1 (PID: $GENERATOR1_PID) - queue 0 -> ../output/worker1/"
-
-python3 prompt.py --num-queues 1 --queue-offset 1 --start-port 11434 --output-dir "../output/worker2" --model "$MODEL_NAME" &
-GENERATOR2_PID=$!
-echo "Started generator 2 (PID: $GENERATOR2_PID) - queue 1 -> ../output/worker2/"
-
-python3 prompt.py --num-queues 1 --queue-offset 2 --start-port 11434 --output-dir "../output/worker3" --model "$MODEL_NAME" &
-GENERATOR3_PID=$!
-echo "Started generator 3 (PID: $GENERATOR3_PID) - queue 2 -> ../output/worker3/"
-
-echo "✅ All instances started!"
-echo ""
-echo "📊 Process Status:"
-echo "Dispatcher: PID $DISPATCHER_PID (queues 0,1,2)"
-echo "Generator 1: PID $GENERATOR1_PID (queue 0 -> ../output/worker1/)"
-echo "Generator 2: PID $GENERATOR2_PID (queue 1 -> ../output/worker2/)"
-echo "Generator 3: PID $GENERATOR3_PID (queue 2 -> ../output/worker3/)"
+echo "🤖 Starting three supervised prompt processors (see workers_example.json)..."
+echo "Queue 0 -> ../output/worker1/, queue 1 -> ../output/worker2/, queue 2 -> ../output/worker3/"
 echo ""
-echo "🛑 To stop all processes:"
-echo "kill $DISPATCHER_PID $GENERATOR1_PID $GENERATOR2_PID $GENERATOR3_PID"
+echo "🛑 To stop: kill -TERM $$ (workers finish in-flight jobs, claimed jobs are requeued)"
 echo ""
 echo "📁 Output directories:"
 echo "ls -la ../output/worker*/"
@@ -58,5 +36,8 @@ echo "ls -la ../output/worker*/"
 # Make script executable
 chmod +x "$0"
 
-# Keep script running to monitor
-wait 
\ No newline at end of file
+# The supervisor restarts crashed workers and drains them all on SIGTERM or Ctrl+C
+trap 'kill -TERM $SUPERVISOR_PID; wait $SUPERVISOR_PID; kill $DISPATCHER_PID 2>/dev/null' TERM INT
+python3 supervisor.py --drain-timeout 60 workers_example.json -- --model "$MODEL_NAME" &
+SUPERVISOR_PID=$!
+wait $SUPERVISOR_PID
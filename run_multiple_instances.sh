@@ -1,13 +1,8 @@
-
 # Example script showing how to run multiple instances of dispatcher and prompt generator
 #!/bin/bash
 
 echo "🚀 Starting multiple instances of profile processing pipeline"
 
-# Kill any existing processes (optional)
-# pkill -f "python3 dispatcher.py"
-# pkill -f "python3 prompt.py"
-
 echo "📦 Starting dispatchers..."
 
 # Dispatcher 1: Process first dataset to queues 0-3
@@ -15,39 +10,26 @@ python3 dispatcher.py --queue-offset 0 --num-queues 4 &
 DISPATCHER1_PID=$!
 echo "Started dispatcher 1 (PID: $DISPATCHER1_PID) - queues 0-3"
 
-# Dispatcher 2: Process second dataset to queues 4-7  
+# Dispatcher 2: Process second dataset to queues 4-7
 python3 dispatcher.py --queue-offset 4 --num-queues 4 &
 DISPATCHER2_PID=$!
 echo "Started dispatcher 2 (PID: $DISPATCHER2_PID) - queues 4-7"
 
-# Wait a few seconds for d
+# Wait a few seconds for dispatchers to initialize
 sleep 5
 
-echo "🤖 Starting prompt +..."
-
-# Generator 1: Process ports 8000-8003 (queues 0-3) -> ../output1/
-python3 prompt.py --start-port 8000 --num-queues 4 --queue-offset 0 --output-dir "../output1" &
-GENERATOR1_PID=$!
-echo "Started generator 1 (PID: $GENERATOR1_PID) - ports 8000-8003 -> ../output1/"
-
-# Generator 2: Process ports 8004-8007 (queues 4-7) -> ../output2/
-python3 prompt.py --start-port 8004 --num-queues 4 --queue-offset 4 --output-dir "../output2" &
-GENERATOR2_PID=$!
-echo "Started generator 2 (PID: $GENERATOR2_PID) - ports 8004-8007 -> ../output2/"
-
-echo "✅ All instances started!"
-echo ""
-echo "📊 Process Status:"
-echo "Dispatcher 1: PID $DISPATCHER1_PID (queues 0-3)"
-echo "Dispatcher 2: PID $DISPATCHER2_PID (queues 4-7)" 
-echo "Generator 1:  PID $GENERATOR1_PID (ports 8000-8003 -> ../output1/)"
-echo "Generator 2:  PID $GENERATOR2_PID (ports 8004-8007 -> ../output2/)"
+echo "🤖 Starting two supervised prompt generators (see workers_multiple_example.json)..."
+echo "Generator 1: ports 8000-8003 (queues 0-3) -> ../output1/"
+echo "Generator 2: ports 8004-8007 (queues 4-7) -> ../output2/"
 echo ""
-echo "🛑 To stop all processes:"
-echo "kill $DISPATCHER1_PID $DISPATCHER2_PID $GENERATOR1_PID $GENERATOR2_PID"
+echo "🛑 To stop: kill -TERM $$ (workers finish in-flight jobs, claimed jobs are requeued)"
 echo ""
 echo "📁 Output directories:"
 echo "ls -la ../output1/ ../output2/"
 
-# Keep script running to monitor
-wait
+# The supervisor restarts crashed generators and drains them all on SIGTERM or Ctrl+C; extra
+# arguments (e.g. --model qwen3:32b) are passed to every generator
+trap 'kill -TERM $SUPERVISOR_PID; wait $SUPERVISOR_PID; kill $DISPATCHER1_PID $DISPATCHER2_PID 2>/dev/null' TERM INT
+python3 supervisor.py --drain-timeout 60 workers_multiple_example.json -- "$@" &
+SUPERVISOR_PID=$!
+wait $SUPERVISOR_PID
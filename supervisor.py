@@ -0,0 +1,238 @@
+import argparse
+import json
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import redis
+
+import reliable_queue
+from check_queues import parse_duration
+
+# Worker process supervisor.
+#
+# Replaces the shell fan-out of run.sh: one entry point starts every worker process described in
+# a JSON config, restarts the ones that exit with exponential backoff, and shuts them all down
+# cleanly. The config lists worker groups; each group's options are prompt.py flags without the
+# leading dashes, on top of the config's defaults (true means a bare flag, false or null leaves it
+# out). A group with "replicas" is started that many times: "{replica}" in an option is replaced by
+# the replica number (1, 2, ...) and the integer options named in "advance" (default: queue-offset)
+# grow by num-queues per replica, so replicas never share a queue (add start-port when each replica
+# has its own servers). "script" runs something other than prompt.py, e.g. a feeder:
+#
+#   {
+#     "defaults": {"start-port": 11434, "reliable": true},
+#     "workers": [
+#       {"name": "generator", "replicas": 3,
+#        "options": {"num-queues": 1, "queue-offset": 0, "output-dir": "../output/worker{replica}"}}
+#     ]
+#   }
+#
+# On SIGTERM or SIGINT (and SIGUSR1/SIGUSR2, which SGE sends ahead of a kill with qsub -notify),
+# or after --stop-after, every worker gets SIGTERM and --drain-timeout seconds to finish its
+# in-flight jobs; stragglers are killed. Jobs still claimed by a worker that exited - crashed or
+# stopped - are returned to the head of their queues right away instead of waiting out the
+# visibility timeout (reliable workers; without --reliable a popped job is lost with its worker).
+# Workers run in their own sessions, so a Ctrl+C reaches them only through the supervisor.
+
+
+def expand_workers(config, extra_args=()):
+    """
+    (name, options, command) for every worker process in a config; extra_args are appended to
+    every prompt.py command line
+    """
+    defaults = config.get("defaults", {})
+    workers = []
+    for group_index, group in enumerate(config.get("workers", [])):
+        replicas = int(group.get("replicas", 1))
+        base = dict(defaults, **group.get("options", {}))
+        script = group.get("script", "prompt.py")
+        name = group.get("name", f"worker{group_index + 1}")
+        advance = group.get("advance", ["queue-offset"])
+        for replica in range(1, replicas + 1):
+            options = {}
+            for key, value in base.items():
+                if isinstance(value, str):
+                    value = value.replace("{replica}", str(replica))
+                options[key] = value
+            for key in advance:
+                if isinstance(options.get(key), int):
+                    options[key] += (replica - 1) * int(options.get("num-queues", 1))
+
+            command = [sys.executable, "-u", script]
+            for key, value in options.items():
+                if value is True:
+                    command.append(f"--{key}")
+                elif value is not False and value is not None:
+                    command.extend([f"--{key}", str(value)])
+            if script == "prompt.py":
+                command.extend(extra_args)
+            workers.append((name if replicas == 1 else f"{name}{replica}", options, command))
+    return workers
+
+
+def restart_delay(failures, base=1.0, cap=60.0):
+    """
+    Seconds to wait before restarting a worker that has exited failures times in a row
+    """
+    return min(cap, base * 2 ** max(failures - 1, 0))
+
+
+class WorkerProcess:
+    """
+    One supervised worker process and its restart state
+    """
+
+    def __init__(self, name, options, command):
+        self.name = name
+        self.options = options
+        self.command = command
+        self.process = None
+        self.started_at = None
+        self.failures = 0
+        self.restart_at = 0.0
+
+    @property
+    def worker_id(self):
+        # prompt.py names its processing lists after the host and its pid
+        return f"{socket.gethostname()}-{self.process.pid}"
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, start_new_session=True)
+        self.started_at = time.monotonic()
+        print(f"Started {self.name} (PID {self.process.pid}): {' '.join(self.command[2:])}")
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+
+class Supervisor:
+    """
+    Keeps the workers running until stopped, then drains them
+    """
+
+    def __init__(self, workers, drain_timeout=60.0, base_delay=1.0, max_delay=60.0, stable_after=60.0):
+        self.workers = [WorkerProcess(*worker) for worker in workers]
+        self.drain_timeout = drain_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stable_after = stable_after
+        self.stop = threading.Event()
+        self.restarts = 0
+        self._redis_clients = {}
+
+    def request_stop(self, signum=None, frame=None):
+        if not self.stop.is_set():
+            reason = signal.Signals(signum).name if signum else "request"
+            print(f"\nSupervisor stopping ({reason}); draining workers for up to {self.drain_timeout:g}s...")
+        self.stop.set()
+
+    def _requeue_claims(self, worker):
+        """
+        Put the jobs a finished worker still holds back at the head of their queues
+        """
+        if "--reliable" not in worker.command:
+            return
+        key = (worker.options.get("redis-host", "localhost"), int(worker.options.get("redis-port", 6379)),
+               int(worker.options.get("redis-db", 0)))
+        try:
+            if key not in self._redis_clients:
+                self._redis_clients[key] = redis.Redis(host=key[0], port=key[1], db=key[2])
+            requeued = reliable_queue.requeue_claims(self._redis_clients[key], worker.worker_id)
+        except redis.exceptions.RedisError as e:
+            print(f"Could not requeue jobs claimed by {worker.name}: {e}; the reaper will pick them up")
+            return
+        if requeued:
+            print(f"Requeued {requeued} jobs claimed by {worker.name}")
+
+    def poll(self, now=None):
+        """
+        Start workers that are due and schedule restarts of the ones that exited
+        """
+        now = time.monotonic() if now is None else now
+        for worker in self.workers:
+            if worker.process is None:
+                if now >= worker.restart_at:
+                    worker.start()
+                continue
+            code = worker.process.poll()
+            if code is None:
+                continue
+            ran = now - worker.started_at
+            worker.failures = 1 if ran >= self.stable_after else worker.failures + 1
+            delay = restart_delay(worker.failures, self.base_delay, self.max_delay)
+            print(f"{worker.name} (PID {worker.process.pid}) exited with code {code} after {ran:.0f}s; "
+                  f"restarting in {delay:g}s")
+            self._requeue_claims(worker)
+            worker.process = None
+            worker.restart_at = now + delay
+            self.restarts += 1
+
+    def run(self, stop_after=None):
+        started = time.monotonic()
+        while not self.stop.is_set():
+            if stop_after is not None and time.monotonic() - started >= stop_after:
+                print(f"\nRun time of {stop_after}s reached; draining workers for up to {self.drain_timeout:g}s...")
+                break
+            self.poll()
+            self.stop.wait(0.5)
+        self.shutdown()
+
+    def shutdown(self):
+        """
+        SIGTERM every worker, kill those still running after the drain timeout, requeue their claims
+        """
+        running = [worker for worker in self.workers if worker.running()]
+        for worker in running:
+            worker.process.terminate()
+        deadline = time.monotonic() + self.drain_timeout
+        for worker in running:
+            try:
+                worker.process.wait(max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                print(f"{worker.name} (PID {worker.process.pid}) still running after the drain timeout; killing it")
+                worker.process.kill()
+                worker.process.wait()
+        for worker in self.workers:
+            if worker.process is not None:
+                self._requeue_claims(worker)
+        print(f"All workers stopped ({self.restarts} restarts).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run and supervise prompt.py worker processes described in a JSON config",
+                                     usage="%(prog)s [options] config [-- worker args]")
+    parser.add_argument("--drain-timeout", default=60.0, type=float, help="Seconds workers get to finish in-flight jobs after SIGTERM before they are killed")
+    parser.add_argument("--restart-delay", default=1.0, type=float, help="Seconds before restarting a worker that exited; doubles with each quick successive exit")
+    parser.add_argument("--max-restart-delay", default=60.0, type=float, help="Longest wait before restarting a worker")
+    parser.add_argument("--stable-after", default=60.0, type=float, help="Seconds a worker must run for its restart delay to reset")
+    parser.add_argument("--stop-after", default=None, type=parse_duration, help="Drain and stop after this run time (HH:MM:SS or seconds), e.g. h_rt minus the drain timeout")
+    parser.add_argument("--dry-run", action="store_true", help="Print the worker command lines and exit")
+    parser.add_argument("config", help="JSON file listing the worker groups (see supervisor.py)")
+    parser.add_argument("worker_args", nargs=argparse.REMAINDER, help="Extra prompt.py arguments for every worker, after --")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    workers = expand_workers(config, args.worker_args)
+    if not workers:
+        print(f"No workers in {args.config}")
+        return
+    if args.dry_run:
+        for name, _, command in workers:
+            print(f"{name}: {' '.join(command)}")
+        return
+
+    supervisor = Supervisor(workers, args.drain_timeout, args.restart_delay, args.max_restart_delay,
+                            args.stable_after)
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1, signal.SIGUSR2):
+        signal.signal(signum, supervisor.request_stop)
+    print(f"Supervising {len(workers)} worker processes. Send SIGTERM or press Ctrl+C to drain and stop.")
+    supervisor.run(args.stop_after)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import asyncio
+import importlib.util
+import json
+import os
+import tempfile
+
+HAVE_DEPENDENCIES = all(importlib.util.find_spec(name) is not None for name in ("aiohttp", "fakeredis"))
+QUEUE = "profiles:queue:0"
+
+
+async def drain(drain_timeout):
+    """
+    Stop a processor with six queued jobs while two requests (of 0.3s) are in flight and two more
+    jobs are prefetched; returns (saved conversations, job ids back in the queue)
+    """
+    import aiohttp
+    import fakeredis.aioredis
+    from aiohttp import web
+    from async_worker import process_queue_async
+
+    async def chat(request):
+        await asyncio.sleep(0.3)
+        return web.json_response({"choices": [{"message": {"content": "reply"}}]})
+
+    app = web.Application()
+    app.add_routes([web.post("/v1/chat/completions", chat)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    redis_client = fakeredis.aioredis.FakeRedis()
+    for index in range(6):
+        await redis_client.lpush(QUEUE, json.dumps({"job_id": f"job-{index}", "profile_data": {"firstName": "A"}}))
+    stop = asyncio.Event()
+    with tempfile.TemporaryDirectory() as output_dir:
+        async with aiohttp.ClientSession() as session:
+            processor = asyncio.create_task(process_queue_async(0, redis_client, session, port, "m", output_dir,
+                                                                concurrency=2, prefetch=2, stop=stop,
+                                                                drain_timeout=drain_timeout))
+            await asyncio.sleep(0.15)
+            stop.set()
+            await asyncio.wait_for(processor, 5)
+        saved = len(os.listdir(output_dir))
+    queued = [json.loads(message)["job_id"] for message in await redis_client.lrange(QUEUE, 0, -1)]
+    await runner.cleanup()
+    return saved, queued
+
+
+def test_drain_on_stop():
+    """
+    A stopped processor returns its prefetched jobs unstarted, lets the requests in flight finish
+    within the drain timeout and returns the ones that don't
+    """
+    if not HAVE_DEPENDENCIES:
+        print("- async worker tests skipped (aiohttp or fakeredis not installed)")
+        return
+    saved, queued = asyncio.run(drain(drain_timeout=5))
+    # Jobs 0 and 1 were in flight and finished; 2 and 3 were prefetched and are next in line again
+    assert saved == 2 and queued == ["job-5", "job-4", "job-3", "job-2"]
+
+    saved, queued = asyncio.run(drain(drain_timeout=0.05))
+    assert saved == 0 and sorted(queued) == [f"job-{index}" for index in range(6)]
+    assert queued[:2] == ["job-5", "job-4"]
+    print("✓ Async processors drain on stop")
+
+
+async def undecodable_replies():
+    """
+    Serve 200s whose bodies aren't JSON and run one job against them; returns the outcomes of
+    both engines' requests, the endpoint's failures, saved conversations and the queued job ids
+    """
+    import aiohttp
+    import fakeredis.aioredis
+    from aiohttp import web
+    import endpoint_health
+    from async_worker import call_model_api_async, run_jobs
+    from prompt import request_completion
+
+    async def html(request):
+        return web.Response(text="<html>Bad gateway</html>", content_type="text/html")
+
+    async def truncated(request):
+        return web.Response(text='{"choices": [{"message": {"cont', content_type="application/json")
+
+    app = web.Application()
+    app.add_routes([web.post("/html/v1/chat/completions", html), web.post("/v1/chat/completions", truncated)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    redis_client = fakeredis.aioredis.FakeRedis()
+    jobs = asyncio.Queue()
+    jobs.put_nowait(json.dumps({"job_id": "job-0", "profile_data": {"firstName": "A"}}))
+    with tempfile.TemporaryDirectory() as output_dir:
+        async with aiohttp.ClientSession() as session:
+            outcomes = [await call_model_api_async(session, "p", f"{port}/html", "m"),
+                        await call_model_api_async(session, "p", port, "m"),
+                        await asyncio.to_thread(request_completion, "p", port, "m")]
+            runner_task = asyncio.create_task(run_jobs(jobs, session, redis_client, QUEUE, port, "m",
+                                                       output_dir, [0]))
+            # Done once the job is handled (requeued, after the endpoint's backoff delay)
+            await asyncio.wait_for(jobs.join(), 5)
+            runner_task.cancel()
+            await asyncio.gather(runner_task, return_exceptions=True)
+        saved = len(os.listdir(output_dir))
+    queued = [json.loads(message)["job_id"] for message in await redis_client.lrange(QUEUE, 0, -1)]
+    failures = endpoint_health.get_health(f"http://localhost:{port}").consecutive_failures
+    await runner.cleanup()
+    return outcomes, failures, saved, queued
+
+
+def test_undecodable_reply_requeues_the_job():
+    """
+    A 200 whose body isn't JSON counts as an endpoint failure in both engines, and the job goes
+    back to the queue instead of being dropped
+    """
+    if not HAVE_DEPENDENCIES:
+        return
+    outcomes, failures, saved, queued = asyncio.run(undecodable_replies())
+    assert [(reply, endpoint_failed) for reply, _, endpoint_failed in outcomes] == [(None, True)] * 3
+    assert failures == 3 and saved == 0 and queued == ["job-0"]
+    print("✓ Undecodable replies requeue the job")
+
+
+if __name__ == '__main__':
+    test_drain_on_stop()
+    test_undecodable_reply_requeues_the_job()
@@ -0,0 +1,41 @@
+from check_queues import parse_duration, format_duration, natural_key, DrainRates
+
+
+def test_durations_and_order():
+    """
+    h_rt-style durations parse, and queues sort by number
+    """
+    assert parse_duration("48:00:00") == 172800
+    assert parse_duration("05:30") == 330
+    assert parse_duration("90") == 90
+    assert format_duration(3900) == "1h05m"
+    assert format_duration(45) == "45s"
+    queues = ["profiles:queue:10", "profiles:queue:2", "profiles:queue:1"]
+    assert sorted(queues, key=natural_key) == ["profiles:queue:1", "profiles:queue:2", "profiles:queue:10"]
+    print("✓ Durations and queue order")
+
+
+def test_drain_rate_and_eta():
+    """
+    The drain rate follows outstanding (pending + claimed) jobs, and the ETA follows the rate
+    """
+    def counts(pending, claimed=0):
+        return {"pending": pending, "claimed": claimed, "dead": 0, "uncached": 0}
+
+    rates = DrainRates()
+    rates.update({"q": counts(1000, 4)}, now=0)
+    assert rates.eta("q", 1004) is None
+    rates.update({"q": counts(900, 4)}, now=10)
+    assert rates.rates["q"] == 10
+    assert rates.eta("q", 904) == 90.4
+
+    # A dispatcher refilling the queue shows up as a queue that isn't draining
+    rates.update({"q": counts(2000, 4)}, now=20)
+    assert rates.rates["q"] < 0 and rates.eta("q", 2004) is None
+    assert rates.eta("q", 0) == 0
+    print("✓ Drain rates and ETAs")
+
+
+if __name__ == '__main__':
+    test_durations_and_order()
+    test_drain_rate_and_eta()
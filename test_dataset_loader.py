@@ -0,0 +1,70 @@
+import gzip
+import importlib.util
+import json
+import os
+import tempfile
+
+import pandas as pd
+
+from dataset_loader import convert_pickle, is_streamable, iter_dataframe_chunks, iter_profile_chunks
+
+HAVE_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+def sample_dataset(count=25):
+    return pd.DataFrame([{"urn": f"urn:li:member:{index}", "firstName": f"User {index}", "rank": index}
+                         for index in range(count)])
+
+
+def ranks(chunks):
+    return [[profile["rank"] for profile in chunk] for chunk in chunks]
+
+
+def test_chunked_readers_and_skip():
+    """
+    Every reader yields the same chunks of plain dicts, and skip resumes after that many
+    profiles (also in the middle of a chunk)
+    """
+    dataset = sample_dataset()
+    expected = ranks(iter_dataframe_chunks(dataset, 10))
+    assert [len(chunk) for chunk in expected] == [10, 10, 5]
+    assert ranks(iter_dataframe_chunks(dataset, 10, skip=12)) == [list(range(12, 22)), [22, 23, 24]]
+    assert ranks(iter_dataframe_chunks(dataset, 10, skip=25)) == []
+
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, "profiles.pcl")
+        dataset.to_pickle(pickle_path)
+        paths = [os.path.join(directory, name) for name in ("profiles.jsonl", "profiles.jsonl.gz")]
+        if HAVE_PYARROW:
+            paths.append(os.path.join(directory, "profiles.parquet"))
+        for path in paths:
+            assert is_streamable(path) and convert_pickle(pickle_path, path, chunk_size=10) == 25
+            assert ranks(iter_profile_chunks(path, 10)) == expected
+            assert ranks(iter_profile_chunks(path, 10, skip=12)) == [list(range(12, 22)), [22, 23, 24]]
+            assert next(iter_profile_chunks(path, 10))[0] == {"urn": "urn:li:member:0", "firstName": "User 0", "rank": 0}
+
+        with gzip.open(paths[1], "rt", encoding="utf-8") as f:
+            assert json.loads(f.readline())["urn"] == "urn:li:member:0"
+
+        # A pickle isn't streamable but still reads in chunks
+        assert not is_streamable(pickle_path)
+        assert ranks(iter_profile_chunks(pickle_path, 10, skip=20)) == [[20, 21, 22, 23, 24]]
+    print(f"✓ Chunked dataset readers{'' if HAVE_PYARROW else ' (Parquet skipped: pyarrow not installed)'}")
+
+
+def test_blank_lines_are_ignored():
+    """
+    Blank lines in a JSON Lines file don't count as profiles, for skip either
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "profiles.ndjson")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{"rank": 0}\n\n{"rank": 1}\n   \n{"rank": 2}\n')
+        assert ranks(iter_profile_chunks(path, 2)) == [[0, 1], [2]]
+        assert ranks(iter_profile_chunks(path, 2, skip=1)) == [[1, 2]]
+    print("✓ Blank JSON Lines ignored")
+
+
+if __name__ == '__main__':
+    test_chunked_readers_and_skip()
+    test_blank_lines_are_ignored()
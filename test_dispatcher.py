@@ -0,0 +1,193 @@
+import importlib.util
+import json
+import os
+import tempfile
+
+import pandas as pd
+import redis
+
+from dispatch_dedup import RedisBloomDedup, RedisSetDedup
+from dispatcher import (dispatch_batched, dispatch_chunks, dispatch_to_redis_queues, feed_queues,
+                         feeder_checkpoint_key, profile_identity, profile_job_id)
+from job_codec import JobEncoder
+from profile_store import ProfileStoreWriter, orphans_path
+
+HAVE_FAKEREDIS = importlib.util.find_spec("fakeredis") is not None
+
+
+def profiles(start, stop):
+    return [{"urn": f"urn:li:member:{index}", "firstName": f"User {index}"} for index in range(start, stop)]
+
+
+def test_dedup_claims_only_pushed_profiles():
+    """
+    Duplicates (also within a chunk) are skipped, and a chunk whose push fails leaves no claims
+    behind, so the next dispatch sends it
+    """
+    if not HAVE_FAKEREDIS:
+        print("- dispatcher tests skipped (fakeredis not installed)")
+        return
+    import fakeredis
+    server = fakeredis.FakeServer()
+    r = fakeredis.FakeRedis(server=server)
+
+    class DisconnectingEncoder(JobEncoder):
+        # The connection drops while the chunk is being prepared
+        def encode(self, job_payload):
+            server.connected = False
+            return super().encode(job_payload)
+
+    for dedup in (RedisSetDedup(r, "set"), RedisBloomDedup(r, "bloom", capacity=1000)):
+        prefix = dedup.key.split(":")[0]
+        queues = [f"{prefix}:queue:0", f"{prefix}:queue:1"]
+        chunks = [profiles(0, 4) + profiles(2, 4), profiles(3, 6)]
+        assert dispatch_chunks(r, chunks, 2, queue_prefix=prefix, dedup=dedup) == 6
+        assert [r.llen(queue) for queue in queues] == [3, 3]
+
+        failing = profiles(6, 9)
+        assert dispatch_chunks(r, [failing], 2, queue_prefix=prefix, dedup=dedup,
+                               encoder=DisconnectingEncoder()) == 0
+        server.connected = True
+        assert not any(dedup.seen([profile_identity(profile) for profile in failing]))
+        assert dispatch_chunks(r, [failing], 2, queue_prefix=prefix, dedup=dedup) == 3
+        assert [r.llen(queue) for queue in queues] == [5, 4]
+    print("✓ Dispatch dedup claims only pushed profiles")
+
+
+def test_feeder_resumes_after_crash():
+    """
+    A feeder that dies while pushing a refill leaves neither claims nor offset behind for it, so
+    the restarted feeder queues every profile exactly once
+    """
+    if not HAVE_FAKEREDIS:
+        return
+    import fakeredis
+    server = fakeredis.FakeServer()
+    r = fakeredis.FakeRedis(server=server)
+    dedup = RedisSetDedup(r)
+
+    class CrashingEncoder(JobEncoder):
+        # The connection drops while the third refill is being prepared
+        encoded = 0
+
+        def encode(self, job_payload):
+            self.encoded += 1
+            if self.encoded > 25:
+                server.connected = False
+            return super().encode(job_payload)
+
+    with tempfile.TemporaryDirectory() as directory:
+        dataset = os.path.join(directory, "profiles.jsonl")
+        with open(dataset, "w", encoding="utf-8") as f:
+            for profile in profiles(0, 50):
+                f.write(json.dumps(profile) + "\n")
+
+        options = dict(low_watermark=90, high_watermark=100, chunk_size=10, poll_interval=0.01, dedup=dedup)
+        try:
+            feed_queues(r, dataset, 1, encoder=CrashingEncoder(), **options)
+        except redis.exceptions.ConnectionError:
+            pass
+        else:
+            raise AssertionError("the feeder survived a lost connection")
+        server.connected = True
+        assert r.llen("profiles:queue:0") == 20
+        assert r.hget(feeder_checkpoint_key(), "profiles.jsonl") == b"20" and r.scard(dedup.key) == 20
+
+        assert feed_queues(r, dataset, 1, **options) == 30
+        job_ids = {json.loads(message)["job_id"] for message in r.lrange("profiles:queue:0", 0, -1)}
+        assert r.llen("profiles:queue:0") == len(job_ids) == 50
+    print("✓ Restarted feeder queues every profile once")
+
+
+def queued_job_ids(r, queue):
+    # Oldest first, the order BRPOP hands them out
+    return [json.loads(message)["job_id"] for message in reversed(r.lrange(queue, 0, -1))]
+
+
+def test_batched_dispatch():
+    """
+    Batched dispatch flushes one transaction per chunk, including the partial last one, sends
+    every profile exactly once and fills the queues like the row-by-row dispatcher
+    """
+    if not HAVE_FAKEREDIS:
+        return
+    import fakeredis
+
+    class CountingRedis(fakeredis.FakeRedis):
+        transactions = 0
+
+        def transaction(self, *args, **kwargs):
+            self.transactions += 1
+            return super().transaction(*args, **kwargs)
+
+    dataset = pd.DataFrame(profiles(0, 25))
+    expected = [profile_job_id(profile) for profile in profiles(0, 25)]
+    queues = ["profiles:queue:1", "profiles:queue:2", "profiles:queue:3"]
+
+    r = CountingRedis()
+    assert dispatch_batched(r, dataset, 3, chunk_size=10, queue_offset=1) == 25
+    assert r.transactions == 3 and r.keys("profiles:queue:0") == []
+    batched = [queued_job_ids(r, queue) for queue in queues]
+    assert [len(job_ids) for job_ids in batched] == [9, 8, 8]
+    assert sorted(sum(batched, [])) == sorted(expected)
+    # Round robin continues across chunk boundaries
+    assert batched[0] == expected[0::3] and batched[1] == expected[1::3] and batched[2] == expected[2::3]
+
+    r = fakeredis.FakeRedis()
+    dispatch_to_redis_queues(r, dataset, 3, queue_offset=1)
+    assert [queued_job_ids(r, queue) for queue in queues] == batched
+
+    assert dispatch_batched(CountingRedis(), dataset, 3, chunk_size=0) == 0
+    print("✓ Batched dispatch")
+
+
+def test_failed_pushes_leave_store_rows_for_reuse():
+    """
+    Store rows of a push that fails are reused when the profiles are sent again; rows of profiles
+    another dispatcher claimed while the push was prepared are listed as orphans on close
+    """
+    if not HAVE_FAKEREDIS:
+        return
+    import fakeredis
+    server = fakeredis.FakeServer()
+    r = fakeredis.FakeRedis(server=server)
+    dedup = RedisSetDedup(r)
+
+    class DisconnectingEncoder(JobEncoder):
+        def encode(self, job_payload):
+            server.connected = False
+            return super().encode(job_payload)
+
+    class RacingEncoder(JobEncoder):
+        # Another dispatcher claims profile 4 while the first attempt is being prepared
+        def encode(self, job_payload):
+            if r.scard(dedup.key) == 3:
+                dedup.add(r, [profile_identity(profiles(4, 5)[0])])
+            return super().encode(job_payload)
+
+    def rows(queue):
+        return sorted(json.loads(message)["profile_ref"]["row"] for message in r.lrange(queue, 0, -1))
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = ProfileStoreWriter(os.path.join(directory, "profiles.store"))
+        assert dispatch_chunks(r, [profiles(0, 3)], 1, dedup=dedup, encoder=DisconnectingEncoder(), store=store) == 0
+        server.connected = True
+        assert store.rows == 3 and r.llen("profiles:queue:0") == 0
+        assert dispatch_chunks(r, [profiles(0, 3)], 1, dedup=dedup, store=store) == 3
+        assert store.rows == 3 and rows("profiles:queue:0") == [0, 1, 2]
+
+        # The WATCHed claims change, so the push is retried without profile 4, whose row is left over
+        assert dispatch_chunks(r, [profiles(3, 5)], 1, queue_prefix="race", dedup=dedup, encoder=RacingEncoder(),
+                               store=store) == 1
+        assert store.rows == 5 and rows("race:queue:0") == [3]
+        store.close()
+        with open(orphans_path(store.path), encoding="utf-8") as f:
+            assert f.read() == "4\n"
+    print("✓ Failed pushes leave store rows for reuse")
+
+
+if __name__ == '__main__':
+    test_dedup_claims_only_pushed_profiles()
+    test_feeder_resumes_after_crash()
+    test_batched_dispatch()
+    test_failed_pushes_leave_store_rows_for_reuse()
@@ -0,0 +1,135 @@
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import endpoint_health
+from endpoint_health import CLOSED, HALF_OPEN, OPEN, PROBE, EndpointHealth
+from prompt import request_completion
+
+
+def unused_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def test_breaker_cycle():
+    """
+    The breaker opens after the threshold, lets exactly one probe through once the cooldown is
+    over, and closes or re-opens (with a longer cooldown) on the probe's outcome
+    """
+    health = EndpointHealth("http://test", failure_threshold=2, cooldown=0.05)
+    assert health.allow_request() is True
+    health.record_failure()
+    health.record_failure()
+    assert health.state == OPEN and not health.is_available()
+
+    time.sleep(0.06)
+    # Checking availability (before taking a job) claims nothing, however often it's done
+    assert all(health.is_available() for _ in range(5))
+    assert health.allow_request() == PROBE and health.state == HALF_OPEN
+    assert not health.allow_request() and not health.is_available()
+    health.record_failure()
+    assert health.state == OPEN and health.current_cooldown == 0.1
+
+    time.sleep(0.11)
+    assert health.allow_request() == PROBE
+    health.record_success()
+    assert health.state == CLOSED and health.current_cooldown == 0.05 and health.allow_request() is True
+    print("✓ Circuit breaker cycle")
+
+
+def test_probe_released_without_answer():
+    """
+    A probe request that ends without an answer gives the slot back, and a failed probe
+    re-opens the breaker, so the endpoint is never stuck half-open
+    """
+    port = unused_port()
+    endpoint_health.configure(failure_threshold=1, cooldown=0.01)
+    health = endpoint_health.get_health(f"http://localhost:{port}")
+
+    # Nothing listens on the port: the first failure opens the breaker
+    assert request_completion("hi", port, "m")[2] is True and health.state == OPEN
+    time.sleep(0.02)
+
+    # The probe's request blows up before it is sent (the prompt can't be serialized)
+    try:
+        request_completion(object(), port, "m")
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("unserializable prompt was sent")
+    assert health.state == HALF_OPEN and not health.probe_in_flight and health.is_available()
+
+    # The next probe reaches the (dead) endpoint and re-opens the breaker
+    assert request_completion("hi", port, "m")[2] is True and health.state == OPEN
+    endpoint_health.configure(failure_threshold=5, cooldown=15.0)
+    print("✓ Unanswered probes release the half-open slot")
+
+
+class SlowModelHandler(BaseHTTPRequestHandler):
+    """
+    Chat completions that take 0.3s
+    """
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(0.3)
+        body = json.dumps({"choices": [{"message": {"content": "reply"}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_requests_follow_the_probe():
+    """
+    Requests that find the half-open probe in flight wait for its outcome instead of being
+    refused: they go through once it closes the breaker, and one of them probes if it was given back
+    """
+    health = EndpointHealth("http://test-wait", failure_threshold=1, cooldown=0.01)
+    health.record_failure()
+    time.sleep(0.02)
+    assert health.allow_request() == PROBE and health.probe_pending()
+    with ThreadPoolExecutor(3) as pool:
+        waiting = [pool.submit(health.wait_for_request) for _ in range(3)]
+        time.sleep(0.05)
+        assert not any(future.done() for future in waiting)
+        health.cancel_probe()
+        # One waiter takes over the probe, the others keep waiting for it
+        time.sleep(0.05)
+        assert [future.result() for future in waiting if future.done()] == [PROBE]
+        health.record_success()
+        results = [future.result() for future in waiting]
+        assert results.count(True) == 2 and results.count(PROBE) == 1
+    assert health.wait_for_request(timeout=0.01) is True
+
+    # Two workers (or two perspectives of a job) reach a recovering endpoint at once
+    server = ThreadingHTTPServer(("localhost", 0), SlowModelHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    endpoint_health.configure(failure_threshold=1, cooldown=0.01)
+    health = endpoint_health.get_health(f"http://localhost:{port}")
+    health.record_failure()
+    time.sleep(0.02)
+    with ThreadPoolExecutor(2) as pool:
+        results = list(pool.map(lambda prompt: request_completion(prompt, port, "m"), ["a", "b"]))
+    assert [result[0] for result in results] == ["reply", "reply"] and not any(result[2] for result in results)
+    assert health.state == CLOSED
+    endpoint_health.configure(failure_threshold=5, cooldown=15.0)
+    server.shutdown()
+    server.server_close()
+    print("✓ Requests follow the half-open probe")
+
+
+if __name__ == '__main__':
+    test_breaker_cycle()
+    test_probe_released_without_answer()
+    test_requests_follow_the_probe()
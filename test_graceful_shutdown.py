@@ -0,0 +1,90 @@
+import importlib.util
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prompt import InFlightJobs, drain_workers, process_queue
+
+HAVE_FAKEREDIS = importlib.util.find_spec("fakeredis") is not None
+QUEUE = "profiles:queue:0"
+
+
+class SlowModelHandler(BaseHTTPRequestHandler):
+    """
+    Chat completions that take 0.5s
+    """
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(0.5)
+        body = json.dumps({"choices": [{"message": {"content": "reply"}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def drain(drain_timeout):
+    """
+    Stop two worker threads while each has a job in flight, with four more jobs queued; returns
+    (saved conversations, threads still busy, job ids in the queue)
+    """
+    import fakeredis
+    server = ThreadingHTTPServer(("localhost", 0), SlowModelHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    r = fakeredis.FakeRedis()
+    for index in range(6):
+        r.lpush(QUEUE, json.dumps({"job_id": f"job-{index}", "profile_data": {"firstName": "A"}}))
+    stop = threading.Event()
+    in_flight = InFlightJobs()
+    with tempfile.TemporaryDirectory() as output_dir:
+        threads = []
+        for index in range(2):
+            thread = threading.Thread(target=process_queue, args=(0, r, port, "m", output_dir),
+                                      kwargs=dict(stop=stop, in_flight=in_flight), daemon=True)
+            thread.start()
+            threads.append(thread)
+            # One at a time, so job-0 is started first
+            while len(in_flight) <= index:
+                time.sleep(0.01)
+
+        busy, returned = drain_workers(threads, stop, in_flight, r, drain_timeout)
+        queued = [json.loads(message)["job_id"] for message in r.lrange(QUEUE, 0, -1)]
+        saved = len(os.listdir(output_dir))
+        assert returned == (2 if busy else 0)
+        for thread in threads:
+            thread.join(5)
+    server.shutdown()
+    server.server_close()
+    return saved, busy, queued
+
+
+def test_drain_on_stop():
+    """
+    Stopped worker threads take no new jobs and finish the ones in flight within the drain
+    timeout; the ones that don't finish in time go back to the head of the queue, in order
+    """
+    if not HAVE_FAKEREDIS:
+        print("- graceful shutdown tests skipped (fakeredis not installed)")
+        return
+    saved, busy, queued = drain(drain_timeout=5)
+    assert saved == 2 and busy == 0 and queued == ["job-5", "job-4", "job-3", "job-2"]
+
+    saved, busy, queued = drain(drain_timeout=0.05)
+    # BRPOP takes from the right: job-0 is next in line again
+    assert saved == 0 and busy == 2
+    assert queued == ["job-5", "job-4", "job-3", "job-2", "job-1", "job-0"]
+    print("✓ Worker threads drain on stop")
+
+
+if __name__ == '__main__':
+    test_drain_on_stop()
@@ -0,0 +1,80 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import http_sessions
+from http_sessions import EndpointSessions
+
+
+class ModelsHandler(BaseHTTPRequestHandler):
+    """
+    Keep-alive /v1/models that remembers the client port of every request
+    """
+    protocol_version = "HTTP/1.1"
+    client_ports = []
+
+    def do_GET(self):
+        self.client_ports.append(self.client_address[1])
+        body = b'{"data": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve():
+    server = ThreadingHTTPServer(("localhost", 0), ModelsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://localhost:{server.server_address[1]}"
+
+
+def test_connections_are_reused():
+    """
+    Requests to an endpoint share one session whose pooled connection is reused, and the reuse
+    counters read from the urllib3 pool agree with what the server saw
+    """
+    server, base_url = serve()
+    sessions = EndpointSessions(pool_size=4, connect_timeout=2.0, read_timeout=7.0)
+    assert sessions.get(base_url) is sessions.get(base_url) and sessions.timeout == (2.0, 7.0)
+    assert sessions.get(base_url).get_adapter(base_url)._pool_maxsize == 4
+
+    ModelsHandler.client_ports = []
+    for _ in range(5):
+        sessions.get(base_url).get(f"{base_url}/v1/models", timeout=sessions.timeout).raise_for_status()
+    assert len(set(ModelsHandler.client_ports)) == 1
+    assert sessions.stats()[base_url] == {"requests": 5, "connections": 1, "reused": 4}
+    sessions.close()
+
+    # Without keep-alive every request opens a new connection
+    closing = EndpointSessions(keep_alive=False)
+    ModelsHandler.client_ports = []
+    for _ in range(3):
+        closing.get(base_url).get(f"{base_url}/v1/models", timeout=closing.timeout).raise_for_status()
+    assert len(set(ModelsHandler.client_ports)) == 3
+    assert closing.stats()[base_url] == {"requests": 3, "connections": 3, "reused": 0}
+    closing.close()
+    server.shutdown()
+    server.server_close()
+    print("✓ Pooled connections reused")
+
+
+def test_shared_registry():
+    """
+    configure() replaces the shared registry that get_session and get_timeout use
+    """
+    try:
+        registry = http_sessions.configure(pool_size=2, connect_timeout=1.0, read_timeout=3.0)
+        assert http_sessions.get_timeout() == (1.0, 3.0)
+        assert http_sessions.get_session("http://localhost:1") is registry.get("http://localhost:1")
+    finally:
+        http_sessions.configure()
+    assert http_sessions.get_timeout() == (5.0, 60.0)
+    print("✓ Shared session registry")
+
+
+if __name__ == '__main__':
+    test_connections_are_reused()
+    test_shared_registry()
@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from dispatcher import build_job_payload, profile_job_id
+from idempotency import output_key, variant_for_job, variants_for_job, LocalCompletionIndex
+from output_sink import ShardedJsonlWriter
+from prompt import save_conversation
+
+
+def load_example_profile():
+    with open("profile_example.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_job_ids_are_stable():
+    """
+    Re-dispatching a profile yields the same job id and therefore the same output key
+    """
+    profile = load_example_profile()
+    first = build_job_payload(profile)["job_id"]
+    assert build_job_payload(profile, compaction={})["job_id"] == first
+    assert profile_job_id(dict(profile, urn="someone-else")) != first
+
+    anonymous = {"headline": "Engineer"}
+    assert profile_job_id(anonymous) == profile_job_id(dict(anonymous))
+
+    variant = variant_for_job(first, 21)
+    assert variant == variant_for_job(first, 21)
+    assert output_key(first, "qwen332b", variant).startswith(f"qwen332b_{first}_p")
+    print("✓ Stable job ids and output keys")
+
+
+def test_perspectives_are_distinct_and_balanced():
+    """
+    A job's perspectives are distinct, and over many jobs every subprompt is used equally often
+    """
+    usage = [0] * 21
+    for index in range(2100):
+        variants = variants_for_job(f"job{index}", 21, count=3)
+        assert len(set(variants)) == 3
+        assert variants[0] == variant_for_job(f"job{index}", 21)
+        for variant in variants:
+            usage[variant] += 1
+    assert min(usage) > 0.8 * 300 and max(usage) < 1.2 * 300
+    assert variants_for_job("job0", 21, count=3, seed=1) != variants_for_job("job0", 21, count=3)
+    assert sorted(variants_for_job("job0", 4, count=10)) == [0, 1, 2, 3]
+    print("✓ Balanced perspective selection")
+
+
+def test_local_index_finds_files_and_shards():
+    """
+    The local index picks up keyed files and shard records already in the output directory
+    """
+    conversation = {"messages": [{"role": "user", "content": "prompt"}]}
+    with tempfile.TemporaryDirectory() as output_dir:
+        save_conversation("m", 1, conversation, output_dir, key="m_job1_p03")
+        sink = ShardedJsonlWriter(output_dir, flush_interval=0)
+        sink.write(dict(id="m_job2_p07", **conversation))
+        sink.close()
+
+        index = LocalCompletionIndex(output_dir)
+        assert index.contains("m_job1_p03")
+        assert index.contains("m_job2_p07")
+        assert not index.contains("m_job3_p00")
+        index.add("m_job3_p00")
+        assert index.contains("m_job3_p00")
+        print("✓ Local completion index")
+
+
+def test_concurrent_saves_of_one_key():
+    """
+    Threads saving the same output key at once each publish a complete file and leave no
+    temporary files behind
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        def save(index):
+            conversation = {"messages": [{"role": "user", "content": chr(ord("a") + index) * 100000}]}
+            return save_conversation("m", index, conversation, output_dir, key="m_job1_p03")
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            paths = list(pool.map(save, range(32)))
+        assert all(paths)
+        assert os.listdir(output_dir) == ["m_job1_p03.json"]
+        with open(paths[0], encoding="utf-8") as f:
+            content = json.load(f)["messages"][0]["content"]
+        assert content == content[0] * 100000
+        print("✓ Concurrent saves of one output key")
+
+
+if __name__ == '__main__':
+    test_job_ids_are_stable()
+    test_perspectives_are_distinct_and_balanced()
+    test_local_index_finds_files_and_shards()
+    test_concurrent_saves_of_one_key()
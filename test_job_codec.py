@@ -0,0 +1,65 @@
+import importlib.util
+import json
+
+from dispatcher import build_job_payload
+from job_codec import JobEncoder, JobDecoder, JobDecodeError, synthetic_jobs, train_dictionary
+
+HAVE_CODECS = all(importlib.util.find_spec(module) for module in ("msgpack", "zstandard"))
+
+
+def load_example_profile():
+    with open("profile_example.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_json_jobs_still_decode():
+    """
+    JSON messages, as text or as the bytes Redis returns, decode unchanged
+    """
+    job = build_job_payload(load_example_profile())
+    message = JobEncoder().encode(job)
+    assert message == json.dumps(job, default=str)
+    decoder = JobDecoder()
+    assert decoder.decode(message) == job
+    assert decoder.decode(message.encode('utf-8')) == job
+    print("✓ JSON jobs decode")
+
+
+def test_binary_codecs_round_trip():
+    """
+    Every binary codec round-trips and is smaller than JSON; bad headers are rejected
+    """
+    if not HAVE_CODECS:
+        print("- binary codecs skipped (msgpack/zstandard not installed)")
+        return
+
+    template = load_example_profile()
+    jobs = synthetic_jobs(template, 20)
+    dictionary = train_dictionary(synthetic_jobs(template, 300, seed=1), dict_size=16 * 1024)
+    decoder = JobDecoder()
+    decoder.add_dictionary(dictionary)
+
+    json_size = len(JobEncoder().encode(jobs[0]).encode('utf-8'))
+    sizes = {}
+    for codec in ("msgpack", "zstd", "zstd-dict"):
+        encoder = JobEncoder(codec, dictionary)
+        message = encoder.encode(jobs[0])
+        assert message[:3] == bytes([0, 1, {"msgpack": 1, "zstd": 2, "zstd-dict": 3}[codec]])
+        assert decoder.decode(message) == jobs[0]
+        sizes[codec] = len(message)
+    assert json_size > sizes["msgpack"] > sizes["zstd"] > sizes["zstd-dict"]
+
+    # A dictionary the worker has never seen, a future header version and garbage are all errors
+    for message in (JobEncoder("zstd-dict", dictionary).encode(jobs[1]), b"\x00\x09\x01", b"\x00\x01\x02junk"):
+        try:
+            JobDecoder().decode(message)
+        except JobDecodeError:
+            continue
+        raise AssertionError(f"{message[:8]!r} decoded")
+    print(f"✓ Binary codecs: {json_size} bytes as JSON, " +
+          ", ".join(f"{size} as {codec}" for codec, size in sizes.items()))
+
+
+if __name__ == '__main__':
+    test_json_jobs_still_decode()
+    test_binary_codecs_round_trip()
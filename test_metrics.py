@@ -0,0 +1,56 @@
+import metrics
+
+
+def test_text_format():
+    """
+    Counters, gauges and histograms render in the Prometheus text format
+    """
+    counter = metrics.Counter("test_jobs_total", "Jobs", ["queue"])
+    counter.inc(queue="profiles:queue:0")
+    counter.inc(2, queue="profiles:queue:0")
+    assert counter.value(queue="profiles:queue:0") == 3
+    assert 'test_jobs_total{queue="profiles:queue:0"} 3' in counter.render()
+
+    try:
+        counter.inc(model="m")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("wrong labels were accepted")
+
+    gauge = metrics.Gauge("test_in_flight", "In flight", ["endpoint"])
+    gauge.inc(endpoint="localhost:8000")
+    gauge.inc(endpoint="localhost:8000")
+    gauge.dec(endpoint="localhost:8000")
+    assert "# TYPE test_in_flight gauge" in gauge.render()
+    assert 'test_in_flight{endpoint="localhost:8000"} 1' in gauge.render()
+
+    histogram = metrics.Histogram("test_latency_seconds", "Latency", ["model"], buckets=(1, 10))
+    for seconds in (0.5, 3, 30):
+        histogram.observe(seconds, model='say "hi"')
+    lines = histogram.render().splitlines()
+    assert 'test_latency_seconds_bucket{model="say \\"hi\\"",le="1"} 1' in lines
+    assert 'test_latency_seconds_bucket{model="say \\"hi\\"",le="10"} 2' in lines
+    assert 'test_latency_seconds_bucket{model="say \\"hi\\"",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_sum{model="say \\"hi\\""} 33.5' in lines
+    print("✓ Prometheus text format")
+
+
+def test_usage_tokens():
+    """
+    Token counts come from the completion's usage block, which may be missing
+    """
+    before = metrics.TOKENS.value(model="test-model", kind="completion")
+    metrics.record_request("localhost:8000", "test-model", 1.5, "ok",
+                           {"usage": {"prompt_tokens": 900, "completion_tokens": 300}})
+    metrics.record_request("localhost:8000", "test-model", 0.1, "ok", {"choices": []})
+    metrics.record_request("localhost:8000", "test-model", 0.1, "503")
+    assert metrics.TOKENS.value(model="test-model", kind="completion") == before + 300
+    assert metrics.REQUESTS.value(endpoint="localhost:8000", model="test-model", outcome="503") == 1
+    assert "profilegen_tokens_total" in metrics.render()
+    print("✓ Usage tokens counted")
+
+
+if __name__ == '__main__':
+    test_text_format()
+    test_usage_tokens()
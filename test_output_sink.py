@@ -0,0 +1,69 @@
+import os
+import tempfile
+
+from output_sink import ShardedJsonlWriter, shard_files, iter_conversations
+
+
+def conversation(index):
+    return {"messages": [{"role": "user", "content": f"prompt {index}"},
+                         {"role": "assistant", "content": {"confidence_score": index}}]}
+
+
+def test_rotation_by_record_count():
+    """
+    Shards rotate after max_records conversations and read back in order
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        sink = ShardedJsonlWriter(output_dir, max_records=4, buffer_size=3, flush_interval=0)
+        for index in range(10):
+            sink.write(conversation(index))
+        sink.close()
+
+        assert len(shard_files(output_dir)) == 3
+        scores = [record["messages"][1]["content"]["confidence_score"] for record in iter_conversations(output_dir)]
+        assert scores == list(range(10))
+        print("✓ 10 conversations rotated into 3 shards")
+
+
+def test_gzip_shards_and_flush_callbacks():
+    """
+    Every flush appends a gzip member; callbacks run only once their records are on disk
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        acked = []
+        sink = ShardedJsonlWriter(output_dir, compression="gzip", buffer_size=100, flush_interval=0)
+        for index in range(5):
+            sink.write(conversation(index), on_flush=lambda index=index: acked.append(index))
+            if index == 2:
+                assert acked == []
+                sink.flush()
+                assert acked == [0, 1, 2]
+        sink.close()
+
+        assert acked == [0, 1, 2, 3, 4]
+        [shard] = shard_files(output_dir)
+        assert shard.endswith(".jsonl.gz")
+        assert len(list(iter_conversations(shard))) == 5
+        print("✓ Multi-member gzip shard readable; callbacks after flush")
+
+
+def test_truncated_line_is_skipped():
+    """
+    A record cut off by a crash mid-write doesn't stop the reader
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        sink = ShardedJsonlWriter(output_dir, flush_interval=0)
+        sink.write(conversation(1))
+        sink.close()
+        with open(shard_files(output_dir)[0], 'a', encoding='utf-8') as f:
+            f.write('{"messages": [{"role": "us')
+
+        assert len(list(iter_conversations(output_dir))) == 1
+        assert os.listdir(output_dir)[0].startswith("conversations-")
+        print("✓ Truncated record skipped")
+
+
+if __name__ == '__main__':
+    test_rotation_by_record_count()
+    test_gzip_shards_and_flush_callbacks()
+    test_truncated_line_is_skipped()
@@ -0,0 +1,78 @@
+import json
+
+from profile_compaction import compact_profile, serialize_profile, compaction_report, format_report
+from prompt import buildprompt, prompt_for_job, subprompts
+from dispatcher import build_job_payload
+
+
+def load_example_profile():
+    with open("profile_example.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_denylist_and_empties():
+    """
+    Images, identifiers and null/empty fields are dropped at every depth
+    """
+    compacted = compact_profile(load_example_profile())
+
+    assert "urn" not in compacted
+    assert "profilePicture" not in compacted
+    assert "backgroundImage" not in compacted
+    assert "skills" not in compacted  # null in the example
+    assert all("companyLogo" not in position for position in compacted["position"])
+    assert all("description" not in position for position in compacted["position"])  # empty string
+    assert compacted["headline"] == "Co-chair, Bill & Melinda Gates Foundation"
+    print("✓ Denylisted and empty fields removed")
+
+
+def test_allowlist_and_truncation():
+    """
+    Only allowlisted top-level fields survive and long lists are cut
+    """
+    profile = load_example_profile()
+    compacted = compact_profile(profile, allowlist=["headline", "position"], max_list_items=1)
+
+    assert set(compacted) == {"headline", "position"}
+    assert len(compacted["position"]) == 1
+    assert compacted["position"][0]["title"] == profile["position"][0]["title"]
+    print("✓ Allowlist and list truncation applied")
+
+
+def test_compact_prompt_is_smaller():
+    """
+    The compact prompt is much shorter than the legacy indented one
+    """
+    profile = load_example_profile()
+    legacy = buildprompt(subprompts[0], json.dumps(profile, indent=2))
+    compact = buildprompt(subprompts[0], json.dumps(profile, indent=2), compaction={})
+
+    compacted_text = serialize_profile(profile)
+    assert compacted_text in compact
+    assert len(compact) < len(legacy) / 2
+
+    report = compaction_report(profile, compacted_text)
+    assert report["tokens_after"] < report["tokens_before"]
+    print(f"✓ Compact prompt: {format_report(report)}")
+
+
+def test_spliced_profile_text_matches_buildprompt():
+    """
+    A job dispatched with compacted profile_text yields the same prompt as compacting in the worker
+    """
+    profile = load_example_profile()
+    message = json.dumps(build_job_payload(profile, compaction={}))
+
+    spliced = prompt_for_job(subprompts[3], json.loads(message))
+    assert spliced == buildprompt(subprompts[3], profile, compaction={})
+
+    legacy_message = json.dumps(build_job_payload(profile))
+    assert prompt_for_job(subprompts[3], json.loads(legacy_message)) == buildprompt(subprompts[3], profile)
+    print("✓ Spliced prompt matches buildprompt")
+
+
+if __name__ == '__main__':
+    test_denylist_and_empties()
+    test_allowlist_and_truncation()
+    test_compact_prompt_is_smaller()
+    test_spliced_profile_text_matches_buildprompt()
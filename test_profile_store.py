@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+
+from dispatcher import build_job_payload
+from job_codec import JobEncoder, JobDecoder, JobDecodeError
+from profile_store import ProfileStore, ProfileStoreWriter, index_path
+
+
+def load_example_profile():
+    with open("profile_example.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_claim_check_round_trip():
+    """
+    Jobs carry only a reference; the decoder puts the stored profile back, even for rows
+    appended after the store was first mapped
+    """
+    profile = load_example_profile()
+    with tempfile.TemporaryDirectory() as directory:
+        writer = ProfileStoreWriter(os.path.join(directory, "profiles.store"))
+        decoder = JobDecoder()
+        messages = []
+        for index in range(3):
+            job = build_job_payload(dict(profile, username=f"user-{index}"), store=writer)
+            assert "profile_data" not in job and job["profile_ref"]["row"] == index
+            writer.flush()
+            message = JobEncoder().encode(job)
+            assert len(message) < 200
+            messages.append(message)
+            decoded = decoder.decode(message)
+            assert decoded["job_id"] == job["job_id"] and "profile_ref" not in decoded
+            assert decoded["profile_data"]["username"] == f"user-{index}"
+
+        # A JSON store doubles as a .jsonl dataset
+        with open(writer.path, encoding="utf-8") as f:
+            assert [json.loads(line)["username"] for line in f] == ["user-0", "user-1", "user-2"]
+
+        # Compacted text can't go into a JSON store, and references to missing rows are errors
+        try:
+            ProfileStoreWriter(writer.path, "text")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("opened a JSON store for text")
+        bad = json.dumps({"job_id": "x", "profile_ref": {"store": writer.path, "row": 7}})
+        try:
+            decoder.decode(bad)
+        except JobDecodeError:
+            pass
+        else:
+            raise AssertionError("resolved a missing row")
+        writer.close()
+    print(f"✓ Claim-check jobs: {len(messages[0])} bytes per message")
+
+
+def test_torn_tail_is_dropped():
+    """
+    Reopening a store after a crash keeps only rows whose records are complete
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "profiles.store")
+        writer = ProfileStoreWriter(path, "text")
+        for index in range(3):
+            writer.append(f"profile {index}\nwith two lines")
+        writer.close()
+        # The last record only half reached the disk
+        os.truncate(path, os.path.getsize(path) - 5)
+
+        writer = ProfileStoreWriter(path, "text")
+        assert writer.rows == 2
+        writer.append("profile 3")
+        writer.close()
+        store = ProfileStore(path)
+        assert [store.text(row) for row in range(len(store))] == ["profile 0\nwith two lines",
+                                                                 "profile 1\nwith two lines", "profile 3"]
+        assert os.path.getsize(index_path(path)) == 16 + 3 * 8
+    print("✓ Torn store tail dropped")
+
+
+if __name__ == '__main__':
+    test_claim_check_round_trip()
+    test_torn_tail_is_dropped()
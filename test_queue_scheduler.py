@@ -0,0 +1,54 @@
+from queue_scheduler import parse_queue_weights, WeightedQueueScheduler
+
+
+def test_weighted_shares():
+    """
+    With every queue busy, picks follow the weights and are interleaved
+    """
+    assert parse_queue_weights("urgent=3, profiles") == [("urgent", 3.0), ("profiles", 1.0)]
+    for bad in ("urgent=0", "urgent=x", "a=1,a=2"):
+        try:
+            parse_queue_weights(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad} was accepted")
+
+    scheduler = WeightedQueueScheduler([("urgent:queue:0", 3), ("profiles:queue:0", 1)], max_wait=1e9)
+    picks = []
+    for _ in range(8):
+        queue_name = scheduler.ranking(now=0)[0]
+        scheduler.served(queue_name, now=0)
+        picks.append(queue_name.split(":")[0])
+    assert picks.count("urgent") == 6 and picks.count("profiles") == 2
+    assert "urgent urgent urgent urgent" not in " ".join(picks)
+    print(f"✓ Weighted shares: {' '.join(picks)}")
+
+
+def test_starvation_protection():
+    """
+    A queue left unserved for max_wait seconds goes first, whatever its weight
+    """
+    scheduler = WeightedQueueScheduler([("urgent:queue:0", 1000), ("profiles:queue:0", 1)], max_wait=30)
+    scheduler.last_served = {"urgent:queue:0": 100, "profiles:queue:0": 100}
+    scheduler.served("urgent:queue:0", now=120)
+    assert scheduler.ranking(now=125)[0] == "urgent:queue:0"
+    assert scheduler.ranking(now=131)[0] == "profiles:queue:0"
+    scheduler.served("profiles:queue:0", now=131)
+    assert scheduler.ranking(now=132)[0] == "urgent:queue:0"
+
+    # An idle queue's credit is capped, so it can't hog the workers once it fills up
+    scheduler = WeightedQueueScheduler([("urgent:queue:0", 1), ("profiles:queue:0", 1)], max_wait=1e9)
+    for _ in range(100):
+        scheduler.served("profiles:queue:0", now=0)
+    picks = []
+    for _ in range(6):
+        queue_name = scheduler.ranking(now=0)[0]
+        scheduler.served(queue_name, now=0)
+        picks.append(queue_name)
+    assert picks.count("profiles:queue:0") >= 2
+    print("✓ Starvation protection")
+
+
+if __name__ == '__main__':
+    test_weighted_shares()
+    test_starvation_protection()
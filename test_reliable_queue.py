@@ -0,0 +1,106 @@
+import importlib.util
+import time
+
+import reliable_queue
+from dispatcher import build_job_payload
+from reliable_queue import (ack_job, claim_field, claim_job, dead_letter_name, processing_list_name,
+                            reap_expired, release_job, requeue_claims)
+
+HAVE_FAKEREDIS = importlib.util.find_spec("fakeredis") is not None
+QUEUE = "profiles:queue:0"
+
+
+def fake_redis():
+    import fakeredis
+    return fakeredis.FakeRedis()
+
+
+def test_claim_ack_release():
+    """
+    A claimed job is acked once, requeued on failure and dead-lettered after max_attempts
+    """
+    if not HAVE_FAKEREDIS:
+        print("- reliable queue tests skipped (fakeredis not installed)")
+        return
+    r = fake_redis()
+    processing = processing_list_name(QUEUE, "host-1")
+    r.lpush(QUEUE, "job-a", "job-b")
+
+    assert claim_job(r, QUEUE, processing, timeout=None) == b"job-a"
+    assert r.lrange(processing, 0, -1) == [b"job-a"]
+    assert ack_job(r, QUEUE, processing, b"job-a") and not ack_job(r, QUEUE, processing, b"job-a")
+    assert not r.exists(processing) and not r.hlen(f"{QUEUE}:claimed_at")
+
+    for attempt in range(1, 3):
+        assert claim_job(r, QUEUE, processing, timeout=None) == b"job-b"
+        assert release_job(r, QUEUE, processing, b"job-b", max_attempts=3) == "requeued"
+        assert r.hget(f"{QUEUE}:attempts", reliable_queue.job_digest(b"job-b")) == str(attempt).encode()
+    claim_job(r, QUEUE, processing, timeout=None)
+    assert release_job(r, QUEUE, processing, b"job-b", max_attempts=3) == "dead"
+    assert r.lrange(dead_letter_name(QUEUE), 0, -1) == [b"job-b"] and not r.hlen(f"{QUEUE}:attempts")
+    # A job that is no longer claimed is left alone
+    assert release_job(r, QUEUE, processing, b"job-b") is None
+    assert r.llen(QUEUE) == 0
+    print("✓ Claim, ack, release and dead-letter")
+
+
+def test_front_release_and_reaper():
+    """
+    Uncharged releases go to the head of the queue; expired and orphaned claims are recovered
+    """
+    if not HAVE_FAKEREDIS:
+        return
+    r = fake_redis()
+    r.lpush(QUEUE, "job-a", "job-b", "job-c")
+    processing = processing_list_name(QUEUE, "host-1")
+    claim_job(r, QUEUE, processing, timeout=None)
+    assert release_job(r, QUEUE, processing, b"job-a", front=True, count_attempt=False) == "requeued"
+    assert r.lindex(QUEUE, -1) == b"job-a" and not r.hlen(f"{QUEUE}:attempts")
+
+    # One claim has expired, one is fresh
+    claim_job(r, QUEUE, processing, timeout=None)
+    claim_job(r, QUEUE, processing, timeout=None)
+    r.hset(f"{QUEUE}:claimed_at", claim_field(processing, b"job-a"), time.time() - 1000)
+    assert reap_expired(r, "profiles", visibility_timeout=300) == (1, 0)
+    assert r.lrange(processing, 0, -1) == [b"job-b"]
+
+    # Jobs of an exited worker (and of its threads) go back right away
+    thread_list = processing_list_name(QUEUE, "host-1-0")
+    claim_job(r, QUEUE, thread_list, timeout=None)
+    other = processing_list_name(QUEUE, "host-12")
+    claim_job(r, QUEUE, other, timeout=None)
+    assert requeue_claims(r, "host-1") == 2
+    assert r.llen(processing) == 0 and r.llen(thread_list) == 0 and r.llen(other) == 1
+    print("✓ Front releases, reaper and exited-worker requeue")
+
+
+def test_identical_copies_keep_their_claims():
+    """
+    Acking one of two byte-identical jobs claimed by different workers leaves the other's claim
+    time, so the reaper still recovers it; dispatched copies of a profile are never identical
+    """
+    if not HAVE_FAKEREDIS:
+        return
+    r = fake_redis()
+    r.lpush(QUEUE, "job-a", "job-a")
+    first = processing_list_name(QUEUE, "host-1")
+    second = processing_list_name(QUEUE, "host-2")
+    assert claim_job(r, QUEUE, first, timeout=None) == claim_job(r, QUEUE, second, timeout=None) == b"job-a"
+    assert r.hlen(f"{QUEUE}:claimed_at") == 2
+
+    assert ack_job(r, QUEUE, first, b"job-a")
+    assert r.hexists(f"{QUEUE}:claimed_at", claim_field(second, b"job-a"))
+    r.hset(f"{QUEUE}:claimed_at", claim_field(second, b"job-a"), time.time() - 1000)
+    assert reap_expired(r, "profiles", visibility_timeout=300) == (1, 0)
+    assert r.lrange(QUEUE, 0, -1) == [b"job-a"] and not r.hlen(f"{QUEUE}:claimed_at")
+
+    profile = {"urn": "urn:li:member:1"}
+    copies = [build_job_payload(profile) for _ in range(2)]
+    assert copies[0]["job_id"] == copies[1]["job_id"] and copies[0] != copies[1]
+    print("✓ Identical copies keep their own claims")
+
+
+if __name__ == '__main__':
+    test_claim_ack_release()
+    test_front_release_and_reaper()
+    test_identical_copies_keep_their_claims()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+
+from prompt import build_chat_payload
+from response_cache import cache_key, SqliteResponseCache
+
+
+def test_key_covers_model_and_prompt():
+    """
+    Keys differ by model and prompt and don't depend on dict ordering
+    """
+    payload = build_chat_payload("Analyze this profile", "qwen3:32b")
+    assert cache_key(payload) == cache_key(dict(reversed(list(payload.items()))))
+    assert cache_key(payload) != cache_key(build_chat_payload("Analyze this profile", "gemma3:27b"))
+    assert cache_key(payload) != cache_key(build_chat_payload("Analyze this profile!", "qwen3:32b"))
+    assert cache_key(payload) != cache_key(dict(payload, temperature=0.0))
+    print("✓ Cache keys cover model, sampling parameters and prompt")
+
+
+def test_sqlite_lru_eviction_and_stats():
+    """
+    The least recently used reply is evicted first and lookups are counted
+    """
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = SqliteResponseCache(os.path.join(cache_dir, "cache.sqlite"), max_entries=2)
+        cache.put("a", "m", "reply a")
+        cache.put("b", "m", "reply b")
+        assert cache.get("a") == "reply a"  # a is now more recent than b
+        cache.put("c", "m", "reply c")
+
+        assert cache.get("b") is None
+        assert cache.get("a") == "reply a"
+        assert cache.get("c") == "reply c"
+        assert len(cache) == 2
+        assert (cache.stats.hits, cache.stats.misses, cache.stats.evictions) == (3, 1, 1)
+        cache.close()
+
+        # Replies survive a restart
+        reopened = SqliteResponseCache(os.path.join(cache_dir, "cache.sqlite"), max_entries=2)
+        assert reopened.get("c") == "reply c"
+        reopened.close()
+        print(f"✓ SQLite LRU cache: {cache.stats.format()}")
+
+
+def test_sqlite_evicts_in_batches():
+    """
+    A full cache evicts a batch of its oldest replies at once and never grows past max_entries,
+    also when another process shares the database
+    """
+    with tempfile.TemporaryDirectory() as cache_dir:
+        path = os.path.join(cache_dir, "cache.sqlite")
+        cache = SqliteResponseCache(path, max_entries=500)
+        other = SqliteResponseCache(path, max_entries=500)
+        for i in range(1000):
+            (cache if i % 2 else other).put(f"key{i}", "m", "reply")
+            # Each process may store one batch (5 replies) before it counts again
+            assert len(cache) <= 500 + 2 * 6
+        assert cache.get("key999") == "reply" and cache.get("key0") is None
+        evictions = cache.stats.evictions + other.stats.evictions
+        assert evictions == 1000 - len(cache) and evictions >= 500
+        cache.close()
+        other.close()
+        print(f"✓ Batched eviction: {evictions} evicted")
+
+
+if __name__ == '__main__':
+    test_key_covers_model_and_prompt()
+    test_sqlite_lru_eviction_and_stats()
+    test_sqlite_evicts_in_batches()
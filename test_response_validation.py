@@ -0,0 +1,114 @@
+import json
+
+import prompt_templates
+from prompt import build_chat_payload
+from prompt_templates import RESPONSE_JSON_SCHEMA
+from response_validation import parse_reply, check_schema, ResponseValidator
+
+
+def valid_analysis():
+    return {
+        "personality_traits": ["Visionary", "Driven", "Analytical", "Generous", "Curious"],
+        "communication_style": "Analytical",
+        "vibe_category": "Leader",
+        "confidence_score": 85,
+        "key_strength": "Strong strategic thinking",
+        "growth_area": "More collaborative leadership",
+        "radar_data": [{"trait": trait, "score": 80} for trait in
+                       ["Leadership", "Innovation", "Empathy", "Analytics", "Communication"]]
+    }
+
+
+def test_reply_cleanup():
+    """
+    Reasoning blocks, markdown fences, prose and trailing commas don't prevent parsing
+    """
+    text = json.dumps(valid_analysis(), indent=2)
+    wrapped = f"<think>\nThe user wants {{JSON}}.\n</think>\n\nHere you go:\n```json\n{text}\n```\nHope this helps!"
+    analysis, error = parse_reply(wrapped)
+    assert error is None and analysis == valid_analysis()
+
+    analysis, error = parse_reply(text.replace('"Curious"', '"Curious",'))
+    assert error is None and analysis["personality_traits"][-1] == "Curious"
+
+    assert parse_reply("<think>\nStill thinking about {the profile")[0] is None
+    assert parse_reply('{"personality_traits": [')[0] is None
+    print("✓ Replies cleaned up and parsed")
+
+
+def test_schema_repair_and_rejection():
+    """
+    Fixable deviations are repaired; missing fields and unknown enum values are errors
+    """
+    analysis = valid_analysis()
+    analysis["communication_style"] = "analytical"
+    analysis["radar_data"][0]["score"] = 120
+    analysis["personality_traits"].append("Extra")
+    errors, repairs = check_schema(analysis)
+    assert errors == [] and len(repairs) == 3
+    assert analysis["communication_style"] == "Analytical"
+    assert analysis["radar_data"][0]["score"] == 100
+    assert len(analysis["personality_traits"]) == 5
+
+    strict = valid_analysis()
+    strict["radar_data"][1]["score"] = -5
+    assert check_schema(strict, repair=False)[0] == ["radar_data score for Innovation -5 is outside 0-100"]
+
+    broken = valid_analysis()
+    broken["vibe_category"] = "Wizard"
+    del broken["growth_area"]
+    errors, _ = check_schema(broken)
+    assert [error.split(" ", 1)[0] for error in errors] == ["vibe_category", "growth_area"]
+
+    # Non-finite scores are errors, not something to clamp
+    analysis, _ = parse_reply(json.dumps(valid_analysis()).replace("85", "NaN").replace("80", "Infinity", 1))
+    errors, _ = check_schema(analysis)
+    assert errors == ["confidence_score is not a number", "radar_data score for Leadership is not a number"]
+    print("✓ Schema repaired or rejected")
+
+
+def test_validator_stats():
+    """
+    The validator returns normalized JSON and counts outcomes per model
+    """
+    validator = ResponseValidator()
+    reply = validator.check("qwen332b", "```json\n" + json.dumps(valid_analysis()) + "\n```")
+    assert json.loads(reply) == valid_analysis()
+    assert validator.check("qwen332b", "I cannot analyze this profile.") is None
+    assert validator.stats._counts["qwen332b"] == {"valid": 1, "repaired": 0, "invalid": 1}
+    validator.stats.print_stats()
+    print("✓ Validity stats recorded")
+
+
+def test_guided_decoding_payload():
+    """
+    Guided decoding sends the schema the validator checks and a schema-sized max_tokens
+    """
+    assert set(RESPONSE_JSON_SCHEMA["required"]) == set(valid_analysis())
+    properties = RESPONSE_JSON_SCHEMA["properties"]
+    assert valid_analysis()["communication_style"] in properties["communication_style"]["enum"]
+
+    try:
+        prompt_templates.configure_decoding("guided_json")
+        payload = build_chat_payload("prompt", "m")
+        assert payload["guided_json"] is RESPONSE_JSON_SCHEMA
+        assert 0 < payload["max_tokens"] < 1000
+
+        prompt_templates.configure_decoding("ollama", max_tokens=512)
+        payload = build_chat_payload("prompt", "m")
+        assert payload["format"] is RESPONSE_JSON_SCHEMA
+        assert payload["response_format"]["json_schema"]["schema"] is RESPONSE_JSON_SCHEMA
+        assert payload["max_tokens"] == 512
+    finally:
+        prompt_templates.configure_decoding()
+
+    assert build_chat_payload("prompt", "m") == {"model": "m", "messages": [{"role": "user", "content": "prompt"}],
+                                                 "temperature": 0.7, "max_tokens": 3000}
+    print("✓ Guided decoding payloads")
+
+
+if __name__ == '__main__':
+    test_reply_cleanup()
+    test_schema_repair_and_rejection()
+    test_validator_stats()
+    test_guided_decoding_payload()
@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+
+from router import EWMA_ALPHA, Endpoint, Router, load_registry
+
+# Ports nothing listens on, so the shared endpoint health registry starts out clean for them
+PORTS = (59101, 59102, 59103)
+
+
+def open_breaker(endpoint):
+    while endpoint.health.is_available():
+        endpoint.health.record_failure()
+
+
+def test_registry_formats():
+    """
+    Endpoints load from the JSON registry and from the models.md table, whose checkpoint column
+    is the served model name
+    """
+    endpoints = load_registry("endpoints_example.json")
+    assert len(endpoints) == 8 and endpoints[0].port == 8000 and endpoints[0].model == "meta-llama/Llama-2-13b-chat-hf"
+
+    markdown = load_registry("models.md")
+    assert [(e.port, e.model) for e in markdown] == [(e.port, e.model) for e in endpoints]
+    assert all(endpoint.weight == 1.0 for endpoint in markdown)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "endpoints.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([{"port": "9000", "model": "m", "weight": 2}, {"port": 9001, "model": "m"}], f)
+        weighted, default = load_registry(path)
+    assert (weighted.port, weighted.weight, default.weight) == (9000, 2.0, 1.0)
+    print("✓ Registries from JSON and models.md")
+
+
+def test_least_loaded_choice():
+    """
+    Jobs go to the compatible endpoint with the lowest expected wait, in-flight requests are
+    counted until released, latencies update an EWMA, and unavailable endpoints are skipped
+    """
+    fast, slow, other = Endpoint(PORTS[0], "m"), Endpoint(PORTS[1], "m", weight=2.0), Endpoint(PORTS[2], "x")
+    router = Router([fast, slow, other])
+
+    # Unmeasured endpoints look average (1s): the weight-2 one wins, then the load spreads out
+    assert router.acquire("m") is slow and router.acquire("m") is fast
+    assert (fast.in_flight, slow.in_flight, other.in_flight) == (1, 1, 0)
+    router.release(fast, 0.1)
+    router.release(slow, 2.0)
+    assert router.acquire("m") is fast
+    router.release(fast, 0.2)
+    assert (fast.in_flight, slow.in_flight, fast.completed, slow.completed) == (0, 0, 2, 1)
+    assert abs(fast.ewma_latency - (EWMA_ALPHA * 0.2 + (1 - EWMA_ALPHA) * 0.1)) < 1e-9
+
+    # (n + 1) * 0.12s stays below slow's 2s / 2 for the first 8 requests in flight
+    picks = [router.acquire("m") for _ in range(9)]
+    assert picks[:8] == [fast] * 8 and picks[8] is slow
+    assert (fast.in_flight, slow.in_flight) == (8, 1)
+    for endpoint in picks:
+        # Released without a measurement (failed or cancelled requests)
+        router.release(endpoint)
+    assert fast.in_flight == slow.in_flight == 0 and fast.completed == 2
+
+    # Only endpoints of the requested model, and only while their breaker lets requests through
+    assert router.acquire("x") is other
+    router.release(other)
+    open_breaker(other)
+    assert router.acquire("x") is None and not router.any_available("x")
+    open_breaker(fast)
+    assert router.acquire("m") is slow and router.acquire(None) is slow
+    assert other.in_flight == 0 and fast.in_flight == 0
+    print("✓ Least-loaded routing")
+
+
+if __name__ == '__main__':
+    test_registry_formats()
+    test_least_loaded_choice()
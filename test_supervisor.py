@@ -0,0 +1,62 @@
+import os
+import tempfile
+import threading
+import time
+
+from supervisor import Supervisor, expand_workers, restart_delay
+
+
+def test_expand_workers():
+    """
+    Replicas get their own queue offset and {replica} options; extra args go to every worker
+    """
+    config = {
+        "defaults": {"reliable": True, "start-port": 8000, "skip-completed": None},
+        "workers": [
+            {"name": "generator", "replicas": 2, "advance": ["queue-offset", "start-port"],
+             "options": {"num-queues": 4, "queue-offset": 0, "output-dir": "../output{replica}"}},
+            {"script": "dispatcher.py", "options": {"feed": True, "reliable": False}},
+        ],
+    }
+    workers = expand_workers(config, ["--model", "m"])
+    assert [name for name, _, _ in workers] == ["generator1", "generator2", "worker2"]
+    second = workers[1][2]
+    assert second[2:] == ["prompt.py", "--reliable", "--start-port", "8004", "--num-queues", "4",
+                          "--queue-offset", "4", "--output-dir", "../output2", "--model", "m"]
+    assert workers[2][2][2:] == ["dispatcher.py", "--start-port", "8000", "--feed"]
+    assert [restart_delay(failures, 1, 60) for failures in (1, 2, 3, 8)] == [1, 2, 4, 60]
+    print("✓ Worker command lines")
+
+
+def test_restart_and_drain():
+    """
+    A crashing worker is restarted with backoff; on stop, workers get SIGTERM and are killed
+    once the drain timeout has passed
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        crash = os.path.join(directory, "crash.py")
+        with open(crash, "w") as f:
+            f.write("import sys; sys.exit(3)\n")
+        stubborn = os.path.join(directory, "stubborn.py")
+        with open(stubborn, "w") as f:
+            f.write("import signal, time\nsignal.signal(signal.SIGTERM, signal.SIG_IGN)\ntime.sleep(60)\n")
+
+        workers = expand_workers({"workers": [{"name": "crash", "script": crash},
+                                              {"name": "stubborn", "script": stubborn}]})
+        supervisor = Supervisor(workers, drain_timeout=0.5, base_delay=0.1, max_delay=0.4)
+        runner = threading.Thread(target=supervisor.run)
+        runner.start()
+        time.sleep(3)
+        supervisor.request_stop()
+        started = time.monotonic()
+        runner.join(10)
+        assert not runner.is_alive() and time.monotonic() - started < 5
+        assert 2 <= supervisor.restarts <= 8
+        assert all(not worker.running() for worker in supervisor.workers)
+        assert supervisor.workers[1].process.returncode < 0
+    print(f"✓ Restarted a crashing worker {supervisor.restarts} times, killed a stuck one after the drain timeout")
+
+
+if __name__ == '__main__':
+    test_expand_workers()
+    test_restart_and_drain()